@@ -0,0 +1,135 @@
+'''
+Peak memory per call in flight, streaming form body vs the payload dict urlencoded by aiohttp,
+against the local stand-in of the Baidu ocr api (benchmarks/stub_server.py). Every image is sent as it is
+(see BaseOcrService.PASSTHROUGH_FORMATS), so only the request body differs between the modes.
+Every mode runs in a fresh process: the growth of its peak RSS over the baseline is divided by the calls in flight.
+
+    stream  BaseOcrService.STREAM_BODY = True, the image is base64 encoded and escaped chunk by chunk
+    dict    BaseOcrService.STREAM_BODY = False
+
+    python benchmarks/bench_formbody.py --images 32 --size 1400x1400 --latency const:1
+'''
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_server import BaiduStubServer
+from bench_ocr import StubOcrService
+
+MODES = ('stream', 'dict')
+
+
+def make_noise_images(directory, number, size, quality):
+    '''
+    Noise compresses badly: large files within the payload budget of the api
+    '''
+    paths = []
+    for index in range(number):
+        image = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+        path = os.path.join(directory, '%s.jpg' % index)
+        image.save(path, quality=quality)
+        paths.append(path)
+    return paths
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_mode(mode, base_url, paths, results):
+    class Server(object):
+        token_url = base_url + '/oauth/2.0/token'
+
+    Server.base_url = base_url
+
+    class Service(StubOcrService):
+        STREAM_BODY = mode == 'stream'
+
+    async def run():
+        service = Service(Server, 'app_id', 'api_key', 'secret_key')
+        # the token, the sessions and the lazy imports are not part of the calls
+        await service.aio_request(paths[0])
+        baseline = _peak_rss_bytes()
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*[service.aio_request(path) for path in paths], return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        await service.aclose()
+        peak = _peak_rss_bytes()
+        errors = sum(1 for r in outcomes if isinstance(r, Exception) or 'error_code' in r)
+        return {
+            'images': len(paths),
+            'errors': errors,
+            'seconds': round(elapsed, 4),
+            'payload_bytes': service.encode_stats['bytes'] // max(1, service.encode_stats['images']),
+            'baseline_rss_mb': round(baseline / 2 ** 20, 2),
+            'peak_rss_mb': round(peak / 2 ** 20, 2),
+            'peak_rss_per_call_mb': round((peak - baseline) / len(paths) / 2 ** 20, 3),
+        }
+
+    loop = asyncio.new_event_loop()
+    try:
+        results.put(loop.run_until_complete(run()))
+    finally:
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--images', type=int, default=32, help='calls in flight at once')
+    parser.add_argument('--size', default='1400x1400')
+    parser.add_argument('--quality', type=int, default=90)
+    parser.add_argument('--latency', default='const:1', help='long enough for every call to be in flight')
+    parser.add_argument('--output', default=None, help='also write the results to this file')
+    args = parser.parse_args()
+    modes = [m for m in args.modes.split(',') if m]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error('unknown modes %s' % sorted(unknown))
+
+    server = BaiduStubServer(latency=args.latency).start_in_thread()
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = make_noise_images(directory, args.images, tuple(map(int, args.size.split('x'))),
+                                      args.quality)
+            for mode in modes:
+                queue = context.Queue()
+                process = context.Process(target=run_mode, args=(mode, server.base_url, paths, queue))
+                process.start()
+                results[mode] = queue.get()
+                process.join()
+    finally:
+        server.stop_thread()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+'''
+Throughput of the whole plugin against the local stand-in of the Baidu ocr api (benchmarks/stub_server.py),
+no real api call is made. Scenarios:
+
+    spider      OcrSpider end to end
+    aio_request BaiduOcrService.aio_request, concurrently
+    request     BaiduOcrService.request, sequentially
+    preprocess  _get_image_by_region + image_convert_ocr alone
+    auth        getAuthrHeaders vs the cached BceSigner headers
+
+    python benchmarks/bench_ocr.py --images 64 --latency lognormal:-3,0.5 --output bench.json
+    python benchmarks/bench_ocr.py --compare bench.json --tolerance 0.15
+
+The results are printed as json, --compare exits with status 1 when a rate dropped by more than tolerance.
+'''
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+
+from urllib.parse import urlparse
+
+from PIL import Image, ImageDraw
+
+from ruia_ocr import BaiduOcrService, BaiDuServiceTypes, OcrSpider
+from ruia_ocr.service import getAuthrHeaders
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_server import BaiduStubServer
+
+SCENARIOS = ('spider', 'aio_request', 'request', 'preprocess', 'auth')
+
+# the keys compared by --compare, higher is better
+RATE_KEYS = ('images_per_second', 'calls_per_second')
+
+
+class StubOcrService(BaiduOcrService):
+    '''
+    BaiduOcrService sending every call to the stand-in server
+    '''
+
+    def __init__(self, server: BaiduStubServer, *args, **kwargs):
+        self.server = server
+        self.access_token_url = server.token_url
+        super().__init__(*args, **kwargs)
+
+    def get_service_url(self, service_type=None) -> str:
+        return self.server.base_url + urlparse(super().get_service_url(service_type)).path
+
+
+def make_images(directory, number, size):
+    paths = []
+    for index in range(number):
+        image = Image.new('RGB', size, (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        for line in range(0, size[1], 40):
+            draw.text((10, line), 'ruia_ocr benchmark %s %s' % (index, line), fill=(0, 0, 0))
+        path = os.path.join(directory, '%s.jpg' % index)
+        image.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def _percentiles(latencies):
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000, 3)
+    return {'latency_p50_ms': pick(0.5), 'latency_p90_ms': pick(0.9), 'latency_p99_ms': pick(0.99),
+            'latency_max_ms': round(latencies[-1] * 1000, 3)}
+
+
+def _summary(images, elapsed, latencies=None, errors=0, server=None):
+    result = {
+        'images': images,
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'images_per_second': round(images / elapsed, 2) if elapsed else None,
+    }
+    result.update(_percentiles(latencies or []))
+    if server is not None:
+        result['server'] = dict(server.stats)
+    return result
+
+
+def _service(server, args):
+    return StubOcrService(server, 'app_id', 'api_key', 'secret_key',
+                          BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE)
+
+
+def bench_spider(server, paths, args):
+    results = {'parsed': 0}
+    service = _service(server, args)
+
+    class BenchSpider(OcrSpider):
+        start_urls = paths
+        ocr_service = service
+        ocr_region = args.region
+        concurrency = args.concurrency
+        worker_numbers = 2
+        request_config = {'RETRIES': 3, 'DELAY': 0, 'RETRY_DELAY': 0, 'TIMEOUT': 30}
+
+        async def parse(self, response):
+            await response.json()
+            results['parsed'] += 1
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        start = time.perf_counter()
+        loop.run_until_complete(BenchSpider.async_start(loop=loop))
+        elapsed = time.perf_counter() - start
+        loop.run_until_complete(service.aclose())
+    finally:
+        loop.close()
+    return _summary(results['parsed'], elapsed, errors=len(paths) - results['parsed'], server=server)
+
+
+def bench_aio_request(server, paths, args):
+    async def run():
+        service = _service(server, args)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, errors = [], [0]
+
+        async def one(path):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    result = await service.aio_request(path, args.region)
+                    if 'error_code' in result:
+                        errors[0] += 1
+                except Exception:
+                    errors[0] += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(path) for path in paths])
+        elapsed = time.perf_counter() - start
+        await service.aclose()
+        return _summary(len(paths), elapsed, latencies, errors[0], server)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def bench_request(server, paths, args):
+    service = _service(server, args)
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for path in paths:
+        call_start = time.perf_counter()
+        try:
+            if 'error_code' in service.request(path, args.region):
+                errors += 1
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    service.close()
+    return _summary(len(paths), elapsed, latencies, errors, server)
+
+
+def bench_preprocess(server, paths, args):
+    service = _service(server, args)
+    latencies = []
+    start = time.perf_counter()
+    for path in paths:
+        call_start = time.perf_counter()
+        image = service._get_image_by_region(Image.open(path), args.region)
+        service.image_convert_ocr(image, None)
+        latencies.append(time.perf_counter() - call_start)
+    return _summary(len(paths), time.perf_counter() - start, latencies)
+
+
+def _rate(func, seconds):
+    count, start = 0, time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            func()
+        count += 100
+    elapsed = time.perf_counter() - start
+    return {'calls': count, 'calls_per_second': round(count / elapsed, 1),
+            'us_per_call': round(elapsed / count * 1e6, 3)}
+
+
+def bench_auth(server, paths, args):
+    service = _service(server, args)
+    url = service.service_url
+    return {
+        'getAuthrHeaders': _rate(lambda: getAuthrHeaders('POST', url, _apiKey='api_key',
+                                                         _secretKey='secret_key'), args.seconds),
+        'BaiduOcrService.headers': _rate(lambda: service.headers, args.seconds),
+    }
+
+
+def _rates(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _rates(value, f'{prefix}{key}.')
+        elif key in RATE_KEYS and value:
+            yield f'{prefix}{key}', value
+
+
+def compare(results, baseline, tolerance):
+    '''
+    :return: the rates of results lower than the baseline by more than tolerance
+    '''
+    old = dict(_rates(baseline.get('results', {})))
+    regressions = {}
+    for key, value in _rates(results):
+        if key in old and value < old[key] * (1 - tolerance):
+            regressions[key] = {'baseline': old[key], 'current': value,
+                                'change': round(value / old[key] - 1, 4)}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--images', type=int, default=32)
+    parser.add_argument('--size', default='1200x800')
+    parser.add_argument('--region', default=None)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', default='const:0.02')
+    parser.add_argument('--qps', type=float, default=None)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seconds', type=float, default=1.0, help='duration of the auth scenario')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='also write the results to this file')
+    parser.add_argument('--compare', default=None, help='baseline results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios %s' % sorted(unknown))
+
+    server = BaiduStubServer(latency=args.latency, qps=args.qps, failure_rate=args.failure_rate,
+                             error_rate=args.error_rate, seed=args.seed).start_in_thread()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = make_images(directory, args.images, tuple(map(int, args.size.split('x'))))
+            for scenario in scenarios:
+                server.reset_stats()
+                results[scenario] = globals()['bench_' + scenario](server, paths, args)
+    finally:
+        server.stop_thread()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    status = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf8') as f:
+            report['regressions'] = compare(results, json.load(f), args.tolerance)
+        status = 1 if report['regressions'] else 0
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            f.write(output)
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
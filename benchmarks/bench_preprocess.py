@@ -0,0 +1,119 @@
+'''
+Loop latency and images per second of the image stage, inline on the event loop vs OcrExecutor.
+The draft decode of the JPEGs is checked against a PNG of the same pixels first.
+
+    python benchmarks/bench_preprocess.py --images 64 --size 3000x2000 --concurrency 8
+'''
+import os
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+from io import BytesIO
+from PIL import Image, ImageDraw
+
+from ruia_ocr.executor import OcrExecutor
+from ruia_ocr.imaging import EncoderPolicy, preprocess_image
+
+
+def make_images(directory, number, size):
+    paths = []
+    for index in range(number):
+        image = Image.new('RGB', size, (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+        for line in range(0, size[1], 40):
+            draw.text((10, line), 'ruia_ocr benchmark %s %s' % (index, line), fill=(0, 0, 0))
+        path = os.path.join(directory, '%s.jpg' % index)
+        image.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def check_draft_dpi(size=(2000, 1500), dpi=600, target_dpi=150):
+    '''
+    A JPEG and a PNG of the same pixels and dpi must encode to the same size:
+    the JPEG is draft decoded at a reduced size, which must not be scaled down by target_dpi again
+    '''
+    policy = EncoderPolicy(format='JPEG', target_dpi=target_dpi, max_edge=None, passthrough=False)
+    sizes = {}
+    for format in ('JPEG', 'PNG'):
+        buffer = BytesIO()
+        Image.new('RGB', size, (255, 255, 255)).save(buffer, format, dpi=(dpi, dpi))
+        sizes[format] = preprocess_image(buffer.getvalue(), None, False, policy).size
+    if sizes['JPEG'] != sizes['PNG']:
+        raise AssertionError('draft decoded JPEG encoded to %s, the PNG to %s' % (sizes['JPEG'], sizes['PNG']))
+    return sizes
+
+
+async def _ticker(lags, stop, interval=0.001):
+    loop = asyncio.get_event_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - start - interval)
+
+
+async def _run(paths, region, concurrency, executor=None):
+    lags, stop = [], asyncio.Event()
+    ticker = asyncio.ensure_future(_ticker(lags, stop))
+    queue = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+
+    async def worker():
+        while not queue.empty():
+            path = queue.get_nowait()
+            if executor is None:
+                preprocess_image(path, region, False)
+            else:
+                await executor.run(preprocess_image, path, region, False)
+            # give the ticker a chance to run between images, like a real request would
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    lags.sort()
+    return {
+        'images': len(paths),
+        'seconds': round(elapsed, 4),
+        'images_per_second': round(len(paths) / elapsed, 2),
+        'loop_lag_p50_ms': round(lags[len(lags) // 2] * 1000, 3) if lags else None,
+        'loop_lag_p99_ms': round(lags[int(len(lags) * 0.99)] * 1000, 3) if lags else None,
+        'loop_lag_max_ms': round(lags[-1] * 1000, 3) if lags else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=32)
+    parser.add_argument('--size', default='3000x2000')
+    parser.add_argument('--region', default='1,1,0.5,0.5;0.5,0.5,0.99,0.99')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    size = tuple(map(int, args.size.split('x')))
+
+    results = {'draft_dpi_check': check_draft_dpi()}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_images(directory, args.images, size)
+        loop = asyncio.new_event_loop()
+        results['inline'] = loop.run_until_complete(
+            _run(paths, args.region, args.concurrency))
+        for kind in OcrExecutor.KINDS:
+            executor = OcrExecutor(kind, max_workers=args.workers)
+            try:
+                results[kind] = loop.run_until_complete(
+                    _run(paths, args.region, args.concurrency, executor))
+            finally:
+                executor.shutdown()
+        loop.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
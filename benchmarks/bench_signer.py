@@ -0,0 +1,54 @@
+'''
+Signatures per second of the bce authorization headers: getAuthrHeaders vs BceSigner.
+
+    python benchmarks/bench_signer.py --seconds 1
+'''
+import json
+import time
+import argparse
+
+from ruia_ocr.auth import BceSigner
+from ruia_ocr.configs import BaiDuServiceTypes
+from ruia_ocr.service import getAuthrHeaders
+
+URL = BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE.url
+
+
+def _rate(func, seconds):
+    count, start = 0, time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            func()
+        count += 100
+    elapsed = time.perf_counter() - start
+    return {'calls': count, 'calls_per_second': round(count / elapsed, 1),
+            'us_per_call': round(elapsed / count * 1e6, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    signer = BceSigner('api_key', 'secret_key')
+    content_type = {'Content-Type': 'application/x-www-form-urlencoded'}
+    clock = [time.time()]
+
+    def resign():
+        # move past the re-sign deadline on every call, so every call signs
+        clock[0] += signer.expire
+        return signer.sign('POST', URL, headers=content_type, now=clock[0])
+
+    results = {
+        'getAuthrHeaders': _rate(lambda: getAuthrHeaders('POST', URL, _apiKey='api_key',
+                                                         _secretKey='secret_key'), args.seconds),
+        'BceSigner.sign(resign)': _rate(resign, args.seconds),
+        'BceSigner.sign(cached)': _rate(lambda: signer.sign('POST', URL, headers=content_type),
+                                        args.seconds),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+'''
+Local stand-in of the Baidu ocr api for the benchmarks: the token endpoint and the ocr endpoints
+answering words_result with locations, after a configurable latency, with qps-limit errors and failures.
+
+    python benchmarks/stub_server.py --port 8800 --latency lognormal:-3,0.5 --qps 50 --failure-rate 0.01
+
+Latency specs: const:SECONDS, uniform:LOW,HIGH, normal:MEAN,STDDEV, lognormal:MU,SIGMA, exp:MEAN
+'''
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+
+from collections import deque
+from typing import Callable
+
+from aiohttp import web
+
+# error codes of the real api, they come back with http status 200
+QPS_ERROR = {'error_code': 18, 'error_msg': 'Open api qps request limit reached'}
+INTERNAL_ERROR = {'error_code': 282000, 'error_msg': 'internal error'}
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    '''
+    :return: a function drawing the latency in seconds of a response
+    '''
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v.strip()]
+    if kind == 'const':
+        return lambda rng: values[0] if values else 0.0
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    if kind == 'exp':
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    raise ValueError('unknown latency spec %r' % spec)
+
+
+class BaiduStubServer(object):
+    '''
+    latency: latency spec of the ocr endpoints, see parse_latency
+    qps: answer error_code 18 above this many ocr calls per second, None means no limit
+    failure_rate: share of the ocr calls answered with http status 500
+    error_rate: share of the ocr calls answered with an internal error_code
+    lines: number of lines in every words_result
+    '''
+
+    def __init__(self,
+                 host: str='127.0.0.1',
+                 port: int=0,
+                 latency: str='const:0',
+                 qps: float=None,
+                 failure_rate: float=0.0,
+                 error_rate: float=0.0,
+                 lines: int=5,
+                 expires_in: int=2592000,
+                 seed: int=None):
+        self.host = host
+        self.port = port
+        self.latency_spec = latency
+        self.latency = parse_latency(latency)
+        self.qps = qps
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.lines = lines
+        self.expires_in = expires_in
+        self.random = random.Random(seed)
+        self.stats = {'ocr_calls': 0, 'token_calls': 0, 'qps_errors': 0, 'failures': 0, 'errors': 0,
+                      'bytes_received': 0}
+        self._window = deque()
+        self._runner: web.AppRunner = None
+        self._thread: threading.Thread = None
+        self._loop: asyncio.AbstractEventLoop = None
+
+    def __repr__(self):
+        return f'BaiduStubServer<{self.base_url}, latency={self.latency_spec}, qps={self.qps}>'
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def token_url(self) -> str:
+        return self.base_url + '/oauth/2.0/token'
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route('*', '/oauth/2.0/token', self.token)
+        app.router.add_post('/rest/2.0/{path:.*}', self.ocr)
+        return app
+
+    async def token(self, request: web.Request) -> web.Response:
+        self.stats['token_calls'] += 1
+        return web.json_response({'access_token': 'stub.%s' % int(time.time()),
+                                  'expires_in': self.expires_in,
+                                  'scope': 'public brain_all_scope'})
+
+    def _over_qps(self) -> bool:
+        if not self.qps:
+            return False
+        now = time.monotonic()
+        while self._window and now - self._window[0] >= 1.0:
+            self._window.popleft()
+        if len(self._window) >= self.qps:
+            return True
+        self._window.append(now)
+        return False
+
+    def _words_result(self) -> list:
+        return [{'words': 'ruia_ocr stub line %s' % index,
+                 'location': {'left': 10, 'top': 10 + index * 40, 'width': 300, 'height': 30},
+                 'probability': {'average': 0.98, 'min': 0.9, 'variance': 0.001}}
+                for index in range(self.lines)]
+
+    async def ocr(self, request: web.Request) -> web.Response:
+        self.stats['ocr_calls'] += 1
+        body = await request.read()
+        self.stats['bytes_received'] += len(body)
+        if self._over_qps():
+            self.stats['qps_errors'] += 1
+            return web.json_response(QPS_ERROR)
+        await asyncio.sleep(self.latency(self.random))
+        draw = self.random.random()
+        if draw < self.failure_rate:
+            self.stats['failures'] += 1
+            return web.Response(status=500, text='stub failure')
+        if draw < self.failure_rate + self.error_rate:
+            self.stats['errors'] += 1
+            return web.json_response(INTERNAL_ERROR)
+        words_result = self._words_result()
+        return web.json_response({'log_id': self.random.getrandbits(63),
+                                  'words_result_num': len(words_result),
+                                  'words_result': words_result})
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self) -> 'BaiduStubServer':
+        '''
+        Serve from a thread with its own loop, so that the sync clients of the same process can use it
+        '''
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, name='baidu_stub_server', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self) -> None:
+        if self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def reset_stats(self) -> None:
+        for key in self.stats:
+            self.stats[key] = 0
+        self._window.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency', default='const:0.05')
+    parser.add_argument('--qps', type=float, default=None)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--lines', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    server = BaiduStubServer(args.host, args.port, args.latency, args.qps, args.failure_rate,
+                             args.error_rate, args.lines, seed=args.seed)
+    print(json.dumps({'base_url': server.base_url, 'token_url': server.token_url}))
+    web.run_app(server.app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == '__main__':
+    main()
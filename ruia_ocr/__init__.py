@@ -4,6 +4,23 @@ from .service import *
 from .utils import *
 from .items import *
 from .configs import *
+from .imaging import *
+from .executor import *
+from .cache import *
+from .ratelimit import *
+from .auth import *
+from .tiling import *
+from .batching import *
+from .dedupe import *
+from .metrics import *
+from .result import *
+from .pool import *
+from .hedging import *
+from .prefilter import *
+from .checkpoint import *
+from .runner import *
+from .formbody import *
+from .fetch import *
 
 name = 'ruia_ocr'
 
@@ -0,0 +1,317 @@
+import os
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import aiohttp
+import requests
+
+from types import MappingProxyType
+from typing import Dict, Mapping, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse, quote, urlencode
+
+from ruia.utils import get_logger
+from ruia_ocr.exceptions import AccessTokenError
+
+try:
+    # Adaptive interface changes. It's recommended to do this
+    from aip.base import AipBase
+
+    _access_token_url = AipBase._AipBase__accessTokenUrl
+except:
+    # Fixed api implementation, not recommended
+    _access_token_url = 'https://aip.baidubce.com/oauth/2.0/token'
+
+__all__ = ['TokenStore', 'AccessTokenManager', 'BceSigner']
+
+logger = get_logger('Ocr')
+
+
+class TokenStore(object):
+    '''
+    On-disk store of access tokens, so that worker processes can skip the oauth round-trip at startup.
+    Tokens are keyed by a hash of the credentials, the file is only readable by its owner.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'TokenStore<{self.path}>'
+
+    @staticmethod
+    def key(api_key: str, secret_key: str) -> str:
+        return hashlib.sha256(f'{api_key}:{secret_key}'.encode()).hexdigest()[:32]
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, 'r', encoding='utf8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, key: str) -> Optional[dict]:
+        '''
+        :return: {'access_token': str, 'expires_at': float} or None
+        '''
+        return self._read().get(key)
+
+    def save(self, key: str, access_token: str, expires_at: float) -> None:
+        with self._lock:
+            tokens = self._read()
+            tokens[key] = {'access_token': access_token, 'expires_at': expires_at}
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf8') as f:
+                json.dump(tokens, f)
+            os.replace(tmp, self.path)
+
+
+class AccessTokenManager(object):
+    '''
+    Lazy, expiry-aware access token of a pair of credentials.
+
+    Concurrent callers share a single fetch of the token endpoint (single-flight).
+    Once refresh_before seconds (at most half the lifetime) are left, the token is refreshed in the background
+    while the current one is still handed out. Use AccessTokenManager.shared to share the token
+    between services with the same credentials.
+    '''
+
+    _shared: Dict[Tuple[str, str, str], 'AccessTokenManager'] = {}
+
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 api_key: str,
+                 secret_key: str,
+                 token_url: str=_access_token_url,
+                 store: TokenStore=None,
+                 refresh_before: float=3600,
+                 timeout: float=10):
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.token_url = token_url
+        self.store = store
+        self.refresh_before = refresh_before
+        self.timeout = timeout
+        self._token: str = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._future: asyncio.Future = None
+        self._lock = threading.Lock()
+        if store is not None:
+            stored = store.load(TokenStore.key(api_key, secret_key))
+            if stored:
+                self._set(stored['access_token'], stored['expires_at'])
+
+    def __repr__(self):
+        return f'AccessTokenManager<{self.api_key}, expires_at={self._expires_at}>'
+
+    @classmethod
+    def shared(cls, api_key: str, secret_key: str, token_url: str=_access_token_url,
+               **kwargs) -> 'AccessTokenManager':
+        key = (api_key, secret_key, token_url)
+        with cls._shared_lock:
+            manager = cls._shared.get(key)
+            if manager is None:
+                manager = cls._shared[key] = cls(api_key, secret_key, token_url, **kwargs)
+            elif manager.store is None and kwargs.get('store') is not None:
+                manager.store = kwargs['store']
+            return manager
+
+    @property
+    def token(self) -> Optional[str]:
+        '''
+        :return: The current token if it has not expired
+        '''
+        return self._token if time.time() < self._expires_at else None
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    def _set(self, token: str, expires_at: float) -> None:
+        lifetime = max(0.0, expires_at - time.time())
+        self._token = token
+        # keep a margin for the clock skew and the time in flight like aip does
+        self._expires_at = expires_at - min(30, lifetime / 10)
+        self._refresh_at = expires_at - min(self.refresh_before, lifetime / 2)
+
+    def _update(self, obj: dict) -> str:
+        token = obj.get('access_token')
+        if not token:
+            raise AccessTokenError('Baidu-ocr failed to get access_token: %s' % (
+                obj.get('error_description') or obj.get('error') or obj))
+        expires_at = time.time() + float(obj.get('expires_in', 0))
+        self._set(token, expires_at)
+        if self.store is not None:
+            try:
+                self.store.save(TokenStore.key(self.api_key, self.secret_key), token, expires_at)
+            except OSError as e:
+                logger.error(f'<TokenStore {self.store.path}: {e}>')
+        return token
+
+    @property
+    def _token_params(self) -> dict:
+        return {
+            'grant_type': 'client_credentials',
+            'client_id': self.api_key,
+            'client_secret': self.secret_key
+        }
+
+    async def _fetch(self, session: aiohttp.ClientSession=None) -> str:
+        if callable(session):
+            session = session()
+        close_session = session is None
+        if close_session:
+            session = aiohttp.ClientSession()
+        try:
+            async with session.get(self.token_url,
+                                   params=self._token_params,
+                                   timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+                obj = await resp.json(content_type=None)
+        finally:
+            if close_session:
+                await session.close()
+        return self._update(obj)
+
+    @staticmethod
+    def _log_background_error(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f'<Refresh access_token: {future.exception()}>')
+
+    def _refresh(self, session: aiohttp.ClientSession=None) -> asyncio.Future:
+        loop = asyncio.get_event_loop()
+        future = self._future
+        if future is None or future.done() or future.get_loop() is not loop:
+            future = self._future = asyncio.ensure_future(self._fetch(session))
+            future.add_done_callback(self._log_background_error)
+        return future
+
+    async def get_token(self, session: aiohttp.ClientSession=None) -> str:
+        '''
+        :param session: aiohttp session used to fetch the token endpoint, or a callable returning it,
+            None means a temporary one
+        '''
+        now = time.time()
+        if self._token is not None and now < self._refresh_at:
+            return self._token
+        future = self._refresh(session)
+        if self._token is not None and now < self._expires_at:
+            # still valid, refreshing in the background
+            return self._token
+        return await asyncio.shield(future)
+
+    def get_token_sync(self, session: requests.Session=None) -> str:
+        with self._lock:
+            if self._token is not None and time.time() < self._refresh_at:
+                return self._token
+            obj = (session or requests).get(self.token_url,
+                                            params=self._token_params,
+                                            timeout=self.timeout).json()
+            return self._update(obj)
+
+    def invalidate(self) -> None:
+        '''
+        Drop the current token, such as when the server reports it invalid
+        '''
+        self._token = None
+        self._expires_at = self._refresh_at = 0.0
+
+
+class _SignTemplate(NamedTuple):
+    host: str
+    # canonical request without the canonical headers, which hold the timestamp
+    prefix: str
+
+
+class _Signed(NamedTuple):
+    headers: Mapping[str, str]
+    resign_at: float
+
+
+class BceSigner(object):
+    '''
+    bce-auth-v1 signer producing the same headers as getAuthrHeaders.
+
+    The canonical uri and query of a url are computed once, a signature (and the signing key it is derived from)
+    is reused until refresh_before seconds before it expires, then the url is re-signed.
+    Every call returns an immutable mapping, so concurrent requests can't modify each other's headers.
+    '''
+
+    version = '1'
+
+    def __init__(self, api_key: str, secret_key: str, expire: int=1800, refresh_before: int=300):
+        if refresh_before >= expire:
+            raise ValueError('refresh_before must be less than expire')
+        self.api_key = api_key
+        self.secret_key = secret_key.encode('utf-8')
+        self.expire = expire
+        self.refresh_before = refresh_before
+        self._templates: Dict[tuple, _SignTemplate] = {}
+        self._signed: Dict[tuple, _Signed] = {}
+        self._lock = threading.Lock()
+        self.signatures = 0
+
+    def __repr__(self):
+        return f'BceSigner<{self.api_key}, expire={self.expire}>'
+
+    def _template(self, method: str, url: str, params: Optional[dict]) -> _SignTemplate:
+        key = (method, url, tuple(sorted(params.items())) if params else None)
+        template = self._templates.get(key)
+        if template is None:
+            url_result = urlparse(url)
+            query = dict(params or {})
+            for kv in url_result.query.strip().split('&'):
+                if kv:
+                    k, v = kv.split('=')
+                    query[k] = v
+            prefix = '%s\n%s\n%s\n' % (method.upper(), quote(url_result.path), '&'.join(
+                sorted(urlencode(query).split('&'))))
+            template = self._templates[key] = _SignTemplate(url_result.hostname, prefix)
+        return template
+
+    def _sign(self, template: _SignTemplate, now: float) -> Dict[str, str]:
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now))
+        auth_prefix = 'bce-auth-v%s/%s/%s/%s' % (self.version, self.api_key, timestamp, self.expire)
+        signing_key = hmac.new(self.secret_key, auth_prefix.encode('utf-8'),
+                               hashlib.sha256).hexdigest()
+        # host sorts before x-bce-date, the signed headers are fixed
+        canonical_headers = 'host:%s\nx-bce-date:%s' % (quote(template.host.strip(), ''),
+                                                          quote(timestamp, ''))
+        signature = hmac.new(signing_key.encode('utf-8'),
+                             (template.prefix + canonical_headers).encode('utf-8'),
+                             hashlib.sha256).hexdigest()
+        self.signatures += 1
+        return {
+            'Host': template.host,
+            'x-bce-date': timestamp,
+            'authorization': '%s/host;x-bce-date/%s' % (auth_prefix, signature),
+        }
+
+    def sign(self, method: str, url: str, params: dict=None, headers: Mapping[str, str]=None,
+             now: float=None) -> Mapping[str, str]:
+        '''
+        :param params: query params taking part in the signature, such as getAuthrHeaders's params
+        :param headers: extra headers not taking part in the signature, such as Content-Type
+        :return: immutable headers, signed at most expire - refresh_before seconds ago
+        '''
+        now = time.time() if now is None else now
+        key = (method, url, tuple(sorted(params.items())) if params else None,
+               tuple(sorted(headers.items())) if headers else None)
+        signed = self._signed.get(key)
+        if signed is None or now >= signed.resign_at:
+            with self._lock:
+                signed = self._signed.get(key)
+                if signed is None or now >= signed.resign_at:
+                    values = self._sign(self._template(method, url, params), now)
+                    if headers:
+                        values.update(headers)
+                    signed = self._signed[key] = _Signed(
+                        MappingProxyType(values), now + self.expire - self.refresh_before)
+        return signed.headers
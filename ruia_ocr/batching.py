@@ -0,0 +1,257 @@
+# Composite batching: many small images -> one canvas -> one ocr call -> the result of every image
+# Every line of the composite result goes back to the image holding its centre, the gutters keep a line within one image
+import json
+import asyncio
+
+from math import sqrt
+from PIL import Image
+from typing import List, NamedTuple, Optional, Tuple
+
+from ruia.utils import get_logger
+from ruia_ocr.configs import BaiDuServiceTypes, BaseServiceTypes
+from ruia_ocr.exceptions import CompositeOcrError
+from ruia_ocr.imaging import (MAX_EDGE, RegionStr, ImageSource, RegionPlan, EncoderPolicy, EncodedImage,
+                              crop_by_region, encode_image, image_file, open_image)
+from ruia_ocr.tiling import _translate
+
+__all__ = ['BatchPolicy', 'CompositePlan', 'image_size', 'plan_composite', 'preprocess_composite',
+           'demux_words_results', 'CompositeBatcher']
+
+logger = get_logger('Ocr')
+
+
+class BatchPolicy(object):
+    '''
+    Which images are packed into one canvas and recognized by one call.
+
+    service_type: the service type of the composite calls, it must return the location of every line.
+        The small images are sent to it instead of the service type of the service, another endpoint
+        with its own quota and price (BAIDU_GENERA_TYPE by default, even for a BAIDU_GENERALBASIC_TYPE service),
+        and their results are cached under it
+    max_images: max number of images on one canvas
+    max_item_edge: only the images whose longest edge is at most max_item_edge px are packed
+    max_edge: longest edge of the canvas
+    gutter: blank px between the images and around the canvas, so that no line spans two images
+    max_wait: seconds an image waits for others before a partial canvas is sent
+    '''
+
+    def __init__(self,
+                 service_type: BaseServiceTypes=BaiDuServiceTypes.BAIDU_GENERA_TYPE,
+                 max_images: int=16,
+                 max_item_edge: int=512,
+                 max_edge: int=MAX_EDGE,
+                 gutter: int=32,
+                 max_wait: float=0.05):
+        if max_images < 1:
+            raise ValueError('max_images must be greater than 0')
+        if max_item_edge + 2 * gutter > max_edge:
+            raise ValueError('max_item_edge and the gutters can not exceed max_edge')
+        self.service_type = service_type
+        self.max_images = max_images
+        self.max_item_edge = max_item_edge
+        self.max_edge = min(max_edge, MAX_EDGE)
+        self.gutter = gutter
+        self.max_wait = max_wait
+
+    def __repr__(self):
+        return f'BatchPolicy<{self.service_type}, max_images={self.max_images}, max_item_edge={self.max_item_edge}>'
+
+    def accepts(self, size: Tuple[int, int]) -> bool:
+        return 0 < min(size) and max(size) <= self.max_item_edge
+
+
+class CompositePlan(NamedTuple):
+    '''
+    offsets: the (left, top) of every image on the canvas
+    sizes: the size of every image
+    size: the size of the canvas
+    '''
+    offsets: Tuple[Tuple[int, int], ...]
+    sizes: Tuple[Tuple[int, int], ...]
+    size: Tuple[int, int]
+
+    def find(self, x: float, y: float) -> Optional[int]:
+        '''
+        :return: the index of the image holding the point (x, y) of the canvas, None if it is in a gutter
+        '''
+        for index, ((left, top), (width, height)) in enumerate(zip(self.offsets, self.sizes)):
+            if left <= x < left + width and top <= y < top + height:
+                return index
+        return None
+
+
+def image_size(source: ImageSource, region: RegionStr=None) -> Tuple[int, int]:
+    '''
+    :return: the size of the image once the region is applied, only the header of a file is read
+    '''
+    if isinstance(source, Image.Image):
+        size = source.size
+    else:
+        with Image.open(image_file(source)) as image:
+            size = image.size
+    return RegionPlan.compile(region, size).size if region else size
+
+
+def plan_composite(sizes: List[Tuple[int, int]], policy: BatchPolicy) -> CompositePlan:
+    '''
+    Shelf-pack the leading images of sizes row by row, as many as fit on the canvas.
+    The row width aims at a square canvas, so that its edges stay far from the limits
+    :return: the plan of the images packed, len(plan.offsets) of them
+    '''
+    gutter = policy.gutter
+    sizes = sizes[:policy.max_images]
+    area = sum((w + gutter) * (h + gutter) for w, h in sizes)
+    row_width = min(policy.max_edge,
+                    max(max((w for w, _ in sizes), default=0) + 2 * gutter, int(sqrt(area) * 1.2)))
+    offsets, packed = [], []
+    x, y, row_height, width = gutter, gutter, 0, 0
+    for w, h in sizes:
+        if x > gutter and x + w + gutter > row_width:
+            x, y, row_height = gutter, y + row_height + gutter, 0
+        if y + h + gutter > policy.max_edge:
+            break
+        offsets.append((x, y))
+        packed.append((w, h))
+        x += w + gutter
+        row_height = max(row_height, h)
+        width = max(width, x)
+    return CompositePlan(tuple(offsets), tuple(packed), (width, y + row_height + gutter))
+
+
+def preprocess_composite(items: List[Tuple[ImageSource, RegionStr]], plan: CompositePlan,
+                         policy: EncoderPolicy=None) -> EncodedImage:
+    '''
+    Paste every (source, region) at its offset on a white canvas and encode the canvas
+    '''
+    canvas = Image.new('RGB', plan.size, (255, 255, 255))
+    for (source, region), offset in zip(items, plan.offsets):
+        image = crop_by_region(open_image(source, region), region)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            rgba = image.convert('RGBA')
+            canvas.paste(rgba, offset, mask=rgba.split()[-1])
+        else:
+            canvas.paste(image if image.mode == 'RGB' else image.convert('RGB'), offset)
+    return encode_image(canvas, policy, check=True)
+
+
+def demux_words_results(result: dict, plan: CompositePlan, encoded_size: Tuple[int, int]=None) -> List[dict]:
+    '''
+    Split the result of a composite image into the result of every image by the center of each line,
+    the locations are translated to the image. Lines without location or in a gutter are dropped.
+
+    :param encoded_size: the size of the encoded canvas, when the EncoderPolicy downscaled it
+    '''
+    sx, sy = 1.0, 1.0
+    if encoded_size and tuple(encoded_size) != tuple(plan.size):
+        sx, sy = plan.size[0] / float(encoded_size[0]), plan.size[1] / float(encoded_size[1])
+    lines: List[List[dict]] = [[] for _ in plan.offsets]
+    dropped = 0
+    for words in result.get('words_result') or []:
+        location = words.get('location') if isinstance(words, dict) else None
+        if not isinstance(location, dict):
+            dropped += 1
+            continue
+        index = plan.find((location.get('left', 0) + location.get('width', 0) / 2.0) * sx,
+                          (location.get('top', 0) + location.get('height', 0) / 2.0) * sy)
+        if index is None:
+            dropped += 1
+            continue
+        left, top = plan.offsets[index]
+        lines[index].append(_translate(words, -left, -top, sx, sy))
+    if dropped:
+        logger.debug(f'<Composite dropped {dropped} lines without an image>')
+    base = {k: v for k, v in result.items() if k not in ('words_result', 'words_result_num')}
+    return [dict(base, words_result=item_lines, words_result_num=len(item_lines), composite_num=len(lines))
+            for item_lines in lines]
+
+
+class _Item(NamedTuple):
+    source: ImageSource
+    region: RegionStr
+    size: Tuple[int, int]
+    future: asyncio.Future
+
+
+class CompositeBatcher(object):
+    '''
+    Collect the small images submitted concurrently on one event loop, pack them into canvases
+    following the BatchPolicy and recognize every canvas with one call of the service.
+    A canvas is sent once max_images are waiting or max_wait seconds after its first image.
+    '''
+
+    def __init__(self, service, policy: BatchPolicy):
+        self.service = service
+        self.policy = policy
+        self.loop = asyncio.get_event_loop()
+        self._pending: List[_Item] = []
+        self._timer: asyncio.TimerHandle = None
+        self._tasks = set()
+        self.batches = 0
+        self.images = 0
+
+    def __repr__(self):
+        return f'CompositeBatcher<{self.policy}, batches={self.batches}, images={self.images}>'
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'batches': self.batches,
+            'images': self.images,
+            'calls_saved': self.images - self.batches,
+        }
+
+    async def submit(self, source: ImageSource, region: RegionStr=None,
+                     size: Tuple[int, int]=None) -> dict:
+        '''
+        :return: the result of the image, as if it was recognized alone by policy.service_type
+        '''
+        size = size or image_size(source, region)
+        future = self.loop.create_future()
+        self._pending.append(_Item(source, region, size, future))
+        if len(self._pending) >= self.policy.max_images:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.policy.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            plan = plan_composite([item.size for item in self._pending], self.policy)
+            count = max(1, len(plan.offsets))
+            items, self._pending = self._pending[:count], self._pending[count:]
+            task = asyncio.ensure_future(self._run(items, plan))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            if len(self._pending) < self.policy.max_images:
+                break
+        if self._pending:
+            self._timer = self.loop.call_later(self.policy.max_wait, self._flush)
+
+    async def _run(self, items: List[_Item], plan: CompositePlan) -> None:
+        service, service_type = self.service, self.policy.service_type
+        try:
+            sources = [(item.source, item.region) for item in items]
+            if service.executor is None:
+                encoded = await asyncio.get_event_loop().run_in_executor(None, preprocess_composite, sources, plan,
+                                                                         service.encoder)
+            else:
+                encoded = await service.executor.run(preprocess_composite, sources, plan, service.encoder)
+            service._record_encoded(encoded)
+            await service.acquire_quota(service_type)
+            result = service._loads_and_cache(None, await service.aio_post_hedged(encoded.data, service_type),
+                                              service_type)
+            if not service.is_cacheable(result):
+                raise CompositeOcrError(json.dumps(result, ensure_ascii=False))
+            self.batches += 1
+            self.images += len(items)
+            logger.debug(f'<Composite {len(items)} images {plan.size}>')
+            for item, item_result in zip(items, demux_words_results(result, plan, encoded.size)):
+                if not item.future.done():
+                    item.future.set_result(item_result)
+        except Exception as e:
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
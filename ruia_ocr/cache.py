@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from PIL import Image
+from collections import OrderedDict
+from typing import Optional, Union
+
+__all__ = ['OcrCache']
+
+
+class OcrCache(object):
+    '''
+    Content-addressed cache of ocr responses: a size-bounded memory LRU in front of a local sqlite file.
+    The key is a hash of the image bytes, the region, the service type, the effective payload, the EncoderPolicy
+    and the parameters of the request, the value is the raw response body, so a hit can rebuild the OcrResponse locally.
+
+    path: sqlite file of the disk tier, None means memory only
+    max_items: max number of entries in memory
+    max_memory_bytes: byte budget of the memory tier
+    max_disk_bytes: byte budget of the disk tier, once over it the expired then the least recently used entries
+        are evicted down to 90% of it
+    ttl: seconds an entry stays valid, None means forever
+
+    The size of the disk tier is counted as entries are written and evicted, the table is only summed again
+    when the count goes over max_disk_bytes, to take in the entries written by the other processes.
+    get and set read and write the sqlite file in the calling thread, call them off the event loop
+    '''
+
+    def __init__(self,
+                 path: str=None,
+                 max_items: int=1024,
+                 max_memory_bytes: int=64 * 1024 * 1024,
+                 max_disk_bytes: int=1024 * 1024 * 1024,
+                 ttl: float=None):
+        self.path = path
+        self.max_items = max_items
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection = None
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS ocr_cache ('
+                             'key TEXT PRIMARY KEY, value BLOB, size INTEGER, '
+                             'created REAL, accessed REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS ocr_cache_accessed ON ocr_cache (accessed)')
+            self._db.commit()
+            self._disk_bytes = self._disk_size()
+
+    def __repr__(self):
+        return f'OcrCache<{self.path}, hits={self.hits}, misses={self.misses}>'
+
+    def __len__(self):
+        return len(self._memory)
+
+    @staticmethod
+    def make_key(source: Union[str, bytes, Image.Image], region: str=None, service_type=None,
+                 payload: dict=None, encoder=None, params: dict=None) -> str:
+        '''
+        Hash the whole image, call it off the event loop for a large file
+        :param source: local image path, remote image url, image bytes or PIL.Image
+        :param region: RegionStr
+        :param service_type: BaseServiceTypes member
+        :param payload: the effective payload, `image` and `url` are ignored
+        :param encoder: EncoderPolicy of the image sent, the downscaling and the quality change the result
+        :param params: anything else of the request the result depends on, such as the url and the tiling
+        '''
+        digest = hashlib.sha256()
+        if isinstance(source, Image.Image):
+            digest.update(('%s%s' % (source.mode, source.size)).encode())
+            digest.update(source.tobytes())
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            digest.update(source)
+        elif source.startswith('http'):
+            digest.update(source.encode())
+        else:
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        digest.update(OcrCache.make_meta(region, service_type, payload, encoder, params).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_meta(region: str=None, service_type=None, payload: dict=None, encoder=None,
+                  params: dict=None) -> str:
+        '''
+        :return: everything but the image a result depends on, `image` and `url` of the payload are ignored
+        '''
+        payload = {k: v for k, v in (payload or {}).items() if k not in ('image', 'url')}
+        encoder = vars(encoder) if encoder is not None else None
+        return json.dumps([region or '', str(getattr(service_type, 'value', service_type)), payload, encoder,
+                           params or {}], sort_keys=True, default=str)
+
+    @property
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'hit_rate': self.hits / total if total else 0.0,
+            'memory_items': len(self._memory),
+            'memory_bytes': self._memory_bytes,
+            'disk_bytes': self._disk_bytes,
+        }
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return value
+                self._pop_memory(key)
+            if self._db is not None:
+                row = self._db.execute('SELECT value, size, created FROM ocr_cache WHERE key = ?',
+                                       (key, )).fetchone()
+                if row is not None:
+                    value, size, created = row
+                    if not self._expired(created, now):
+                        self._db.execute('UPDATE ocr_cache SET accessed = ? WHERE key = ?', (now, key))
+                        self._db.commit()
+                        self._set_memory(key, bytes(value), created)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return bytes(value)
+                    self._db.execute('DELETE FROM ocr_cache WHERE key = ?', (key, ))
+                    self._db.commit()
+                    self._disk_bytes -= size
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            self._set_memory(key, value, now)
+            if self._db is not None:
+                row = self._db.execute('SELECT size FROM ocr_cache WHERE key = ?', (key, )).fetchone()
+                self._db.execute('REPLACE INTO ocr_cache (key, value, size, created, accessed) '
+                                 'VALUES (?, ?, ?, ?, ?)', (key, value, len(value), now, now))
+                self._disk_bytes += len(value) - (row[0] if row is not None else 0)
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk(now)
+                self._db.commit()
+
+    def _pop_memory(self, key: str) -> None:
+        value, _ = self._memory.pop(key)
+        self._memory_bytes -= len(value)
+
+    def _set_memory(self, key: str, value: bytes, created: float) -> None:
+        if key in self._memory:
+            self._pop_memory(key)
+        if len(value) > self.max_memory_bytes:
+            return
+        self._memory[key] = (value, created)
+        self._memory_bytes += len(value)
+        while len(self._memory) > self.max_items or self._memory_bytes > self.max_memory_bytes:
+            self._pop_memory(next(iter(self._memory)))
+
+    def _disk_size(self) -> int:
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM ocr_cache').fetchone()[0]
+
+    def _evict_disk(self, now: float) -> None:
+        self._disk_bytes = self._disk_size()
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        if self.ttl is not None:
+            self._db.execute('DELETE FROM ocr_cache WHERE created < ?', (now - self.ttl, ))
+            self._disk_bytes = self._disk_size()
+        target = self.max_disk_bytes * 0.9
+        while self._disk_bytes > target:
+            rows = self._db.execute('SELECT key, size FROM ocr_cache ORDER BY accessed LIMIT 256').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._disk_bytes <= target:
+                    break
+                self._db.execute('DELETE FROM ocr_cache WHERE key = ?', (key, ))
+                self._disk_bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._disk_bytes = 0
+            if self._db is not None:
+                self._db.execute('DELETE FROM ocr_cache')
+                self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
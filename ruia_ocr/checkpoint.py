@@ -0,0 +1,226 @@
+# Persistent progress of the ocr runs: which uris are done or failed, with the size, mtime and hash of their file
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from ruia.utils import get_logger
+
+__all__ = ['Fingerprint', 'fingerprint', 'ProgressIndex']
+
+logger = get_logger('Ocr')
+
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Fingerprint(NamedTuple):
+    '''
+    The version of the file of a uri, all None for a remote image
+    '''
+    size: Optional[int]
+    mtime: Optional[float]
+    digest: Optional[str]
+
+
+def _file_digest(path: str, chunk_size: int=1024 * 1024) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(uri: str, hash_content: bool=True) -> Fingerprint:
+    '''
+    :param hash_content: hash the bytes of the file too, else only its size and mtime are kept
+    '''
+    if uri.startswith('http'):
+        return Fingerprint(None, None, None)
+    stat = os.stat(uri)
+    return Fingerprint(stat.st_size, stat.st_mtime, _file_digest(uri) if hash_content else None)
+
+
+class ProgressIndex(object):
+    '''
+    Progress of the ocr runs in a local sqlite file: the uris done or failed, with the fingerprint of their file.
+    The outcomes are written in batches of batch_size, or every flush_interval seconds, by the thread recording
+    the last outcome of the batch while it holds the lock, so mark and flush write sqlite: call them off the event loop.
+    A crash loses at most the last batch, those images are recognized again by the next run.
+
+    rescan: False resumes a run, every uri done is skipped without looking at its file.
+        True recognizes only the files new or changed since they were done: a file whose size or mtime changed
+        is hashed, and it is skipped when its content is the same
+    retry_failed: recognize again the uris which failed, else they are skipped like the ones done
+    hash_content: keep the hash of the files done, so that a rescan can tell a touched file from a changed one
+    '''
+
+    def __init__(self,
+                 path: str,
+                 rescan: bool=False,
+                 retry_failed: bool=True,
+                 hash_content: bool=True,
+                 batch_size: int=200,
+                 flush_interval: float=2.0):
+        self.path = path
+        self.rescan = rescan
+        self.retry_failed = retry_failed
+        self.hash_content = hash_content
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.skipped = 0
+        self.done = 0
+        self.failed = 0
+        self._pending: List[Tuple] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS ocr_progress ('
+                         'uri TEXT PRIMARY KEY, status TEXT, size INTEGER, mtime REAL, digest TEXT, '
+                         'attempts INTEGER, error TEXT, updated REAL)')
+        self._db.commit()
+
+    def __repr__(self):
+        return f'ProgressIndex<{self.path}, rescan={self.rescan}, done={self.done}, skipped={self.skipped}>'
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM ocr_progress').fetchone()[0]
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'skipped': self.skipped,
+            'done': self.done,
+            'failed': self.failed,
+            'pending_writes': len(self._pending),
+        }
+
+    def _record(self, uri: str) -> Optional[tuple]:
+        with self._lock:
+            return self._db.execute('SELECT status, size, mtime, digest, attempts FROM ocr_progress WHERE uri = ?',
+                                    (uri, )).fetchone()
+
+    def _unchanged(self, uri: str, size: int, mtime: float, digest: str) -> bool:
+        if uri.startswith('http'):
+            return True
+        try:
+            stat = os.stat(uri)
+        except OSError:
+            return False
+        if stat.st_size == size and stat.st_mtime == mtime:
+            return True
+        if digest is None or stat.st_size != size:
+            return False
+        if _file_digest(uri) != digest:
+            return False
+        # touched but the same content: keep the new mtime, the next rescans don't hash it again
+        with self._lock:
+            if self._db is not None:
+                with self._db:
+                    self._db.execute('UPDATE ocr_progress SET size = ?, mtime = ? WHERE uri = ?',
+                                     (stat.st_size, stat.st_mtime, uri))
+        return True
+
+    def should_skip(self, uri: str) -> bool:
+        '''
+        :return: whether the uri is done, or failed without retry_failed, and unchanged in a rescan
+        '''
+        row = self._record(uri)
+        if row is None:
+            return False
+        status, size, mtime, digest, _ = row
+        if status != DONE and self.retry_failed:
+            return False
+        if self.rescan and not self._unchanged(uri, size, mtime, digest):
+            return False
+        with self._lock:
+            self.skipped += 1
+        return True
+
+    def mark(self, uri: str, error: str=None) -> None:
+        '''
+        Record the outcome of a uri: done when error is None, else failed.
+        The file of a uri done is stat'ed and hashed, call it off the event loop
+        '''
+        if error is None:
+            self.mark_done(uri)
+        else:
+            self.mark_failed(uri, error)
+
+    def mark_done(self, uri: str) -> None:
+        try:
+            size, mtime, digest = fingerprint(uri, self.hash_content)
+        except OSError:
+            size, mtime, digest = None, None, None
+        self._add((uri, DONE, size, mtime, digest, None, time.time()))
+
+    def mark_failed(self, uri: str, error: str=None) -> None:
+        self._add((uri, FAILED, None, None, None, None if error is None else str(error)[:1000], time.time()))
+
+    def _add(self, row: tuple) -> None:
+        with self._lock:
+            if row[1] == DONE:
+                self.done += 1
+            else:
+                self.failed += 1
+            self._pending.append(row)
+            if (len(self._pending) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush()
+
+    def flush(self) -> None:
+        '''
+        Write the outcomes recorded since the last flush, in one transaction
+        '''
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        rows, self._pending = self._pending, []
+        self._last_flush = time.monotonic()
+        if not rows or self._db is None:
+            return
+        with self._db:
+            self._db.executemany(
+                'INSERT INTO ocr_progress (uri, status, size, mtime, digest, attempts, error, updated) '
+                'VALUES (?, ?, ?, ?, ?, 1, ?, ?) '
+                'ON CONFLICT(uri) DO UPDATE SET status = excluded.status, size = excluded.size, '
+                'mtime = excluded.mtime, digest = excluded.digest, attempts = ocr_progress.attempts + 1, '
+                'error = excluded.error, updated = excluded.updated', rows)
+        logger.debug(f'<Progress: {len(rows)} outcomes written>')
+
+    def counts(self) -> Dict[str, int]:
+        '''
+        :return: {status: number of uris} of the index
+        '''
+        self.flush()
+        with self._lock:
+            return dict(self._db.execute('SELECT status, COUNT(*) FROM ocr_progress GROUP BY status').fetchall())
+
+    def forget(self, uri: str) -> None:
+        '''
+        Drop the progress of a uri, the next run recognizes it again
+        '''
+        self.flush()
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM ocr_progress WHERE uri = ?', (uri, ))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending = []
+            with self._db:
+                self._db.execute('DELETE FROM ocr_progress')
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
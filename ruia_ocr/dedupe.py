@@ -0,0 +1,367 @@
+# Near-duplicate suppression: gray grid of the image -> perceptual hash of the grid -> indexed hashes within threshold
+# -> grids of the same shape within tolerance -> the result already recognized.
+# The index lives in memory or in a sqlite file reused by the next runs
+import os
+import zlib
+import sqlite3
+import threading
+
+from PIL import Image
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from ruia_ocr.imaging import SOURCE_SIZE, RegionStr, ImageSource, RegionPlan, crop_by_region, image_file
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is only needed by the perceptual hashes and the grids
+    np = None
+
+__all__ = ['dhash', 'phash', 'image_hash', 'image_grid', 'image_fingerprint', 'hamming', 'BKTree', 'DedupeKey',
+           'DedupeIndex']
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError('numpy is required by the perceptual hashes, pip install ruia_ocr[dedupe]')
+
+
+def _gray(image: Image.Image, size: Tuple[int, int]) -> 'np.ndarray':
+    _require_numpy()
+    return np.asarray(image.convert('L').resize(size, Image.BILINEAR), dtype=np.float32)
+
+
+def dhash(image: Image.Image, hash_size: int=8) -> int:
+    '''
+    Difference hash: whether each pixel is brighter than its right neighbour, hash_size ** 2 bits
+    '''
+    pixels = _gray(image, (hash_size + 1, hash_size))
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+@lru_cache(maxsize=8)
+def _dct_matrix(size: int) -> 'np.ndarray':
+    k = np.arange(size).reshape(-1, 1)
+    n = np.arange(size).reshape(1, -1)
+    matrix = np.sqrt(2.0 / size) * np.cos(np.pi * (2 * n + 1) * k / (2.0 * size))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+def phash(image: Image.Image, hash_size: int=8) -> int:
+    '''
+    DCT hash: whether each of the lowest frequencies is above their median, hash_size ** 2 bits.
+    Slower than dhash, more robust to the changes of contrast and gamma
+    '''
+    size = hash_size * 4
+    dct = _dct_matrix(size)
+    coeffs = dct.dot(_gray(image, (size, size))).dot(dct.T)[:hash_size, :hash_size]
+    # the dc coefficient is left out of the median
+    return _pack(coeffs > np.median(coeffs.ravel()[1:]))
+
+
+def _pack(bits: 'np.ndarray') -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+_HASHES = {'dhash': dhash, 'phash': phash}
+
+
+def image_hash(source: ImageSource, region: RegionStr=None, method: str='dhash', hash_size: int=8) -> int:
+    '''
+    Perceptual hash of the image once the region is applied.
+    A JPEG is draft decoded at a reduced size, the hash only needs a few pixels
+    '''
+    if isinstance(source, Image.Image):
+        return _HASHES[method](crop_by_region(source, region), hash_size)
+    with Image.open(image_file(source)) as image:
+        if image.format == 'JPEG':
+            size = image.size
+            image.draft(image.mode, (max(hash_size * 4, size[0] // 4), max(hash_size * 4, size[1] // 4)))
+            if image.size != size:
+                image.info[SOURCE_SIZE] = size
+        return _HASHES[method](crop_by_region(image, region), hash_size)
+
+
+def _grid_shape(size: Tuple[int, int], cell: int, max_cells: int) -> Tuple[int, int]:
+    '''
+    :return: (width, height) of the grid of an image of size, one pixel per cell x cell block,
+        max_cells at most along the longest edge
+    '''
+    width, height = size
+    cells = min(max_cells, max(1, -(-max(width, height) // cell)))
+    if width >= height:
+        return cells, max(1, round(cells * height / width))
+    return max(1, round(cells * width / height)), cells
+
+
+def _grid(image: Image.Image, region: RegionStr, cell: int, max_cells: int) -> Image.Image:
+    source_size = image.info.get(SOURCE_SIZE, image.size)
+    out_size = RegionPlan.compile(region, tuple(source_size)).size if region else source_size
+    shape = _grid_shape(out_size, cell, max_cells)
+    return crop_by_region(image, region).convert('L').resize(shape, Image.BOX)
+
+
+def image_grid(source: ImageSource, region: RegionStr=None, cell: int=8, max_cells: int=256) -> Image.Image:
+    '''
+    Gray grid of the image once the region is applied: every pixel is the mean of a cell x cell block,
+    the blocks grow when the longest edge would have more than max_cells of them.
+    A JPEG is draft decoded at a reduced size, with at least 4 pixels per cell along each edge
+    '''
+    if isinstance(source, Image.Image):
+        return _grid(source, region, cell, max_cells)
+    with Image.open(image_file(source)) as image:
+        if image.format == 'JPEG':
+            size = image.size
+            # at one pixel per cell the blocks of the decoder, not the cells, would be averaged
+            scale = max(size) / float(max(_grid_shape(size, cell, max_cells))) / 4
+            image.draft(image.mode, (int(size[0] / scale) + 1, int(size[1] / scale) + 1))
+            if image.size != size:
+                image.info[SOURCE_SIZE] = size
+        return _grid(image, region, cell, max_cells)
+
+
+def image_fingerprint(source: ImageSource, region: RegionStr=None, method: str='dhash', hash_size: int=8,
+                      cell: int=8, max_cells: int=256) -> Tuple[int, Tuple[int, int], bytes]:
+    '''
+    :return: (perceptual hash of the grid, shape of the grid, bytes of the grid), see image_grid and DedupeKey
+    '''
+    grid = image_grid(source, region, cell, max_cells)
+    return _HASHES[method](grid, hash_size), grid.size, grid.tobytes()
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class BKTree(object):
+    '''
+    Burkhard-Keller tree of hashes under the hamming distance,
+    a search only visits the children whose distance can be within the threshold
+    '''
+
+    __slots__ = ('_root', '_size')
+
+    def __init__(self):
+        # node: [hash, {distance: child node}]
+        self._root: list = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value: int) -> None:
+        if self._root is None:
+            self._root = [value, {}]
+            self._size += 1
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                self._size += 1
+                return
+            node = child
+
+    def search(self, value: int, threshold: int) -> Optional[Tuple[int, int]]:
+        '''
+        :return: (distance, hash) of the nearest hash within threshold, None if there is none
+        '''
+        found = self.search_all(value, threshold)
+        return found[0] if found else None
+
+    def search_all(self, value: int, threshold: int) -> List[Tuple[int, int]]:
+        '''
+        :return: (distance, hash) of every hash within threshold, the nearest first
+        '''
+        found = []
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            node_value, children = nodes.pop()
+            distance = hamming(value, node_value)
+            if distance <= threshold:
+                found.append((distance, node_value))
+            for child_distance, child in children.items():
+                if distance - threshold <= child_distance <= distance + threshold:
+                    nodes.append(child)
+        found.sort()
+        return found
+
+
+class DedupeKey(NamedTuple):
+    '''
+    hash: perceptual hash of the grid
+    scope: everything else the result depends on, see OcrCache.make_meta
+    shape: (width, height) of the grid
+    grid: its gray pixels, see image_grid
+    '''
+    hash: int
+    scope: str
+    shape: Tuple[int, int]
+    grid: bytes
+
+
+class DedupeIndex(object):
+    '''
+    Index of the images already recognized, with their results.
+    An image found in the index reuses the result instead of calling the ocr api.
+
+    Every image is reduced to a gray grid, one pixel per cell x cell block (a JPEG is draft decoded to it).
+    The perceptual hash of the grid finds the candidates within threshold bits in a BK-tree,
+    a candidate is a duplicate when its grid has the same shape and no cell differs by more than tolerance
+    gray levels. So the same picture re-encoded, saved in another format, copied to another path
+    or sent as bytes reuses the result, while text images differing by a few characters (prices, captchas,
+    invoice numbers) differ by far more than tolerance in the cells of those characters.
+    The shape is the size class: an image resized by more than a cell is not matched.
+    Characters smaller than a cell can change unnoticed, lower cell for small print.
+
+    path: sqlite file keeping the index between runs, None means memory only
+    threshold: max hamming distance of two candidates, out of hash_size ** 2 bits
+    method: 'dhash' or 'phash'
+    cell: edge of the block averaged by a pixel of the grid, in pixels of the image
+    max_cells: max pixels of the grid along the longest edge
+    tolerance: max difference of a pixel of two duplicate grids, 0 needs the same grid
+    '''
+
+    METHODS = tuple(_HASHES)
+
+    def __init__(self, path: str=None, threshold: int=6, method: str='dhash', hash_size: int=8, cell: int=8,
+                 max_cells: int=256, tolerance: int=16):
+        if method not in self.METHODS:
+            raise ValueError('DedupeIndex method must in %s' % (self.METHODS, ))
+        _require_numpy()
+        self.path = path
+        self.threshold = threshold
+        self.method = method
+        self.hash_size = hash_size
+        self.cell = cell
+        self.max_cells = max_cells
+        self.tolerance = tolerance
+        self.lookups = 0
+        self.hits = 0
+        self._trees: Dict[str, BKTree] = {}
+        # (scope, hash): [(id, shape)]
+        self._entries: Dict[Tuple[str, int], List[Tuple[int, Tuple[int, int]]]] = {}
+        # id: (compressed grid, value), memory only
+        self._values: Dict[int, Tuple[bytes, bytes]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection = None
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS ocr_dedupe (id INTEGER PRIMARY KEY, '
+                             'scope TEXT, method TEXT, hash TEXT, width INTEGER, height INTEGER, '
+                             'grid BLOB, value BLOB)')
+            self._db.commit()
+            rows = self._db.execute('SELECT id, scope, hash, width, height FROM ocr_dedupe WHERE method = ?',
+                                    (self._method_key, )).fetchall()
+            for row_id, scope, value, width, height in rows:
+                self._index(row_id, scope, int(value, 16), (width, height))
+
+    def __repr__(self):
+        return f'DedupeIndex<{self.path}, {self.method}, threshold={self.threshold}, hits={self.hits}>'
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def _method_key(self) -> str:
+        return f'{self.method}{self.hash_size}/{self.cell}x{self.max_cells}'
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'lookups': self.lookups,
+            'calls_avoided': self.hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'items': len(self),
+        }
+
+    def hash(self, source: ImageSource, region: RegionStr=None) -> int:
+        return image_hash(source, region, self.method, self.hash_size)
+
+    def fingerprint(self, source: ImageSource, region: RegionStr=None) -> Tuple[int, Tuple[int, int], bytes]:
+        return image_fingerprint(source, region, self.method, self.hash_size, self.cell, self.max_cells)
+
+    def _index(self, row_id: int, scope: str, value: int, shape: Tuple[int, int]) -> None:
+        tree = self._trees.get(scope)
+        if tree is None:
+            tree = self._trees[scope] = BKTree()
+        tree.add(value)
+        self._entries.setdefault((scope, value), []).append((row_id, tuple(shape)))
+        self._count += 1
+
+    def _load(self, row_id: int) -> Tuple[bytes, bytes]:
+        if self._db is None:
+            return self._values[row_id]
+        grid, value = self._db.execute('SELECT grid, value FROM ocr_dedupe WHERE id = ?', (row_id, )).fetchone()
+        return bytes(grid), bytes(value)
+
+    def _same(self, grid: bytes, other: bytes) -> bool:
+        a = np.frombuffer(grid, dtype=np.uint8).astype(np.int16)
+        b = np.frombuffer(zlib.decompress(other), dtype=np.uint8).astype(np.int16)
+        return int(np.abs(a - b).max()) <= self.tolerance
+
+    def _match(self, key: DedupeKey) -> Optional[bytes]:
+        '''
+        :return: the value of the nearest indexed duplicate, None if there is none
+        '''
+        tree = self._trees.get(key.scope)
+        if tree is None:
+            return None
+        for _, value in tree.search_all(key.hash, self.threshold):
+            for row_id, shape in self._entries[(key.scope, value)]:
+                if shape != tuple(key.shape):
+                    continue
+                grid, body = self._load(row_id)
+                if self._same(key.grid, grid):
+                    return body
+        return None
+
+    def get(self, key: DedupeKey) -> Optional[bytes]:
+        '''
+        :return: the result body of a duplicate image, None if there is none
+        '''
+        with self._lock:
+            self.lookups += 1
+            value = self._match(key)
+            if value is not None:
+                self.hits += 1
+            return value
+
+    def add(self, key: DedupeKey, value: bytes) -> None:
+        grid = zlib.compress(key.grid)
+        with self._lock:
+            if self._db is None:
+                row_id = self._count
+                self._values[row_id] = (grid, value)
+            else:
+                row_id = self._db.execute('INSERT INTO ocr_dedupe (scope, method, hash, width, height, grid, value) '
+                                          'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                          (key.scope, self._method_key, '%x' % key.hash, key.shape[0],
+                                           key.shape[1], grid, value)).lastrowid
+                self._db.commit()
+            self._index(row_id, key.scope, key.hash, key.shape)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._trees.clear()
+            self._entries.clear()
+            self._values.clear()
+            self._count = 0
+            if self._db is not None:
+                self._db.execute('DELETE FROM ocr_dedupe')
+                self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -8,3 +8,19 @@ class ServicePayloadsError(Exception):
 
 class OcrServiceNotFoundError(Exception):
     pass
+
+
+class AccessTokenError(Exception):
+    pass
+
+
+class CompositeOcrError(Exception):
+    pass
+
+
+class QuotaExhaustedError(Exception):
+    pass
+
+
+class ImageFetchError(Exception):
+    pass
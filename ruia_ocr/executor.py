@@ -0,0 +1,66 @@
+import os
+import asyncio
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+__all__ = ['OcrExecutor']
+
+
+class OcrExecutor(object):
+    '''
+    Run the cpu bound image stage (decode -> crop -> encode -> base64) off the event loop.
+
+    kind: 'process' (default) or 'thread'.
+        A process pool only runs picklable module level functions: the image stages of ruia_ocr.imaging,
+        tiling, batching, dedupe and prefilter are module level for this reason, see preprocess_image.
+        A thread pool runs the hooks of the service itself, overriding image_convert_ocr still works.
+    max_workers: size of the pool, None means os.cpu_count()
+    max_pending: cap on the jobs queued or running in the pool,
+        callers beyond it wait on the event loop instead of piling images up in the pool's queue
+    '''
+
+    KINDS = ('process', 'thread')
+
+    def __init__(self, kind: str='process', max_workers: int=None, max_pending: int=None):
+        if kind not in self.KINDS:
+            raise ValueError('OcrExecutor kind must in %s' % (self.KINDS, ))
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 2
+        self._pool: Executor = None
+        self._semaphore: asyncio.Semaphore = None
+
+    def __repr__(self):
+        return f'OcrExecutor<{self.kind}, workers={self.max_workers}, pending={self.max_pending}>'
+
+    @property
+    def is_process(self) -> bool:
+        return self.kind == 'process'
+
+    @property
+    def pool(self) -> Executor:
+        if self._pool is None:
+            if self.is_process:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='ruia_ocr')
+        return self._pool
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        '''
+        Run func(*args, **kwargs) in the pool, waiting for a free slot when max_pending jobs are in flight
+        '''
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        async with self._semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.pool, partial(func, *args, **kwargs))
+
+    def shutdown(self, wait: bool=True) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+        self._semaphore = None
@@ -0,0 +1,185 @@
+# Download stage of the remote images the ocr api can't fetch itself, such as https links:
+# bounded concurrency, a size limit checked while streaming, and conditional requests against a local cache
+import json
+import asyncio
+import threading
+
+import aiohttp
+import requests
+
+from typing import Optional, Tuple
+
+from ruia.utils import get_logger
+from ruia_ocr.cache import OcrCache
+from ruia_ocr.exceptions import ImageFetchError
+
+__all__ = ['ImageFetcher']
+
+logger = get_logger('Ocr')
+
+# answers worth a retry, the other 4xx are not
+_RETRY_STATUSES = (408, 429)
+
+_Validated = Tuple[Optional[str], Optional[str], bytes]
+
+
+class ImageFetcher(object):
+    '''
+    Download the remote images in memory, the bytes go straight to the region and encode stage of the service.
+
+    schemes: url schemes downloaded by the fetcher, by default only https,
+        which the ocr api can't fetch itself, add 'http' to download every remote image
+    concurrency: max downloads at once, on top of the connection limit of the session
+    max_bytes: a download over this size is aborted, checked on Content-Length first and then while streaming
+    timeout: seconds of one whole download
+    cache: OcrCache keeping the images with an ETag or a Last-Modified, a url downloaded again is sent with
+        If-None-Match/If-Modified-Since and a 304 answer reuses the cached bytes.
+        OcrCache() keeps them in memory only, OcrCache(path) in a local sqlite file too. None means no cache
+    headers: extra headers of the downloads, such as a User-Agent or a Referer
+    '''
+
+    def __init__(self,
+                 schemes: Tuple[str, ...]=('https', ),
+                 concurrency: int=16,
+                 max_bytes: int=10 * 1024 * 1024,
+                 timeout: float=30.0,
+                 chunk_size: int=64 * 1024,
+                 cache: OcrCache=None,
+                 headers: dict=None):
+        self.schemes = tuple(scheme.lower() + '://' for scheme in schemes)
+        self.concurrency = concurrency
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.headers = dict(headers or {})
+        self.downloads = 0
+        self.not_modified = 0
+        self.bytes = 0
+        self.too_large = 0
+        self.errors = 0
+        self._semaphore: asyncio.Semaphore = None
+        self._sync_semaphore = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'ImageFetcher<{self.schemes}, concurrency={self.concurrency}, max_bytes={self.max_bytes}>'
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'downloads': self.downloads,
+            'not_modified': self.not_modified,
+            'bytes': self.bytes,
+            'too_large': self.too_large,
+            'errors': self.errors,
+        }
+
+    def accepts(self, uri) -> bool:
+        '''
+        :return: whether the uri is a remote image downloaded by this fetcher
+        '''
+        return isinstance(uri, str) and uri.lower().startswith(self.schemes)
+
+    @staticmethod
+    def _cache_key(url: str) -> str:
+        return 'fetch:' + url
+
+    def _cached(self, url: str) -> Optional[_Validated]:
+        if self.cache is None:
+            return None
+        value = self.cache.get(self._cache_key(url))
+        if value is None:
+            return None
+        meta, _, body = value.partition(b'\n')
+        etag, last_modified = json.loads(meta)
+        return etag, last_modified, body
+
+    def _store(self, url: str, etag: Optional[str], last_modified: Optional[str], body: bytes) -> None:
+        if self.cache is not None and (etag or last_modified):
+            self.cache.set(self._cache_key(url), json.dumps([etag, last_modified]).encode() + b'\n' + body)
+
+    def _request_headers(self, cached: Optional[_Validated]) -> dict:
+        headers = dict(self.headers)
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def _failed(self, url: str, status: int) -> None:
+        '''
+        Count a download answered with another status than 200, raise ImageFetchError when a retry can't help,
+        the caller raises the http error of the others
+        '''
+        with self._lock:
+            self.errors += 1
+        if status < 500 and status not in _RETRY_STATUSES:
+            raise ImageFetchError(f'Download of {url} failed: status {status}')
+
+    def _check_size(self, url: str, size: Optional[int]) -> None:
+        if size is not None and size > self.max_bytes:
+            with self._lock:
+                self.too_large += 1
+            raise ImageFetchError(f'Download of {url} is over {self.max_bytes} bytes')
+
+    def _downloaded(self, url: str, body: bytes, headers) -> bytes:
+        with self._lock:
+            self.downloads += 1
+            self.bytes += len(body)
+        self._store(url, headers.get('ETag'), headers.get('Last-Modified'), body)
+        logger.debug(f'<Download {url}: {len(body)} bytes>')
+        return body
+
+    def _reused(self, url: str, cached: _Validated) -> bytes:
+        with self._lock:
+            self.not_modified += 1
+        logger.debug(f'<Download {url}: not modified>')
+        return cached[2]
+
+    async def fetch(self, url: str, session: aiohttp.ClientSession) -> bytes:
+        '''
+        Download the image, at most concurrency at once
+        :param session: the pooled session, such as the one of the spider or the service
+        :return: the bytes of the image, ImageFetchError when it can't be fetched by a retry
+        '''
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            cached = self._cached(url)
+            async with session.get(url, headers=self._request_headers(cached),
+                                   timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+                if resp.status == 304 and cached is not None:
+                    return self._reused(url, cached)
+                if resp.status != 200:
+                    self._failed(url, resp.status)
+                    resp.raise_for_status()
+                self._check_size(url, resp.content_length)
+                buffer = bytearray()
+                async for chunk in resp.content.iter_chunked(self.chunk_size):
+                    buffer += chunk
+                    self._check_size(url, len(buffer))
+                return self._downloaded(url, bytes(buffer), resp.headers)
+
+    def fetch_sync(self, url: str, session: requests.Session=None) -> bytes:
+        '''
+        Same as fetch, with requests
+        '''
+        with self._sync_semaphore:
+            cached = self._cached(url)
+            with (session or requests).get(url, headers=self._request_headers(cached), stream=True,
+                                           timeout=self.timeout) as resp:
+                if resp.status_code == 304 and cached is not None:
+                    return self._reused(url, cached)
+                if resp.status_code != 200:
+                    self._failed(url, resp.status_code)
+                    resp.raise_for_status()
+                length = resp.headers.get('Content-Length')
+                self._check_size(url, int(length) if length and length.isdigit() else None)
+                buffer = bytearray()
+                for chunk in resp.iter_content(self.chunk_size):
+                    buffer += chunk
+                    self._check_size(url, len(buffer))
+                return self._downloaded(url, bytes(buffer), resp.headers)
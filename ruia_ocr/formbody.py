@@ -0,0 +1,129 @@
+# Streaming application/x-www-form-urlencoded bodies: the image field is base64 encoded and escaped
+# chunk by chunk while the body is written, instead of being urlencoded into one more copy of the image
+from urllib.parse import quote_plus
+from typing import Any, Iterator, Mapping
+
+from aiohttp import payload
+
+from ruia_ocr.imaging import BYTES_TYPES, RawImage, payload_size
+
+__all__ = ['FormBody', 'FormPayload']
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+_BASE64_SPECIALS = b'+/='
+
+
+def _is_base64(chunk: bytes) -> bool:
+    return chunk.translate(None, _BASE64_SPECIALS).isalnum()
+
+
+def _escape(chunk: bytes) -> bytes:
+    if _is_base64(chunk):
+        # only 3 characters of base64 need escaping, str.replace runs at C speed unlike quote_plus
+        return chunk.replace(b'+', b'%2B').replace(b'/', b'%2F').replace(b'=', b'%3D')
+    return quote_plus(chunk, safe='').encode('ascii')
+
+
+def _escaped_size(chunk: bytes) -> int:
+    if _is_base64(chunk):
+        return payload_size(chunk)
+    return len(quote_plus(chunk, safe=''))
+
+
+class FormBody(object):
+    '''
+    The urlencoded form of fields, produced chunk by chunk: at most chunk_size characters of a value
+    are encoded at a time. A str value is sliced, a RawImage is base64 encoded from its file,
+    bytes are sent as they are like urlencode does. The exact size is known before the first chunk,
+    so the body is sent with a Content-Length, and it can be iterated again by a retry.
+
+    requests streams it as it is: session.post(url, data=FormBody(fields)),
+    aiohttp through FormPayload: session.post(url, data=FormPayload(FormBody(fields)))
+    '''
+
+    def __init__(self, fields: Mapping[str, Any], chunk_size: int=64 * 1024):
+        self.fields = dict(fields)
+        self.chunk_size = chunk_size
+        self._size = None
+
+    def __repr__(self):
+        return f'FormBody<{list(self.fields)}, {self.size} bytes>'
+
+    def _value_chunks(self, value: Any) -> Iterator[bytes]:
+        step = self.chunk_size
+        if isinstance(value, RawImage):
+            # 3 bytes of the file are 4 of base64
+            yield from value.chunks(step // 4 * 3)
+        elif isinstance(value, BYTES_TYPES):
+            data = memoryview(value).cast('B')
+            for start in range(0, len(data), step):
+                yield bytes(data[start:start + step])
+        else:
+            value = value if isinstance(value, str) else str(value)
+            for start in range(0, len(value), step):
+                yield value[start:start + step].encode('utf-8')
+
+    def _names(self) -> Iterator[bytes]:
+        for index, name in enumerate(self.fields):
+            yield ('&' if index else '').encode() + quote_plus(str(name), safe='').encode('ascii') + b'='
+
+    def __iter__(self) -> Iterator[bytes]:
+        for name, value in zip(self._names(), self.fields.values()):
+            yield name
+            for chunk in self._value_chunks(value):
+                yield _escape(chunk)
+
+    def __len__(self):
+        return self.size
+
+    def __bytes__(self):
+        return b''.join(self)
+
+    @property
+    def size(self) -> int:
+        '''
+        :return: bytes of the whole body, without encoding it into memory
+        '''
+        if self._size is None:
+            size = 0
+            for name, value in zip(self._names(), self.fields.values()):
+                size += len(name)
+                if isinstance(value, RawImage):
+                    size += value.payload_size
+                else:
+                    size += sum(_escaped_size(chunk) for chunk in self._value_chunks(value))
+            self._size = size
+        return self._size
+
+
+class FormPayload(payload.Payload):
+    '''
+    aiohttp payload of a FormBody, written chunk by chunk with its Content-Length
+    '''
+
+    def __init__(self, value: FormBody, *args, **kwargs):
+        kwargs.setdefault('content_type', FORM_CONTENT_TYPE)
+        super().__init__(value, *args, **kwargs)
+        self._size = value.size
+
+    @property
+    def fields(self) -> dict:
+        return self._value.fields
+
+    def decode(self, encoding: str='utf-8', errors: str='strict') -> str:
+        return bytes(self._value).decode(encoding, errors)
+
+    async def write(self, writer) -> None:
+        for chunk in self._value:
+            await writer.write(chunk)
+
+    async def write_with_length(self, writer, content_length) -> None:
+        if content_length is None:
+            return await self.write(writer)
+        for chunk in self._value:
+            if content_length <= 0:
+                break
+            chunk = chunk[:content_length]
+            content_length -= len(chunk)
+            await writer.write(chunk)
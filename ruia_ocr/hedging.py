@@ -0,0 +1,143 @@
+# Hedged calls: a call still running after a percentile of the recent latencies gets a duplicate,
+# the first successful one wins and the other one is cancelled
+import time
+import asyncio
+import threading
+
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+__all__ = ['HedgePolicy', 'hedged']
+
+
+class HedgePolicy(object):
+    '''
+    When a duplicate of a call is sent, and how many duplicates can be sent.
+
+    percentile: a duplicate is sent once a call is slower than this percentile of the recent latencies
+    min_delay: lower bound of the delay before a duplicate, seconds
+    max_delay: upper bound of the delay, used until min_samples latencies are known
+    budget: max duplicates per call, every call earns budget tokens and a duplicate spends one
+    burst: max tokens saved up, so many duplicates can be sent in a row after a quiet period
+    window: number of recent latencies the percentile is computed on
+    '''
+
+    def __init__(self,
+                 percentile: float=0.95,
+                 min_delay: float=0.05,
+                 max_delay: float=2.0,
+                 budget: float=0.05,
+                 burst: float=5.0,
+                 window: int=500,
+                 min_samples: int=20):
+        if not 0 < percentile < 1:
+            raise ValueError('percentile must be between 0 and 1')
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedges = 0
+        self.wins = 0
+        self.denied = 0
+        self._tokens = burst
+        self._delay: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'HedgePolicy<p{self.percentile * 100:g}, delay={self.delay():.3f}s, budget={self.budget}>'
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'hedges': self.hedges,
+            'wins': self.wins,
+            'denied': self.denied,
+            'hedge_rate': self.hedges / self.calls if self.calls else 0.0,
+            'delay': self.delay(),
+        }
+
+    def delay(self) -> float:
+        '''
+        :return: the seconds a call runs before its duplicate is sent
+        '''
+        with self._lock:
+            if self._delay is None:
+                if len(self.latencies) < self.min_samples:
+                    self._delay = self.max_delay
+                else:
+                    latencies = sorted(self.latencies)
+                    value = latencies[min(len(latencies) - 1, int(len(latencies) * self.percentile))]
+                    self._delay = min(self.max_delay, max(self.min_delay, value))
+            return self._delay
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            self._delay = None
+
+    def start(self) -> None:
+        '''
+        A call starts, it earns its share of the budget
+        '''
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def allow(self) -> bool:
+        '''
+        :return: whether the budget allows one more duplicate, which is counted then
+        '''
+        with self._lock:
+            if self._tokens < 1:
+                self.denied += 1
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+
+def _succeeded(task: asyncio.Future, is_ok: Callable[[Any], bool]=None) -> bool:
+    return not task.cancelled() and task.exception() is None and (is_ok is None or is_ok(task.result()))
+
+
+async def hedged(policy: HedgePolicy, primary: Callable[[], Awaitable], secondary: Callable[[], Awaitable],
+                 is_ok: Callable[[Any], bool]=None) -> Any:
+    '''
+    Run primary(), and secondary() too once primary is slower than policy.delay() and the budget allows it.
+    The first result passing is_ok wins and the other call is cancelled,
+    when both fail the outcome of primary is returned or raised.
+
+    :param primary: coroutine function of the call
+    :param secondary: coroutine function of its duplicate, such as the same call with another credential
+    :param is_ok: whether a result is a success, None means any result without exception
+    '''
+    policy.start()
+    start = time.perf_counter()
+    first = asyncio.ensure_future(primary())
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=policy.delay())
+        if done or not policy.allow():
+            result = await first
+            policy.record(time.perf_counter() - start)
+            return result
+        second = asyncio.ensure_future(secondary())
+        pending.add(second)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda t: t is not first):
+                if _succeeded(task, is_ok):
+                    # the latency of a primary losing is known to be at least this much
+                    policy.record(time.perf_counter() - start)
+                    if task is second:
+                        policy.wins += 1
+                    return task.result()
+        return first.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,498 @@
+# Pure image helpers of the ocr pipeline: decode -> crop/stitch -> encode -> base64
+# Everything here is module level so that it can be shipped to a process pool
+import os
+import mmap
+import time
+import base64
+import struct
+
+from PIL import Image
+from io import BytesIO
+from functools import lru_cache
+from typing import Any, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from ruia_ocr.exceptions import ImageTypeError
+
+__all__ = ['parse_region', 'RegionPlan', 'crop_by_region', 'check_ocr_size', 'encode_base64',
+           'EncoderPolicy', 'RawImage', 'EncodedImage', 'encode_image', 'image_header', 'passthrough_image',
+           'open_image', 'preprocess_image']
+
+_Number = Union[int, float]
+
+Region = Tuple[_Number, _Number, _Number, _Number] # (x1, y1, x2, y2)
+
+RegionStr = str #  x1,y1,x2,y2;...  example 1,1,200,200;1,1,0.9,0.9
+
+ImageBytes = Union[bytes, bytearray, memoryview]
+
+# local image path, remote image url, the bytes of an image file or PIL.Image
+ImageSource = Union[str, ImageBytes, Image.Image]
+
+BYTES_TYPES = (bytes, bytearray, memoryview)
+
+MAX_EDGE = 4096
+
+MIN_EDGE = 15
+
+# base64 and urlencode of the image can not exceed 4M
+MAX_PAYLOAD_BYTES = 4 * 1024 * 1024
+
+# image.info key of the size before draft decoding, regions are relative to it
+SOURCE_SIZE = 'ruia_ocr.source_size'
+
+
+def parse_region(size: Tuple[int, int], region: RegionStr) -> List[Region]:
+    '''
+    region: 1,1,200,200 or 1,1, 0.9, 0.9
+    size: (width, height) of the source image
+    '''
+    width, height = size
+    boxs = []
+    for v in region.strip(';').split(';'):
+        box = list((map(float, v.split(','))))
+        for index, coord in enumerate(box):
+            if index % 2 == 0:
+                box[index] = width * coord if coord < 1 else coord
+            else:
+                box[index] = height * coord if coord < 1 else coord
+
+        box = tuple(map(int, box))
+        boxs.append(box)
+    return boxs
+
+
+class RegionPlan(object):
+    '''
+    A RegionStr compiled for one image size: the crop boxes, the offset of every box on the stitched canvas
+    and the size of the canvas. Plans are cached per (region, size), see RegionPlan.compile
+    '''
+
+    __slots__ = ('boxes', 'offsets', 'size', 'source_size')
+
+    def __init__(self, boxes: List[Region], source_size: Tuple[int, int]):
+        self.boxes = tuple(boxes)
+        self.source_size = source_size
+        offsets, top, width = [], 0, 0
+        for x1, y1, x2, y2 in self.boxes:
+            offsets.append(top)
+            top += y2 - y1
+            width = max(width, x2 - x1)
+        self.offsets = tuple(offsets)
+        self.size = (width, top)
+
+    def __repr__(self):
+        return f'RegionPlan<{self.boxes}, size={self.size}>'
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def compile(region: RegionStr, size: Tuple[int, int]) -> 'RegionPlan':
+        return RegionPlan(parse_region(size, region), size)
+
+    def apply(self, image: Image.Image) -> Image.Image:
+        '''
+        Crop every box and stitch them by row, image may be a draft decoded (reduced) source
+        '''
+        boxes, offsets = self.boxes, self.offsets
+        canvas_size = self.size
+        if image.size != self.source_size:
+            rx = image.width / float(self.source_size[0])
+            ry = image.height / float(self.source_size[1])
+            boxes = [(int(x1 * rx), int(y1 * ry), int(x2 * rx), int(y2 * ry)) for x1, y1, x2, y2 in boxes]
+            offsets, top, width = [], 0, 0
+            for x1, y1, x2, y2 in boxes:
+                offsets.append(top)
+                top += y2 - y1
+                width = max(width, x2 - x1)
+            canvas_size = (width, top)
+        if len(boxes) == 1:
+            img = image.crop(boxes[0])
+            return img if img.mode == 'RGB' else img.convert('RGB')
+        img_new = Image.new('RGB', canvas_size)
+        for box, top in zip(boxes, offsets):
+            img_new.paste(image.crop(box), (0, top))
+        return img_new
+
+
+def crop_by_region(image: Image.Image, region: RegionStr=None) -> Image.Image:
+    '''
+    Crop every box of the region and stitch them by row into a new image
+    '''
+    if not region:
+        return image
+    source_size = image.info.get(SOURCE_SIZE, image.size)
+    return RegionPlan.compile(region, tuple(source_size)).apply(image)
+
+
+def check_ocr_size(image: Image.Image, max_edge: int=MAX_EDGE, min_edge: int=MIN_EDGE) -> None:
+    '''
+    Raise ImageTypeError if the image is out of the size limits of the ocr api
+    '''
+    if max(image.height, image.width) > max_edge:
+        raise ImageTypeError(
+            'Baidu-ocr \'s longest edge of the picture can not exceed %s px' % max_edge)
+    if min(image.height, image.width) < min_edge:
+        raise ImageTypeError(
+            'Baidu-ocr \'s shortest edge of the picture cannot be less than %s px' % min_edge)
+
+
+def encode_base64(image: Image.Image, format: str='PNG') -> str:
+    image_io = BytesIO()
+    image.save(image_io, format=format)
+    return base64.b64encode(image_io.getvalue()).decode()
+
+
+def payload_size(b64: bytes) -> int:
+    '''
+    :return: size of the base64 data once urlencoded, `+`, `/` and `=` become 3 bytes
+    '''
+    return len(b64) + 2 * (b64.count(b'+') + b64.count(b'/') + b64.count(b'='))
+
+
+class EncoderPolicy(object):
+    '''
+    How the image is encoded before uploading, to send as few bytes as the ocr api allows.
+
+    format: 'PNG', 'JPEG' or 'AUTO', AUTO keeps PNG when it is at most lossless_max_bytes, else JPEG
+    quality: JPEG quality
+    max_edge: downscale so that the longest edge is at most max_edge px, None means never downscale
+    target_dpi: downscale images whose dpi is higher than target_dpi
+    max_payload_bytes: hard budget of the urlencoded base64 data, lower the JPEG quality down to min_quality
+        and then downscale until it fits, ImageTypeError if it can't. None means no budget
+    report_savings: also encode a PNG to report the bytes saved against it, costs an extra encoding
+    passthrough: send the original file as it is when it needs no downscaling and fits the budget,
+        see passthrough_image, False means always decode and encode
+    '''
+
+    FORMATS = ('PNG', 'JPEG', 'AUTO')
+
+    def __init__(self,
+                 format: str='AUTO',
+                 quality: int=85,
+                 lossless_max_bytes: int=256 * 1024,
+                 max_edge: Optional[int]=MAX_EDGE,
+                 target_dpi: Optional[int]=None,
+                 max_payload_bytes: Optional[int]=MAX_PAYLOAD_BYTES,
+                 min_quality: int=40,
+                 report_savings: bool=False,
+                 passthrough: bool=True):
+        format = format.upper()
+        if format not in self.FORMATS:
+            raise ValueError('EncoderPolicy format must in %s' % (self.FORMATS, ))
+        self.format = format
+        self.quality = quality
+        self.lossless_max_bytes = lossless_max_bytes
+        self.max_edge = max_edge
+        self.target_dpi = target_dpi
+        self.max_payload_bytes = max_payload_bytes
+        self.min_quality = min(min_quality, quality)
+        self.report_savings = report_savings
+        self.passthrough = passthrough
+
+    def __repr__(self):
+        return f'EncoderPolicy<{self.format}, quality={self.quality}, max_edge={self.max_edge}>'
+
+    def scale(self, image: Image.Image) -> float:
+        '''
+        :return: the downscale factor of the image, 1 means keep the size
+        '''
+        return self.scale_size(image.size, image.info.get('dpi'))
+
+    def scale_size(self, size: Tuple[int, int], dpi: Tuple[float, float]=None) -> float:
+        factor = 1.0
+        if self.target_dpi and dpi and dpi[0] and dpi[0] > self.target_dpi:
+            factor = self.target_dpi / float(dpi[0])
+        if self.max_edge and max(size) * factor > self.max_edge:
+            factor = self.max_edge / float(max(size))
+        # never below the shortest edge the ocr api accepts
+        return max(factor, min(1.0, MIN_EDGE / float(min(size) or 1)))
+
+
+class RawImage(object):
+    '''
+    The original bytes of an image file sent as they are: they are base64 encoded chunk by chunk
+    while the request body is written, see ruia_ocr.formbody.FormBody. Nothing but the path is pickled
+    for a local file, so a process pool hands it back for free.
+
+    source: local image path, or the bytes of the file
+    '''
+
+    __slots__ = ('source', 'format', 'size', '_payload_size')
+
+    def __init__(self, source: Union[str, 'ImageBytes'], format: str=None, size: Tuple[int, int]=None):
+        self.source = source
+        self.format = format
+        self.size = size
+        self._payload_size: Optional[int] = None
+
+    def __repr__(self):
+        source = self.source if isinstance(self.source, str) else f'<{len(self.source)} bytes>'
+        return f'RawImage<{source}, {self.format}, {self.size}>'
+
+    def __getstate__(self):
+        return self.source, self.format, self.size, self._payload_size
+
+    def __setstate__(self, state):
+        self.source, self.format, self.size, self._payload_size = state
+
+    def chunks(self, chunk_size: int=48 * 1024) -> Iterator[bytes]:
+        '''
+        :param chunk_size: bytes of the file encoded at a time, rounded down to a multiple of 3
+        :return: the base64 data of the file, chunk by chunk
+        '''
+        step = max(3, chunk_size // 3 * 3)
+        if isinstance(self.source, BYTES_TYPES):
+            data = memoryview(self.source).cast('B')
+            for start in range(0, len(data), step):
+                yield base64.b64encode(data[start:start + step])
+            return
+        with open(self.source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start in range(0, len(data), step):
+                yield base64.b64encode(data[start:start + step])
+
+    @property
+    def b64_size(self) -> int:
+        size = len(self.source) if isinstance(self.source, BYTES_TYPES) else os.path.getsize(self.source)
+        return (size + 2) // 3 * 4
+
+    @property
+    def payload_size(self) -> int:
+        '''
+        :return: size of the base64 data once urlencoded, counted by one encoding pass the first time
+        '''
+        if self._payload_size is None:
+            self._payload_size = sum(payload_size(chunk) for chunk in self.chunks())
+        return self._payload_size
+
+
+class EncodedImage(NamedTuple):
+    '''
+    data: base64 data sent to the ocr api, a RawImage for a file sent as it is
+    bytes: size of data once urlencoded
+    baseline_bytes: size of the plain PNG encoding, None if not measured
+    timings: seconds of the decode, region and encode stages, None if not measured
+    passthrough: data is the original file, it was not decoded
+    '''
+    data: Union[str, RawImage]
+    format: str
+    size: Tuple[int, int]
+    bytes: int
+    baseline_bytes: Optional[int] = None
+    timings: Optional[Tuple[float, float, float]] = None
+    passthrough: bool = False
+
+    @property
+    def saved_bytes(self) -> Optional[int]:
+        if self.baseline_bytes is None:
+            return None
+        return self.baseline_bytes - self.bytes
+
+
+def _save(image: Image.Image, format: str, quality: int=None) -> bytes:
+    image_io = BytesIO()
+    if format == 'JPEG':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # transparent areas become white instead of black
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[-1])
+            image = background
+        elif image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(image_io, format='JPEG', quality=quality, optimize=True)
+    else:
+        image.save(image_io, format=format)
+    return base64.b64encode(image_io.getbuffer())
+
+
+def encode_image(image: Image.Image, policy: EncoderPolicy=None, check: bool=True) -> EncodedImage:
+    '''
+    Encode the image following the policy, None means a plain PNG like encode_base64
+    :param check: check the size limits of the ocr api, after downscaling
+    '''
+    if policy is None:
+        if check:
+            check_ocr_size(image)
+        data = _save(image, 'PNG')
+        return EncodedImage(data.decode(), 'PNG', image.size, payload_size(data))
+
+    factor = policy.scale(image)
+    if factor < 1:
+        image = image.resize((max(1, int(image.width * factor)), max(1, int(image.height * factor))),
+                             Image.LANCZOS)
+    if check:
+        check_ocr_size(image)
+
+    baseline = None
+    format, quality = policy.format, policy.quality
+    if format == 'PNG' or format == 'AUTO' or policy.report_savings:
+        png = _save(image, 'PNG')
+        baseline = payload_size(png) if policy.report_savings else None
+    if format == 'AUTO':
+        format = 'PNG' if payload_size(png) <= policy.lossless_max_bytes else 'JPEG'
+    data = png if format == 'PNG' else _save(image, 'JPEG', quality)
+
+    while policy.max_payload_bytes and payload_size(data) > policy.max_payload_bytes:
+        if format == 'JPEG' and quality > policy.min_quality:
+            quality = max(policy.min_quality, quality - 10)
+        else:
+            format = 'JPEG'
+            if min(image.size) * 0.8 < MIN_EDGE:
+                raise ImageTypeError('Baidu-ocr \'s image can not be encoded within %s bytes'
+                                     % policy.max_payload_bytes)
+            image = image.resize((int(image.width * 0.8), int(image.height * 0.8)), Image.LANCZOS)
+        data = _save(image, 'JPEG', quality)
+
+    return EncodedImage(data.decode(), format, image.size, payload_size(data), baseline)
+
+
+_SOF_MARKERS = (0xC0, 0xC1, 0xC2)
+
+# lossless, hierarchical and arithmetic coded JPEGs, which not every decoder supports
+_UNSUPPORTED_SOF_MARKERS = (0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+
+
+def _jpeg_header(data) -> Optional[Tuple[str, Tuple[int, int]]]:
+    index, end = 2, len(data)
+    while index + 4 <= end:
+        if data[index] != 0xFF:
+            return None
+        marker = data[index + 1]
+        if marker == 0xFF:
+            # fill byte
+            index += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            index += 2
+            continue
+        if marker in _SOF_MARKERS:
+            if index + 10 > end:
+                return None
+            precision, height, width, components = struct.unpack_from('>BHHB', data, index + 4)
+            # 8 bit gray or YCbCr, CMYK is left to the decoder
+            if precision != 8 or components not in (1, 3):
+                return None
+            return 'JPEG', (width, height)
+        if marker in _UNSUPPORTED_SOF_MARKERS or marker in (0xDA, 0xD9):
+            return None
+        index += 2 + struct.unpack_from('>H', data, index + 2)[0]
+    return None
+
+
+def image_header(data) -> Optional[Tuple[str, Tuple[int, int]]]:
+    '''
+    Read the format and size of a JPEG, PNG or BMP file from its header only, nothing is decoded or copied
+    :param data: bytes, memoryview or mmap of the whole file
+    :return: (format, (width, height)), None for another format or a header the ocr api may not accept
+    '''
+    if len(data) < 26:
+        return None
+    if data[:2] == b'\xff\xd8':
+        return _jpeg_header(data)
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR':
+        return 'PNG', struct.unpack_from('>II', data, 16)
+    if data[:2] == b'BM':
+        if struct.unpack_from('<I', data, 14)[0] == 12:
+            return 'BMP', struct.unpack_from('<HH', data, 18)
+        width, height = struct.unpack_from('<ii', data, 18)
+        # a negative height is a top-down bitmap
+        return 'BMP', (abs(width), abs(height))
+    return None
+
+
+def _passthrough(source, data, policy: EncoderPolicy=None, formats: Tuple[str, ...]=()) -> Optional[EncodedImage]:
+    header = image_header(data)
+    if header is None or header[0] not in formats:
+        return None
+    format, size = header
+    if max(size) > MAX_EDGE or min(size) < MIN_EDGE:
+        return None
+    if policy is not None and (policy.target_dpi or policy.scale_size(size) < 1):
+        return None
+    budget = MAX_PAYLOAD_BYTES if policy is None else policy.max_payload_bytes
+    # the base64 size is known before encoding
+    if budget and (len(data) + 2) // 3 * 4 > budget:
+        return None
+    raw = RawImage(source, format, size)
+    if budget and raw.payload_size > budget:
+        return None
+    return EncodedImage(raw, format, size, raw.payload_size, passthrough=True)
+
+
+def passthrough_image(source: ImageSource, region: RegionStr=None, policy: EncoderPolicy=None,
+                      formats: Tuple[str, ...]=('JPEG', 'PNG', 'BMP')) -> Optional[EncodedImage]:
+    '''
+    Send the original bytes of the image when the ocr api accepts them as they are:
+    no region, a format of formats, within the size limits and the payload budget, and nothing for the policy
+    to downscale. Only the header is parsed, the file is base64 encoded from a memory mapping.
+    :return: the original as a RawImage, None when the image has to be decoded and encoded
+    '''
+    if region or not formats or isinstance(source, Image.Image) or (policy is not None and not policy.passthrough):
+        return None
+    if isinstance(source, BYTES_TYPES):
+        return _passthrough(source, memoryview(source).cast('B'), policy, formats)
+    if source.startswith('http'):
+        return None
+    with open(source, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _passthrough(source, data, policy, formats)
+
+
+def image_file(source: ImageSource) -> Any:
+    '''
+    :return: what Image.open reads the source from, a file-like object for the bytes of an image
+    '''
+    if isinstance(source, BYTES_TYPES):
+        return BytesIO(source)
+    return source
+
+
+def open_image(source: ImageSource, region: RegionStr=None, policy: EncoderPolicy=None) -> Image.Image:
+    '''
+    Open the image lazily. When the policy downscales the (stitched) result by 2 or more,
+    ask the JPEG decoder for a reduced image (Image.draft) instead of decoding every pixel
+    '''
+    if isinstance(source, Image.Image):
+        return source
+    image = Image.open(image_file(source))
+    if policy is None or image.format != 'JPEG':
+        return image
+    size = image.size
+    out_size = RegionPlan.compile(region, size).size if region else size
+    if min(out_size) <= 0:
+        return image
+    factor = policy.scale_size(out_size, image.info.get('dpi'))
+    if factor <= 0.5:
+        image.draft(image.mode, (int(size[0] * factor) + 1, int(size[1] * factor) + 1))
+        if image.size != size:
+            image.info[SOURCE_SIZE] = size
+            dpi = image.info.get('dpi')
+            if dpi:
+                # the reduced image has fewer pixels per inch, else target_dpi would scale it again
+                image.info['dpi'] = (dpi[0] * image.size[0] / size[0], dpi[1] * image.size[1] / size[1])
+    return image
+
+
+def preprocess_image(source: ImageSource, region: RegionStr=None, check: bool=True,
+                     policy: EncoderPolicy=None, passthrough: Tuple[str, ...]=()) -> EncodedImage:
+    '''
+    The whole cpu bound stage of an ocr request
+    :param source: local image path, bytes of an image file or PIL.Image
+    :param region: RegionStr, crop and stitch before encoding
+    :param check: check the size limits of the ocr api
+    :param policy: EncoderPolicy, None means a plain PNG
+    :param passthrough: formats the ocr api accepts as they are, such a file is sent without decoding,
+        see passthrough_image
+    '''
+    start = time.perf_counter()
+    encoded = passthrough_image(source, region, policy, passthrough)
+    if encoded is not None:
+        return encoded._replace(timings=(0.0, 0.0, time.perf_counter() - start))
+    image = open_image(source, region, policy)
+    image.load()
+    decoded = time.perf_counter()
+    image = crop_by_region(image, region)
+    cropped = time.perf_counter()
+    encoded = encode_image(image, policy, check)
+    return encoded._replace(timings=(decoded - start, cropped - decoded, time.perf_counter() - cropped))
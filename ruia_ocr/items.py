@@ -1,15 +1,21 @@
 import re
 from lxml.html import etree
-from typing import Union
+from inspect import isawaitable
+from typing import Any, Dict, Pattern, Union
+from ruia import Item
 from ruia.field import RegexField
+from ruia.exceptions import IgnoreThisItem, InvalidFuncType
 
+from ruia_ocr.result import OcrResult
 
-__all__ = ['OcrField']
+
+__all__ = ['OcrField', 'OcrItem']
 
 
 class OcrField(RegexField):
     '''
-    Inherited from RegexField, The OcrField is exactly the same with RegexField
+    Inherited from RegexField, The OcrField is exactly the same with RegexField.
+    It extracts from the plain text of the ocr result, a str or an OcrResult, without any html parsing
     '''
     def __init__(self,
                  re_select: str,
@@ -18,8 +24,14 @@ class OcrField(RegexField):
                  many: bool = False):
         super().__init__(re_select, re_flags, default, many)
 
-    def extract(self, html: Union[str, etree._Element]):
-        if isinstance(html, etree._Element):
+    @property
+    def pattern(self) -> Pattern:
+        return self._re_object
+
+    def extract(self, html: Union[str, OcrResult, etree._Element]):
+        if isinstance(html, OcrResult):
+            html = html.text
+        elif isinstance(html, etree._Element):
             html = etree.tostring(html, encoding='utf8').decode()
             try:
                 res = re.findall(r'<html><body><p>(.*)</p></body></html>',
@@ -28,10 +40,84 @@ class OcrField(RegexField):
                 html = res[0]
             except:
                 pass
+        return self.extract_matches(self._re_object.finditer(html) if self.many else self._re_object.search(html))
+
+    def extract_matches(self, matches):
+        '''
+        :param matches: the finditer matches of the pattern when many, else its search match
+        '''
         if self.many:
-            matches = self._re_object.finditer(html)
             return [self._parse_match(match) for match in matches]
-        else:
-            match = self._re_object.search(html)
-            return self._parse_match(match)
+        return self._parse_match(matches)
+
+
+class OcrItem(Item):
+    '''
+    Item of OcrFields extracted from the plain text of an ocr result.
+    The text is not parsed into an lxml tree, and all the fields are evaluated in one pass over it:
+    the fields sharing a pattern share its matches.
+
+        class BookItem(OcrItem):
+            title = OcrField(r'书名[:：](.*?)\\n')
+            isbn = OcrField(r'ISBN[:：]?([\\d-]+)')
+
+        item = await BookItem.get_item(result=await response.json(result=True))
+        item = await BookItem.get_item(html=await response.text())
+    '''
+
+    @classmethod
+    def extract_fields(cls, text: Union[str, OcrResult]) -> Dict[str, Any]:
+        '''
+        :return: {field name: extracted value} of the fields of the item, target_item excepted
+        '''
+        if isinstance(text, OcrResult):
+            text = text.text
+        matches = {}
+        values = {}
+        # only the other fields need the lxml tree
+        tree = None
+        for name, field in getattr(cls, '__fields', {}).items():
+            if name == 'target_item':
+                continue
+            if not isinstance(field, OcrField):
+                if tree is None:
+                    tree = etree.HTML(text or ' ')
+                values[name] = field.extract(tree)
+                continue
+            key = (field.pattern, field.many)
+            if key not in matches:
+                matches[key] = list(field.pattern.finditer(text)) if field.many else field.pattern.search(text)
+            values[name] = field.extract_matches(matches[key])
+        return values
+
+    @classmethod
+    async def _parse_html(cls, *, html_etree: Union[str, OcrResult, etree._Element]):
+        if not isinstance(html_etree, (str, OcrResult)):
+            return await super()._parse_html(html_etree=html_etree)
+        item_ins = cls()
+        for field_name, value in cls.extract_fields(html_etree).items():
+            clean_method = getattr(item_ins, f"clean_{field_name}", None)
+            if clean_method is not None and callable(clean_method):
+                try:
+                    aws_clean_func = clean_method(value)
+                    if isawaitable(aws_clean_func):
+                        value = await aws_clean_func
+                    else:
+                        raise InvalidFuncType("<Item: clean_method must be a coroutine function>")
+                except IgnoreThisItem:
+                    item_ins.ignore_item = True
+            setattr(item_ins, field_name, value)
+            item_ins.results[field_name] = value
+        return item_ins
 
+    @classmethod
+    async def get_item(cls, *, html: str = "", url: str = "", html_etree: etree._Element = None,
+                       result: OcrResult = None, **kwargs) -> Any:
+        '''
+        :param html: the plain text of an ocr result, await response.text()
+        :param result: an OcrResult, await response.json(result=True)
+        url and html_etree are handled like ruia.Item
+        '''
+        if url or html_etree is not None:
+            return await super().get_item(html=html, url=url, html_etree=html_etree, **kwargs)
+        return await cls._parse_html(html_etree=html if result is None else result)
@@ -0,0 +1,248 @@
+import time
+import bisect
+import threading
+
+from typing import Dict, List, Sequence, Tuple
+
+__all__ = ['Histogram', 'OcrMetrics']
+
+# seconds, from a cache hit to a slow upload
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# bytes, from a small json response to the 4M limit of a payload
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 524288, 1048576, 2097152, 4194304, 8388608)
+
+
+class Histogram(object):
+    '''
+    Fixed buckets histogram, the quantiles are interpolated inside the buckets like prometheus does
+    '''
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets: Sequence[float]=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return f'Histogram<count={self.count}, sum={self.sum:.4f}>'
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+            seen += count
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else 0.0,
+            'p50': round(self.quantile(0.5), 6),
+            'p90': round(self.quantile(0.9), 6),
+            'p99': round(self.quantile(0.99), 6),
+            'max': round(self.max, 6),
+        }
+
+
+class _Timer(object):
+
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics: 'OcrMetrics', stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+class _NullTimer(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class OcrMetrics(object):
+    '''
+    Latency histograms of the stages of the ocr requests, size histograms of the bytes sent and received,
+    and event counters such as retries and cache hits.
+
+    Stages: decode, region, encode, image (the whole image stage, with the executor queue), quota_wait,
+    connect, upload, server (from the last byte sent to the response headers), http, read, parse and request
+    (a whole OcrRequest, with the retries).
+    Sizes: payload (urlencoded image), response.
+
+    enabled: the off switch, a disabled OcrMetrics records nothing and its timers cost a method call
+    '''
+
+    def __init__(self, enabled: bool=True, buckets: Sequence[float]=LATENCY_BUCKETS,
+                 size_buckets: Sequence[float]=SIZE_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.size_buckets = tuple(size_buckets)
+        self.stages: Dict[str, Histogram] = {}
+        self.sizes: Dict[str, Histogram] = {}
+        self.events: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'OcrMetrics<enabled={self.enabled}, stages={len(self.stages)}>'
+
+    def _observe(self, histograms: Dict[str, Histogram], name: str, buckets: Sequence[float],
+                 value: float) -> None:
+        # the image stage may run in threads
+        with self._lock:
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def timer(self, stage: str):
+        '''
+        with metrics.timer('encode'): ...
+        '''
+        return _Timer(self, stage) if self.enabled else NULL_TIMER
+
+    def observe(self, stage: str, seconds: float) -> None:
+        if self.enabled:
+            self._observe(self.stages, stage, self.buckets, seconds)
+
+    def observe_size(self, name: str, size: int) -> None:
+        if self.enabled:
+            self._observe(self.sizes, name, self.size_buckets, size)
+
+    def count(self, event: str, value: int=1) -> None:
+        if self.enabled:
+            with self._lock:
+                self.events[event] = self.events.get(event, 0) + value
+
+    def trace_config(self):
+        '''
+        :return: aiohttp.TraceConfig splitting the http stage of a session into connect, upload and server
+        '''
+        import aiohttp
+
+        async def on_request_start(session, context, params):
+            context.start = context.sent = time.perf_counter()
+
+        async def on_connection_create_start(session, context, params):
+            context.connect = time.perf_counter()
+
+        async def on_connection_create_end(session, context, params):
+            self.observe('connect', time.perf_counter() - context.connect)
+
+        async def on_request_chunk_sent(session, context, params):
+            context.sent = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            now = time.perf_counter()
+            self.observe('upload', context.sent - context.start)
+            self.observe('server', now - context.sent)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages.clear()
+            self.sizes.clear()
+            self.events.clear()
+
+    def snapshot(self) -> dict:
+        '''
+        :return: {'stages': {stage: seconds stats}, 'sizes': {name: bytes stats}, 'events': {event: count}}
+        '''
+        return {
+            'stages': {name: h.snapshot() for name, h in self.stages.items()},
+            'sizes': {name: h.snapshot() for name, h in self.sizes.items()},
+            'events': dict(self.events),
+        }
+
+    def summary(self) -> str:
+        '''
+        :return: one line per stage, size and event, for the logs
+        '''
+        lines = []
+        for name, h in sorted(self.stages.items()):
+            s = h.snapshot()
+            lines.append(f'{name:<10} count={s["count"]} mean={s["mean"] * 1000:.2f}ms '
+                         f'p50={s["p50"] * 1000:.2f}ms p90={s["p90"] * 1000:.2f}ms '
+                         f'p99={s["p99"] * 1000:.2f}ms max={s["max"] * 1000:.2f}ms')
+        for name, h in sorted(self.sizes.items()):
+            s = h.snapshot()
+            lines.append(f'{name + "_bytes":<10} count={s["count"]} mean={s["mean"]:.0f} '
+                         f'p90={s["p90"]:.0f} max={s["max"]:.0f}')
+        if self.events:
+            lines.append(' '.join(f'{k}={v}' for k, v in sorted(self.events.items())))
+        return '\n'.join(lines)
+
+    def prometheus(self, prefix: str='ruia_ocr') -> str:
+        '''
+        :return: the metrics in the prometheus text exposition format
+        '''
+        lines: List[str] = []
+        self._exposition(lines, f'{prefix}_stage_seconds', 'Latency of the stages of the ocr requests',
+                         'stage', self.stages)
+        self._exposition(lines, f'{prefix}_transfer_bytes', 'Bytes of the payloads and responses',
+                         'kind', self.sizes)
+        if self.events:
+            name = f'{prefix}_events_total'
+            lines.append(f'# HELP {name} Events of the ocr requests')
+            lines.append(f'# TYPE {name} counter')
+            for event, value in sorted(self.events.items()):
+                lines.append(f'{name}{{event="{event}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _exposition(lines: List[str], name: str, help: str, label: str,
+                    histograms: Dict[str, Histogram]) -> None:
+        if not histograms:
+            return
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} histogram')
+        for key, h in sorted(histograms.items()):
+            cumulative = 0
+            bounds: List[Tuple[str, int]] = []
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                bounds.append(('%g' % bound, cumulative))
+            bounds.append(('+Inf', h.count))
+            for bound, count in bounds:
+                lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{{label}="{key}"}} {h.sum}')
+            lines.append(f'{name}_count{{{label}="{key}"}} {h.count}')
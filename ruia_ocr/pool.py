@@ -0,0 +1,283 @@
+import time
+import asyncio
+import threading
+
+from collections import deque
+from PIL import Image
+from typing import Deque, Iterable, List, Optional, Tuple, Union
+
+from ruia.utils import get_logger
+from ruia_ocr.configs import BaseServiceTypes
+from ruia_ocr.service import BaseOcrService
+from ruia_ocr.imaging import RegionStr
+from ruia_ocr.hedging import HedgePolicy, hedged
+
+__all__ = ['PoolMember', 'OcrServicePool']
+
+logger = get_logger('Ocr')
+
+
+class PoolMember(object):
+    '''
+    One credential of an OcrServicePool.
+
+    service: the service of the credential, such as a BaiduOcrService of one app
+    weight: share of the traffic relative to the other members, such as the ratio of their qps quotas
+    limit: max calls sent through this member, such as the free quota of the app, None means no limit
+    '''
+
+    def __init__(self, service: BaseOcrService, weight: float=1.0, limit: int=None):
+        if weight <= 0:
+            raise ValueError('weight must be greater than 0')
+        self.service = service
+        self.weight = float(weight)
+        self.limit = limit
+        self.inflight = 0
+        self.calls = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self.ejections = 0
+        # ejections without a success in between
+        self.strikes = 0
+        self.ejected_until = 0.0
+        self.throttled_until = 0.0
+        # (time, ok) of the recent calls
+        self.recent: Deque[Tuple[float, bool]] = deque()
+
+    def __repr__(self):
+        return f'PoolMember<{self.service!r}, weight={self.weight}, inflight={self.inflight}>'
+
+    @property
+    def exhausted(self) -> bool:
+        return self.limit is not None and self.calls >= self.limit
+
+    @property
+    def load(self) -> float:
+        return (self.inflight + 1) / self.weight
+
+    @property
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            'credential': self.service.credential,
+            'service_type': str(self.service.service_type),
+            'weight': self.weight,
+            'inflight': self.inflight,
+            'calls': self.calls,
+            'limit': self.limit,
+            'errors': self.errors,
+            'quota_errors': self.quota_errors,
+            'ejections': self.ejections,
+            'healthy': self.ejected_until <= now and not self.exhausted,
+        }
+
+
+_Member = Union[BaseOcrService, PoolMember, Tuple[BaseOcrService, float]]
+
+
+class OcrServicePool(BaseOcrService):
+    '''
+    Several credentials behind one service, so that one spider can use the qps quota of several apps.
+    The members may have different service types or tiers, a request without service type uses the one
+    of its member. Share one OcrCache, DedupeIndex or OcrMetrics between the members to share them.
+
+    Every attempt of a request is routed to the healthy member with the least in-flight calls per weight.
+    A member answering a qps error is avoided for throttle seconds, its own rate limiter backs off.
+    A member with max_errors failures among its calls of the last window seconds, and at least error_ratio
+    of them, is ejected for eject_seconds, doubled at every ejection in a row up to max_eject_seconds.
+    A member whose daily or total quota is used up is ejected for exhausted_seconds.
+    When every member is ejected, the one coming back first is used.
+    With hedging, the duplicate of a slow call is sent through another member.
+
+        pool = OcrServicePool([BaiduOcrService(app_id1, api_key1, secret_key1),
+                               PoolMember(BaiduOcrService(app_id2, api_key2, secret_key2), weight=2)])
+
+        class MySpider(OcrSpider):
+            ocr_service = pool
+    '''
+
+    name = 'OcrServicePool'
+
+    def __init__(self,
+                 members: Iterable[_Member],
+                 window: float=30.0,
+                 max_errors: int=5,
+                 error_ratio: float=0.5,
+                 eject_seconds: float=10.0,
+                 max_eject_seconds: float=300.0,
+                 throttle: float=1.0,
+                 exhausted_seconds: float=3600.0,
+                 hedging: HedgePolicy=None):
+        super().__init__(hedging=hedging)
+        self.members: List[PoolMember] = []
+        for member in members:
+            if isinstance(member, tuple):
+                member = PoolMember(*member)
+            elif not isinstance(member, PoolMember):
+                member = PoolMember(member)
+            self.members.append(member)
+        if not self.members:
+            raise ValueError('OcrServicePool needs at least one member')
+        self.window = window
+        self.max_errors = max_errors
+        self.error_ratio = error_ratio
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.throttle = throttle
+        self.exhausted_seconds = exhausted_seconds
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'OcrServicePool<{len(self.members)} members>'
+
+    def __len__(self):
+        return len(self.members)
+
+    @property
+    def services(self) -> List[BaseOcrService]:
+        return [member.service for member in self.members]
+
+    @property
+    def primary(self) -> BaseOcrService:
+        return self.members[0].service
+
+    @property
+    def service_url(self):
+        return self.primary.service_url
+
+    @property
+    def service_type(self):
+        return self.primary.service_type
+
+    @property
+    def service_payload(self):
+        return self.primary.service_payload
+
+    @property
+    def ocr_options(self):
+        return self.primary.ocr_options
+
+    @ocr_options.setter
+    def ocr_options(self, value):
+        for service in self.services:
+            service.ocr_options = value
+
+    def get_service_url(self, service_type: BaseServiceTypes=None) -> str:
+        return self.primary.get_service_url(service_type)
+
+    @property
+    def stats(self) -> List[dict]:
+        return [member.stats for member in self.members]
+
+    def _member(self, service: BaseOcrService) -> Optional[PoolMember]:
+        for member in self.members:
+            if member.service is service:
+                return member
+        return None
+
+    def _pick(self, exclude: BaseOcrService=None) -> PoolMember:
+        now = time.monotonic()
+        members = [m for m in self.members if m.ejected_until <= now and not m.exhausted]
+        members = [m for m in members if m.service is not exclude] or members
+        if not members:
+            members = [m for m in self.members if not m.exhausted] or self.members
+            return min(members, key=lambda m: m.ejected_until)
+        members = [m for m in members if m.throttled_until <= now] or members
+        # the ties are broken round robin
+        self._next = (self._next + 1) % len(self.members)
+        start = self._next
+        return min(members, key=lambda m: (m.load, (self.members.index(m) - start) % len(self.members)))
+
+    def checkout(self, request=None, exclude: BaseOcrService=None) -> BaseOcrService:
+        with self._lock:
+            member = self._pick(exclude)
+            member.inflight += 1
+        return member.service
+
+    def checkin(self, service: BaseOcrService, ok: Optional[bool], result: dict=None) -> None:
+        member = self._member(service)
+        if member is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            member.inflight = max(0, member.inflight - 1)
+            if ok is None:
+                return
+            member.calls += 1
+            if isinstance(result, dict):
+                if service.is_quota_error(result):
+                    # not a failure of the member, only more than its qps
+                    member.quota_errors += 1
+                    member.throttled_until = now + self.throttle
+                    return
+                if service.is_exhausted_error(result):
+                    member.ejected_until = now + self.exhausted_seconds
+                    member.ejections += 1
+                    logger.warning(f'<Pool member {service.credential} quota used up: {result}>')
+                    return
+                if ok and not service.is_cacheable(result):
+                    ok = False
+            self._record(member, ok, now)
+
+    def _record(self, member: PoolMember, ok: bool, now: float) -> None:
+        recent = member.recent
+        recent.append((now, ok))
+        while recent and now - recent[0][0] > self.window:
+            recent.popleft()
+        if ok:
+            member.strikes = 0
+            return
+        member.errors += 1
+        failures = sum(1 for _, success in recent if not success)
+        if failures >= self.max_errors and failures >= self.error_ratio * len(recent):
+            # the ejections in a row double the time out of the pool
+            seconds = min(self.max_eject_seconds, self.eject_seconds * 2 ** min(member.strikes, 16))
+            member.ejected_until = now + seconds
+            member.ejections += 1
+            member.strikes += 1
+            recent.clear()
+            logger.warning(f'<Pool member {member.service.credential} ejected for {seconds:.1f}s: '
+                           f'{failures} errors in {self.window}s>')
+
+    async def _aio_request_member(self, service: BaseOcrService, image_path: str, region: RegionStr=None,
+                                  img: Image.Image=None) -> dict:
+        ok, result = None, None
+        try:
+            result = await service.aio_request(image_path, region, img=img)
+            ok = True
+            return result
+        except asyncio.CancelledError:
+            # the loser of a hedged call, no outcome
+            raise
+        except Exception:
+            ok = False
+            raise
+        finally:
+            self.checkin(service, ok, result)
+
+    async def aio_request(self, image_path: str, region: RegionStr=None, *, img: Image.Image=None) -> dict:
+        service = self.checkout()
+        if self.hedging is None:
+            return await self._aio_request_member(service, image_path, region, img)
+        return await hedged(self.hedging,
+                            lambda: self._aio_request_member(service, image_path, region, img),
+                            lambda: self._aio_request_member(self.checkout(exclude=service), image_path,
+                                                             region, img),
+                            lambda result: isinstance(result, dict) and service.is_cacheable(result))
+
+    def request(self, image_path: str=None, region: RegionStr=None, *, img: Image.Image=None) -> dict:
+        service, result = self.checkout(), None
+        try:
+            result = service.request(image_path, region, img=img)
+            return result
+        finally:
+            self.checkin(service, result is not None, result)
+
+    async def aclose(self) -> None:
+        for service in self.services:
+            await service.aclose()
+
+    def close(self) -> None:
+        for service in self.services:
+            service.close()
@@ -0,0 +1,136 @@
+# Blank image prefilter: a thumbnail of the image -> contrast, histogram and edge density -> skip the ocr call
+# A blank page costs a whole call and answers nothing, it gets the empty result of the service instead
+import threading
+
+from PIL import Image, ImageFilter
+from typing import NamedTuple
+
+from ruia_ocr.imaging import SOURCE_SIZE, RegionStr, ImageSource, crop_by_region, image_file
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy only sums the histogram faster, the loops of python give the same statistics
+    np = None
+
+__all__ = ['BlankStats', 'blank_stats', 'BlankFilter']
+
+
+class BlankStats(NamedTuple):
+    '''
+    std: standard deviation of the gray levels
+    dominant: share of the pixels within 8 gray levels of the most common one
+    edge_density: share of the pixels on an edge
+    '''
+    std: float
+    dominant: float
+    edge_density: float
+
+
+def blank_stats(source: ImageSource, region: RegionStr=None, thumbnail: int=256,
+                edge_threshold: int=32) -> BlankStats:
+    '''
+    Statistics of a gray thumbnail of the image once the region is applied: the pixels are only visited
+    by the C loops of Pillow, the histogram is summed by numpy when it is installed.
+    A JPEG is draft decoded at a reduced size
+    '''
+    if isinstance(source, Image.Image):
+        return _blank_stats(crop_by_region(source, region), thumbnail, edge_threshold)
+    with Image.open(image_file(source)) as image:
+        if image.format == 'JPEG':
+            size = image.size
+            image.draft('L', (max(thumbnail, size[0] // 8), max(thumbnail, size[1] // 8)))
+            if image.size != size:
+                image.info[SOURCE_SIZE] = size
+        return _blank_stats(crop_by_region(image, region), thumbnail, edge_threshold)
+
+
+def _blank_stats(image: Image.Image, thumbnail: int, edge_threshold: int) -> BlankStats:
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # transparent pixels are blank paper
+        rgba = image.convert('RGBA')
+        background = Image.new('RGBA', rgba.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, rgba)
+    gray = image.convert('L')
+    gray.thumbnail((thumbnail, thumbnail), Image.BILINEAR)
+
+    histogram = gray.histogram()
+    if np is not None:
+        counts = np.array(histogram, dtype=np.float64)
+        total = counts.sum() or 1.0
+        levels = np.arange(256)
+        mean = counts.dot(levels) / total
+        variance = float(counts.dot((levels - mean) ** 2) / total)
+        peak = int(counts.argmax())
+        dominant = float(counts[max(0, peak - 8):peak + 9].sum() / total)
+    else:
+        total = float(sum(histogram)) or 1.0
+        mean = sum(level * count for level, count in enumerate(histogram)) / total
+        variance = sum((level - mean) ** 2 * count for level, count in enumerate(histogram)) / total
+        peak = max(range(256), key=histogram.__getitem__)
+        dominant = sum(histogram[max(0, peak - 8):peak + 9]) / total
+
+    width, height = gray.size
+    if width < 3 or height < 3:
+        return BlankStats(variance ** 0.5, dominant, 0.0)
+    # the 1px border of FIND_EDGES is left out, it compares the pixels with the outside
+    edges = gray.filter(ImageFilter.FIND_EDGES).crop((1, 1, width - 1, height - 1))
+    edge_histogram = edges.histogram()
+    edge_density = sum(edge_histogram[edge_threshold:]) / float((width - 2) * (height - 2))
+    return BlankStats(variance ** 0.5, dominant, edge_density)
+
+
+class BlankFilter(object):
+    '''
+    Skip the ocr call of the blank, near-uniform or almost empty images, they get an empty result.
+    An image is blank when the gray levels of its thumbnail deviate by less than min_std,
+    or more than max_dominant of them are one color, or less than min_edge_density of them are on an edge.
+    The defaults only skip images without any readable line, raise them to skip more.
+    The local images, the bytes of an image and the images downloaded by the ImageFetcher of the service
+    are checked, not the remote images the ocr api downloads itself.
+
+    thumbnail: longest edge of the thumbnail the statistics are computed on
+    edge_threshold: gray level difference of an edge
+    '''
+
+    def __init__(self,
+                 min_std: float=0.2,
+                 max_dominant: float=0.99995,
+                 min_edge_density: float=0.0001,
+                 thumbnail: int=256,
+                 edge_threshold: int=32):
+        self.min_std = min_std
+        self.max_dominant = max_dominant
+        self.min_edge_density = min_edge_density
+        self.thumbnail = thumbnail
+        self.edge_threshold = edge_threshold
+        self.checked = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'BlankFilter<min_std={self.min_std}, min_edge_density={self.min_edge_density}, ' \
+               f'skipped={self.skipped}>'
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'checked': self.checked,
+            'skipped': self.skipped,
+            'skip_rate': self.skipped / self.checked if self.checked else 0.0,
+        }
+
+    def is_blank(self, stats: BlankStats) -> bool:
+        blank = (stats.std < self.min_std or stats.dominant > self.max_dominant
+                 or stats.edge_density < self.min_edge_density)
+        with self._lock:
+            self.checked += 1
+            if blank:
+                self.skipped += 1
+        return blank
+
+    def check(self, source: ImageSource, region: RegionStr=None) -> bool:
+        '''
+        :return: whether the image is blank
+        '''
+        return self.is_blank(blank_stats(source, region, self.thumbnail, self.edge_threshold))
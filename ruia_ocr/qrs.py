@@ -1,6 +1,8 @@
+import json
 import asyncio
 import async_timeout
 
+from signal import SIGINT
 from typing import Callable, Optional
 from inspect import iscoroutinefunction
 
@@ -8,9 +10,13 @@ from ruia import Spider
 from ruia import Response
 from ruia import Request
 
+from ruia_ocr.configs import BaseServiceTypes
+from ruia_ocr.result import OcrResult, loads
+from ruia_ocr.hedging import hedged
+from ruia_ocr.checkpoint import ProgressIndex
 from ruia_ocr.service import BaseOcrService, RegionStr
 
-__all__ = ['OcrResponse', 'OcrRequest', 'OcrSpider']
+__all__ = ['OcrResponse', 'OcrRequest', 'StartQueue', 'OcrSpider']
 
 
 class OcrResponse(Response):
@@ -47,6 +53,34 @@ class OcrResponse(Response):
             aws_text=aws_text,
         )
 
+    @classmethod
+    def from_body(cls, body: bytes, *, uri: str, service: 'BaseOcrService', metadata: dict,
+                  status: int = 200, encoding: str = 'utf-8') -> 'OcrResponse':
+        """Build a response locally from a raw response body, such as an ocr cache hit."""
+
+        async def _read(**kwargs):
+            return body
+
+        async def _text(*, encoding: str = None, errors: str = 'strict', **kwargs):
+            return body.decode(encoding or 'utf-8', errors)
+
+        async def _json(*, loads=loads, **kwargs):
+            return loads(body)
+
+        return cls(uri=uri,
+                   service=service,
+                   url=service.service_url,
+                   method='POST',
+                   encoding=encoding,
+                   metadata=metadata,
+                   cookies={},
+                   headers={},
+                   history=(),
+                   status=status,
+                   aws_json=_json,
+                   aws_text=_text,
+                   aws_read=_read)
+
     @property
     def uri(self):
         return self._uri
@@ -55,11 +89,21 @@ class OcrResponse(Response):
     def service(self):
         return self._service
 
-    async def json(self, **kwargs):
-        """Read and decodes JSON response."""
+    async def json(self, *, result: bool = False, **kwargs):
+        """
+        Read and decodes JSON response, processed by service.process_json,
+        or the OcrResult parsed lazily from the body when result is True
+        """
+        if result:
+            return await self.result()
+        kwargs.setdefault('loads', loads)
         res = await self._aws_json(**kwargs)
         return self._service.process_json(res)
 
+    async def result(self) -> OcrResult:
+        """Read the response payload as an OcrResult, decoded on the first access of its fields."""
+        return self._service.process_result(await self._aws_read())
+
     async def read(self, **kwargs):
         """Read response payload."""
         return await self._aws_read(**kwargs)
@@ -88,13 +132,30 @@ class OcrRequest(Request):
         region: str = None,
         uri: str=None,
         service: 'BaseOcrService'=None,
+        service_type: BaseServiceTypes=None,
         **kwargs,
     ):
         self.uri =  uri or url
+        # region and service_type of this request only, None means the ones of the service
         self.region = region
+        # service routes every attempt to a member when it is a pool of services, see BaseOcrService.checkout
+        self.pool = service
         self.service = service
+        self.service_type = service_type
+        # tiles of an image over the size limits, set by the service when it is tiled
+        self.tiles = None
+        # decided by the service before the request is sent, see BaseOcrService.is_batched
+        self.batched = False
+        # bytes of the image downloaded by the fetcher of the service, see BaseOcrService.request_image
+        self.image = None
+        self._cache_key = None
+        self._dedupe_key = None
+        self._fetching = False
+        self._checked_out = False
+        self._result = None
+        self._prefiltered = False
         super(OcrRequest, self).__init__(
-            self.service.service_url,
+            self.service.get_service_url(service_type),
             method,
             callback=callback,
             encoding=encoding,
@@ -111,6 +172,28 @@ class OcrRequest(Request):
 
         await self.service.request_process(self)
 
+        if self.batched:
+            # packed with other small images into one call
+            result = await self.service.batcher.submit(self.uri, self.service._request_region(self))
+            return OcrResponse.from_body(json.dumps(result, ensure_ascii=False).encode(),
+                                         uri=self.uri,
+                                         service=self.service,
+                                         metadata=self.metadata)
+
+        if self.tiles:
+            # the tiles are recognized concurrently and merged into one response
+            result = await self.service.aio_ocr_tiles(self.tiles,
+                                                      self.service_type,
+                                                      self.current_request_session,
+                                                      reserved=1)
+            return OcrResponse.from_body(json.dumps(result, ensure_ascii=False).encode(),
+                                         uri=self.uri,
+                                         service=self.service,
+                                         metadata=self.metadata)
+
+        if self.method == "POST" and self.pool.hedging is not None and self._image_field() is not None:
+            return await self._hedged_request()
+
         if self.method == "GET":
             request_func = self.current_request_session.get(
                 self.url,
@@ -123,42 +206,146 @@ class OcrRequest(Request):
                 headers=self.headers,
                 ssl=self.ssl,
                 **self.aiohttp_kwargs)
-        resp = await request_func
+        with self.service._timer('http'):
+            resp = await request_func
         return resp
 
+    def _image_field(self) -> Optional[str]:
+        data = getattr(self.aiohttp_kwargs.get('data'), 'fields', self.aiohttp_kwargs.get('data'))
+        if isinstance(data, dict):
+            for field in ('image', 'url'):
+                if field in data:
+                    return field
+        return None
+
+    async def _hedged_request(self) -> OcrResponse:
+        """
+        Send the prepared request, and a duplicate to another service of the pool when it is slower
+        than the hedging percentile, the first successful response wins
+        """
+        field = self._image_field()
+        data = getattr(self.aiohttp_kwargs['data'], 'fields', self.aiohttp_kwargs['data'])[field]
+        session = self.current_request_session
+
+        async def primary():
+            with self.service._timer('http'):
+                async with session.post(self.url, headers=self.headers, ssl=self.ssl,
+                                        **self.aiohttp_kwargs) as resp:
+                    return resp.status, await resp.read()
+
+        async def duplicate():
+            service = self.pool.checkout(self, exclude=self.service)
+            ok = None
+            try:
+                await service.acquire_quota(self.service_type)
+                body = await service.aio_post_image(data, self.service_type, session, field)
+                ok = service.is_ok_body(body)
+                return 200, body
+            except Exception:
+                ok = False
+                raise
+            finally:
+                self.pool.checkin(service, ok)
+
+        status, body = await hedged(self.pool.hedging, primary, duplicate,
+                                    lambda r: r[0] == 200 and self.service.is_ok_body(r[1]))
+        return OcrResponse.from_body(body,
+                                     uri=self.uri,
+                                     service=self.service,
+                                     metadata=self.metadata,
+                                     status=status)
+
     async def fetch(self, delay=True) -> OcrResponse:
-        """Fetch all the information by using aiohttp"""
+        """Fetch all the information by using aiohttp, timed with the retries as the request stage"""
+        self._checkout()
+        try:
+            if self._fetching or self.service.metrics is None:
+                return await self._fetch(delay)
+            self._fetching = True
+            self.service._count('requests')
+            try:
+                with self.service.metrics.timer('request'):
+                    return await self._fetch(delay)
+            finally:
+                self._fetching = False
+        finally:
+            self._checkin(False)
+
+    def _checkout(self) -> None:
+        """Pick the service sending this attempt, every attempt is routed again by a pool of services"""
+        self._checkin(None)
+        service = self.pool.checkout(self)
+        if service is not self.service:
+            # the keys depend on the service type and payload of the service
+            self._cache_key = self._dedupe_key = None
+            self.service = service
+        self._checked_out = True
+        self._result = None
+
+    def _checkin(self, ok: Optional[bool]) -> None:
+        if self._checked_out:
+            self._checked_out = False
+            self.pool.checkin(self.service, ok, self._result)
+
+    async def _retry(self, error_msg):
+        self._checkin(False)
+        if self.retry_times > 0:
+            self.service._count('retries')
+        return await super(OcrRequest, self)._retry(error_msg)
+
+    async def _fetch(self, delay=True) -> OcrResponse:
 
         if delay and self.request_config.get("DELAY", 0) > 0:
             await asyncio.sleep(self.request_config["DELAY"])
 
         timeout = self.request_config.get("TIMEOUT", 10)
         try:
+            # decided first: a batched image is cached under the service type of the batching
+            batched = self.service.is_batched(self)
+            response = await self._cached_response()
+            if response is None:
+                response = await self._blank_response()
+            if response is None:
+                response = await self._deduped_response()
+            if response is not None:
+                self._checkin(None)
+                return response
+            # Waiting for the quota does not count towards the timeout,
+            # the batched images share the quota of their composite call
+            if not batched:
+                await self.service.acquire_quota(self.service_type)
             async with async_timeout.timeout(timeout):
                 resp = await self._make_request()
-            try:
-                resp_encoding = resp.get_encoding()
-            except:
-                resp_encoding = self.encoding
-
-            response = OcrResponse(uri=self.uri,
-                                   service=self.service,
-                                   url=str(resp.url),
-                                   method=resp.method,
-                                   encoding=resp_encoding,
-                                   metadata=self.metadata,
-                                   cookies=resp.cookies,
-                                   headers=resp.headers,
-                                   history=resp.history,
-                                   status=resp.status,
-                                   aws_json=resp.json,
-                                   aws_text=resp.text,
-                                   aws_read=resp.read)
+            if isinstance(resp, OcrResponse):
+                response = resp
+            else:
+                try:
+                    resp_encoding = resp.get_encoding()
+                except:
+                    resp_encoding = self.encoding
+
+                response = OcrResponse(uri=self.uri,
+                                       service=self.service,
+                                       url=str(resp.url),
+                                       method=resp.method,
+                                       encoding=resp_encoding,
+                                       metadata=self.metadata,
+                                       cookies=resp.cookies,
+                                       headers=resp.headers,
+                                       history=resp.history,
+                                       status=resp.status,
+                                       aws_json=resp.json,
+                                       aws_text=resp.text,
+                                       aws_read=resp.read)
             # Retry middleware
             aws_valid_response = self.request_config.get("VALID")
             if aws_valid_response and iscoroutinefunction(aws_valid_response):
                 response = await aws_valid_response(response)
             if response.ok:
+                error_msg = await self._process_body(resp)
+                if error_msg is not None:
+                    return await self._retry(error_msg=error_msg)
+                self._checkin(True)
                 return response
             else:
                 return await self._retry(
@@ -173,10 +360,97 @@ class OcrRequest(Request):
             if self.close_request_session:
                 await self._close_request()
 
+    async def _cached_response(self) -> Optional[OcrResponse]:
+        """Look the image up in the ocr cache of the service before any network call, off the event loop"""
+        if self.service.cache is None:
+            return None
+        source = await self.service.request_image(self)
+        try:
+            self._cache_key, body = await self.service.cached_body(
+                source, self.service._request_region(self), self.service.called_type(self), self._cache_key)
+        except OSError:
+            return None
+        if body is None:
+            return None
+        return OcrResponse.from_body(body,
+                                     uri=self.uri,
+                                     service=self.service,
+                                     metadata=self.metadata)
+
+    async def _blank_response(self) -> Optional[OcrResponse]:
+        """Answer an empty result for a blank image, without any network call"""
+        if self.service.prefilter is None or self._prefiltered:
+            return None
+        self._prefiltered = True
+        if not await self.service.is_blank(await self.service.request_image(self), self.service._request_region(self)):
+            return None
+        return OcrResponse.from_body(json.dumps(self.service.empty_result()).encode(),
+                                     uri=self.uri,
+                                     service=self.service,
+                                     metadata=self.metadata)
+
+    async def _deduped_response(self) -> Optional[OcrResponse]:
+        """Reuse the result of a duplicate image already recognized"""
+        if self.service.dedupe is None:
+            return None
+        if self._dedupe_key is None:
+            self._dedupe_key = await self.service.dedupe_key(
+                await self.service.request_image(self), self.service._request_region(self),
+                self.service.called_type(self))
+        body = await self.service.deduped_body(self._dedupe_key, self._cache_key)
+        if body is None:
+            return None
+        return OcrResponse.from_body(body,
+                                     uri=self.uri,
+                                     service=self.service,
+                                     metadata=self.metadata)
+
+    async def _process_body(self, resp) -> Optional[str]:
+        """Cache the ocr result and check the qps limit, return an error message to retry"""
+        if resp.status != 200:
+            return None
+        try:
+            with self.service._timer('read'):
+                body = await resp.read()
+            result = await self.service._aio_loads_and_cache(self._cache_key, body, self.service_type,
+                                                             self._dedupe_key)
+        except ValueError:
+            return None
+        self._result = result
+        if self.service.is_quota_error(result):
+            return f"Ocr service qps limit reached: {result}"
+        if self.service.is_token_error(result):
+            return f"Ocr service access token invalid: {result}"
+        return None
+
     def __repr__(self):
         return f"<{self.method} {self.uri} {self.url}>"
 
 
+class StartQueue(asyncio.Queue):
+    """
+    request_queue of OcrSpider: put waits while start_size items are queued, put_nowait neither waits nor fails,
+    so the requests yielded by the callbacks are always queued
+    """
+
+    def __init__(self, start_size: int):
+        super(StartQueue, self).__init__()
+        self.start_size = start_size
+        self._room = asyncio.Event()
+
+    async def put(self, item) -> None:
+        while self.qsize() >= self.start_size:
+            self._room.clear()
+            await self._room.wait()
+        self.put_nowait(item)
+
+    def get_nowait(self):
+        item = super(StartQueue, self).get_nowait()
+        if self.qsize() < self.start_size:
+            self._room.set()
+        return item
+
+
 class OcrSpider(Spider):
     
    # ocr_service
@@ -192,6 +466,19 @@ class OcrSpider(Spider):
     #   stitching image1 image2 by row get new image to ocr
     ocr_region: RegionStr = ''
 
+    # progress: ProgressIndex, the uris done by the previous runs are skipped,
+    # with ProgressIndex(path, rescan=True) only the files new or changed since then are recognized
+    progress: ProgressIndex = None
+
+    # start_urls may be a lazy iterable such as iter_file_paths('./images', num=100),
+    # the spider starts ocr-ing before the discovery finishes
+    # start_queue_size: max start requests waiting in request_queue, the discovery waits for the workers
+    start_queue_size: int = 1000
+
+    def __init__(self, *args, **kwargs):
+        super(OcrSpider, self).__init__(*args, **kwargs)
+        self.request_queue = StartQueue(self.start_queue_size)
+
     def request(self,
                 url: str,
                 method: str = "GET",
@@ -202,8 +489,13 @@ class OcrSpider(Spider):
                 metadata: dict = None,
                 request_config: dict = None,
                 request_session=None,
+                region: RegionStr = None,
+                service_type: BaseServiceTypes = None,
                 **kwargs):
-        """Init a Request class for crawling html"""
+        """
+        Init a OcrRequest of an image, region and service_type override ocr_region
+        and the service type of ocr_service for this image only
+        """
         headers = headers or {}
         metadata = metadata or {}
         request_config = request_config or {}
@@ -211,9 +503,8 @@ class OcrSpider(Spider):
 
         headers.update(self.headers.copy())
         request_config.update(self.request_config.copy())
-        self.ocr_service.ocr_options.update(region=self.ocr_region)
-        uri = url
-        p_url = self.ocr_service.service_url
+        region = self.ocr_region if region is None else region
+        p_url = self.ocr_service.get_service_url(service_type)
 
         return OcrRequest(
                           p_url,
@@ -224,7 +515,91 @@ class OcrSpider(Spider):
                           metadata=metadata,
                           request_config=request_config,
                           request_session=request_session,
-                          region=self.ocr_region,
+                          region=region,
                           uri=url,
                           service=self.ocr_service,
+                          service_type=service_type,
                           **kwargs)
+
+    async def _iter_start_urls(self):
+        """Iterate start_urls, lazy iterables such as iter_file_paths are advanced in a thread"""
+        if isinstance(self.start_urls, (list, tuple)):
+            for url in self.start_urls:
+                yield url
+            return
+        loop = asyncio.get_event_loop()
+        urls = iter(self.start_urls)
+        stop = object()
+        while True:
+            url = await loop.run_in_executor(None, next, urls, stop)
+            if url is stop:
+                break
+            yield url
+
+    def log_ocr_metrics(self) -> None:
+        """Log the summary of the metrics of ocr_service, or of the members of a pool, at the end of the run"""
+        seen = set()
+        for service in getattr(self.ocr_service, 'services', [self.ocr_service]):
+            metrics = getattr(service, 'metrics', None)
+            if metrics is None or id(metrics) in seen:
+                continue
+            seen.add(id(metrics))
+            if metrics.enabled and (metrics.stages or metrics.events):
+                self.logger.info(f"Ocr metrics:\n{metrics.summary()}")
+
+    async def _is_finished(self, url: Optional[str]) -> bool:
+        """Whether the progress index has the url done, a rescan stats and hashes the files in a thread"""
+        if self.progress is None or url is None:
+            return False
+        if not self.progress.rescan:
+            return self.progress.should_skip(url)
+        return await asyncio.get_event_loop().run_in_executor(None, self.progress.should_skip, url)
+
+    async def handle_request(self, request):
+        """Record the outcome of the start urls in the progress index"""
+        callback_result, request, response = await super(OcrSpider, self).handle_request(request)
+        if self.progress is not None and isinstance(request, OcrRequest):
+            result = request._result
+            if isinstance(result, dict) and not request.service.is_cacheable(result):
+                # errors such as the qps limit come back with http status 200
+                error = json.dumps(result, ensure_ascii=False)
+            elif response is not None and response.ok:
+                error = None
+            else:
+                error = f"status {getattr(response, 'status', None)}"
+            await asyncio.get_event_loop().run_in_executor(None, self.progress.mark, request.uri, error)
+        return callback_result, request, response
+
+    async def process_start_urls(self):
+        """Yield the requests of start_urls, lazy iterables such as iter_file_paths are advanced in a thread"""
+        async for url in self._iter_start_urls():
+            yield self.request(url=url, callback=self.parse, metadata=self.metadata)
+
+    async def start_master(self):
+        """
+        Start the workers first, then feed them the requests of process_start_urls while start_urls
+        is being discovered, waiting while start_queue_size of them are queued
+        """
+        workers = [
+            asyncio.ensure_future(self.start_worker())
+            for i in range(self.worker_numbers)
+        ]
+        for worker in workers:
+            self.logger.info(f"Worker started: {id(worker)}")
+        try:
+            async for request_ins in self.process_start_urls():
+                if await self._is_finished(getattr(request_ins, 'uri', None)):
+                    continue
+                await self.request_queue.put(self.handle_request(request_ins))
+            await self.request_queue.join()
+        finally:
+            if self.progress is not None:
+                await asyncio.get_event_loop().run_in_executor(None, self.progress.flush)
+                self.logger.info(f"Ocr progress: {self.progress.stats}")
+        self.log_ocr_metrics()
+
+        if not self.is_async_start:
+            await self.stop(SIGINT)
+        else:
+            if self.cancel_tasks:
+                await self.cancel_all_tasks()
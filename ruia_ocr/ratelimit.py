@@ -0,0 +1,220 @@
+import time
+import asyncio
+import threading
+import multiprocessing
+
+from typing import Dict, Hashable, Iterable, Tuple, Union
+
+from ruia_ocr.exceptions import QuotaExhaustedError
+
+__all__ = ['TokenBucket', 'RateLimiter', 'SharedTokenBucket', 'SharedRateLimiter']
+
+_Limit = Union[float, Tuple[float, int]]  # qps or (qps, burst)
+
+
+class TokenBucket(object):
+    '''
+    Token bucket refilled at qps tokens per second, holding at most burst tokens.
+    Tokens are reserved first and waited for afterwards, so the bucket is fair and
+    can be shared by coroutines and threads.
+    '''
+
+    def __init__(self, qps: float, burst: int=None):
+        if qps <= 0:
+            raise ValueError('qps must be greater than 0')
+        self.qps = float(qps)
+        self.burst = max(1, int(burst if burst is not None else qps))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+        self.acquired = 0
+
+    def __repr__(self):
+        return f'TokenBucket<qps={self.qps}, burst={self.burst}>'
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.qps)
+        self._last = now
+
+    def reserve(self, tokens: int=1) -> float:
+        '''
+        Take tokens from the bucket, return the seconds to wait before using them
+        '''
+        with self._lock:
+            return self._take(tokens)
+
+    def _take(self, tokens: int) -> float:
+        # the caller holds self._lock
+        self._refill(time.monotonic())
+        self._tokens -= tokens
+        self.acquired += tokens
+        delay = 0.0 if self._tokens >= 0 else -self._tokens / self.qps
+        self.waited += delay
+        return delay
+
+    async def acquire(self, tokens: int=1) -> None:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self, tokens: int=1) -> None:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, seconds: float=1.0) -> None:
+        '''
+        The server reported a qps error: drop the stored burst and pause the bucket for seconds
+        '''
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0) - seconds * self.qps
+
+
+class RateLimiter(object):
+    '''
+    Registry of token buckets keyed by service type and credential,
+    share one RateLimiter between services to share the quota of an app.
+
+    qps: default qps of every service type, None means no limit
+    burst: default burst, None means qps
+    limits: {service_type: qps or (qps, burst)}, overriding the default per service type
+    '''
+
+    def __init__(self, qps: float=None, burst: int=None, limits: Dict[Hashable, _Limit]=None):
+        self.qps = qps
+        self.burst = burst
+        self.limits = dict(limits or {})
+        self._buckets: Dict[Tuple[Hashable, Hashable], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'RateLimiter<qps={self.qps}, burst={self.burst}, buckets={len(self._buckets)}>'
+
+    def bucket(self, service_type: Hashable, credential: Hashable=None) -> TokenBucket:
+        '''
+        :return: the bucket of service_type and credential, None if it is not limited
+        '''
+        key = (service_type, credential)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            limit = self.limits.get(service_type, self.qps)
+            if limit is None:
+                return None
+            qps, burst = limit if isinstance(limit, tuple) else (limit, self.burst)
+            with self._lock:
+                bucket = self._buckets.setdefault(key, TokenBucket(qps, burst))
+        return bucket
+
+    async def acquire(self, service_type: Hashable, credential: Hashable=None, tokens: int=1) -> None:
+        bucket = self.bucket(service_type, credential)
+        if bucket is not None:
+            await bucket.acquire(tokens)
+
+    def acquire_sync(self, service_type: Hashable, credential: Hashable=None, tokens: int=1) -> None:
+        bucket = self.bucket(service_type, credential)
+        if bucket is not None:
+            bucket.acquire_sync(tokens)
+
+    def backoff(self, service_type: Hashable, credential: Hashable=None, seconds: float=1.0) -> None:
+        bucket = self.bucket(service_type, credential)
+        if bucket is not None:
+            bucket.backoff(seconds)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            '%s:%s' % (getattr(service_type, 'value', service_type), credential): {
+                'acquired': bucket.acquired,
+                'waited': round(bucket.waited, 4),
+            }
+            for (service_type, credential), bucket in self._buckets.items()
+        }
+
+
+class SharedTokenBucket(TokenBucket):
+    '''
+    TokenBucket in shared memory, one bucket for every process it is passed to, such as the workers of OcrRunner.
+    time.monotonic is the same clock in every process of a host.
+
+    budget: max tokens ever acquired from the bucket by all the processes, such as the daily quota of an app,
+        beyond it reserve raises QuotaExhaustedError. None means no budget
+    '''
+
+    # tokens, last refill, acquired, waited
+    _TOKENS, _LAST, _ACQUIRED, _WAITED = range(4)
+
+    def __init__(self, qps: float, burst: int=None, budget: int=None, context=None):
+        context = context or multiprocessing.get_context('spawn')
+        self._state = context.RawArray('d', 4)
+        super().__init__(qps, burst)
+        self.budget = budget
+        self._lock = context.Lock()
+
+    def __repr__(self):
+        return f'SharedTokenBucket<qps={self.qps}, burst={self.burst}, budget={self.budget}>'
+
+    def _get(self, index: int) -> float:
+        return self._state[index]
+
+    def _put(self, index: int, value: float) -> None:
+        self._state[index] = value
+
+    _tokens = property(lambda self: self._get(self._TOKENS), lambda self, v: self._put(self._TOKENS, v))
+    _last = property(lambda self: self._get(self._LAST), lambda self, v: self._put(self._LAST, v))
+    acquired = property(lambda self: int(self._get(self._ACQUIRED)), lambda self, v: self._put(self._ACQUIRED, v))
+    waited = property(lambda self: self._get(self._WAITED), lambda self, v: self._put(self._WAITED, v))
+
+    def reserve(self, tokens: int=1) -> float:
+        # the budget is checked and spent at once, else two processes could both take its last token
+        with self._lock:
+            if self.budget is not None and self.acquired + tokens > self.budget:
+                raise QuotaExhaustedError(f'the budget of {self.budget} calls is used up')
+            return self._take(tokens)
+
+
+class SharedRateLimiter(RateLimiter):
+    '''
+    RateLimiter whose buckets are in shared memory, pass it to the workers of OcrRunner to share one quota.
+    The buckets are created up front: one per credential of credentials (None matches every other credential)
+    and per service type of limits.
+
+    qps: unlike RateLimiter, whose default qps makes a bucket per service type, the default qps is ONE bucket
+        shared by all the service types missing from limits: no bucket can be added once the workers started.
+        List every service type in limits to give each one its own quota
+    budget: max calls of every bucket across the processes, see SharedTokenBucket
+    '''
+
+    def __init__(self, qps: float=None, burst: int=None, limits: Dict[Hashable, _Limit]=None,
+                 credentials: Iterable[Hashable]=(None, ), budget: int=None, context=None):
+        super().__init__(qps, burst, limits)
+        self.credentials = tuple(credentials)
+        self.budget = budget
+        for credential in self.credentials:
+            for service_type, limit in [(None, qps)] + list(self.limits.items()):
+                if limit is None:
+                    continue
+                qps_, burst_ = limit if isinstance(limit, tuple) else (limit, burst)
+                self._buckets[(service_type, credential)] = SharedTokenBucket(qps_, burst_, budget, context)
+
+    def __repr__(self):
+        return f'SharedRateLimiter<qps={self.qps}, burst={self.burst}, buckets={len(self._buckets)}>'
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def bucket(self, service_type: Hashable, credential: Hashable=None) -> TokenBucket:
+        '''
+        :return: the bucket of service_type and credential, the shared default bucket when service_type
+            is missing from limits, None if there is neither
+        '''
+        if credential not in self.credentials:
+            credential = None
+        return self._buckets.get((service_type, credential)) or self._buckets.get((None, credential))
@@ -0,0 +1,147 @@
+# Typed view of a words_result response, decoded from the body only when one of its fields is read
+import json
+
+from typing import Iterator, List, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:
+    # orjson is only a faster decoder, the json module decodes the same results
+    orjson = None
+
+__all__ = ['loads', 'OcrLine', 'OcrResult']
+
+
+def loads(body: Union[bytes, str]):
+    '''
+    Decode a json body with orjson when it is installed, else with the json module
+    '''
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+Box = Tuple[int, int, int, int]
+
+
+class OcrLine(object):
+    '''
+    One line of a words_result.
+
+    words: the text of the line
+    box: (left, top, width, height), None when the service type returns no location
+    probability: the average confidence of the line, None when the probability was not requested
+    '''
+
+    __slots__ = ('words', 'box', 'probability', 'raw')
+
+    def __init__(self, words: str, box: Optional[Box]=None, probability: Optional[float]=None,
+                 raw: dict=None):
+        self.words = words
+        self.box = box
+        self.probability = probability
+        self.raw = raw
+
+    def __repr__(self):
+        return f'OcrLine<{self.words!r}, box={self.box}, probability={self.probability}>'
+
+    def __eq__(self, other):
+        if not isinstance(other, OcrLine):
+            return NotImplemented
+        return (self.words, self.box, self.probability) == (other.words, other.box, other.probability)
+
+    @classmethod
+    def from_dict(cls, words: dict) -> 'OcrLine':
+        location = words.get('location')
+        box = None
+        if isinstance(location, dict):
+            box = (location.get('left', 0), location.get('top', 0),
+                   location.get('width', 0), location.get('height', 0))
+        probability = words.get('probability')
+        if isinstance(probability, dict):
+            probability = probability.get('average')
+        return cls(words.get('words') or '', box, probability, words)
+
+
+class OcrResult(object):
+    '''
+    Result of one ocr call, parsed lazily from the response body:
+    the body is decoded the first time a field is read, the lines are built the first time they are read.
+
+        result = await response.json(result=True)
+        result.text, result.lines, result.boxes, result.probabilities
+
+    body: the response body, or an already decoded dict
+    sep: the separator of the lines in text
+    '''
+
+    __slots__ = ('_body', '_data', '_lines', 'sep')
+
+    def __init__(self, body: Union[bytes, str, dict], sep: str=''):
+        self._body = None if isinstance(body, dict) else body
+        self._data = body if isinstance(body, dict) else None
+        self._lines: List[OcrLine] = None
+        self.sep = sep
+
+    def __repr__(self):
+        if self.error_code is not None:
+            return f'OcrResult<error_code={self.error_code}>'
+        return f'OcrResult<lines={len(self)}>'
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self) -> Iterator[OcrLine]:
+        return iter(self.lines)
+
+    def __getitem__(self, index) -> OcrLine:
+        return self.lines[index]
+
+    def __str__(self):
+        return self.text
+
+    @property
+    def raw(self) -> dict:
+        '''
+        The decoded response
+        '''
+        if self._data is None:
+            self._data = loads(self._body)
+            self._body = None
+        return self._data
+
+    @property
+    def lines(self) -> List[OcrLine]:
+        if self._lines is None:
+            words_result = self.raw.get('words_result')
+            self._lines = [OcrLine.from_dict(words) for words in words_result if isinstance(words, dict)] \
+                if isinstance(words_result, list) else []
+        return self._lines
+
+    @property
+    def words(self) -> List[str]:
+        return [line.words for line in self.lines]
+
+    @property
+    def boxes(self) -> List[Optional[Box]]:
+        return [line.box for line in self.lines]
+
+    @property
+    def probabilities(self) -> List[Optional[float]]:
+        return [line.probability for line in self.lines]
+
+    @property
+    def text(self) -> str:
+        return self.sep.join(self.words)
+
+    @property
+    def error_code(self) -> Optional[int]:
+        return self.raw.get('error_code')
+
+    @property
+    def error_msg(self) -> Optional[str]:
+        return self.raw.get('error_msg')
+
+    @property
+    def log_id(self) -> Optional[int]:
+        return self.raw.get('log_id')
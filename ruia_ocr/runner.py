@@ -0,0 +1,268 @@
+# Sharded runs of an OcrSpider: the start urls are split by hash between worker processes,
+# each one runs the spider on its own event loop with its own service
+import os
+import time
+import zlib
+import queue
+import asyncio
+import threading
+import multiprocessing
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Type
+
+from ruia import Item
+from ruia.utils import get_logger
+from ruia_ocr.ratelimit import RateLimiter
+
+__all__ = ['WorkerResult', 'shard_of', 'OcrRunner']
+
+logger = get_logger('Ocr')
+
+_STOP = None
+
+
+class WorkerResult(NamedTuple):
+    '''
+    One result streamed back by a worker.
+    uri: the start url, None for the items yielded by an async generator callback
+    ok: whether the ocr request succeeded
+    value: what the callback returned or yielded, Item.results for an Item
+    '''
+    worker: int
+    uri: Optional[str]
+    ok: bool
+    value: Any
+
+
+def shard_of(uri: str, shards: int) -> int:
+    '''
+    :return: the shard of the uri, the same in every process and every run unlike hash()
+    '''
+    return zlib.crc32(uri.encode('utf-8', 'surrogatepass')) % shards
+
+
+class _QueueUrls(object):
+    '''
+    start_urls of a worker: the urls of its shard, until the parent sends _STOP
+    '''
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+
+    def __iter__(self):
+        while True:
+            url = self.inputs.get()
+            if url is _STOP:
+                return
+            yield url
+
+
+def _plain(value: Any) -> Any:
+    return value.results if isinstance(value, Item) else value
+
+
+def _set_rate_limiter(service, rate_limiter: RateLimiter) -> None:
+    for member in getattr(service, 'services', [service]):
+        member.rate_limiter = rate_limiter
+
+
+def _worker_main(index: int, spider_cls, service_factory: Optional[Callable], inputs, outputs,
+                 rate_limiter: Optional[RateLimiter]) -> None:
+    '''
+    The body of a worker process: run spider_cls over the urls of its shard, stream the results to outputs
+    '''
+    counts = {'requests': 0, 'ok': 0, 'failed': 0, 'results': 0}
+
+    def emit(uri, ok, value):
+        counts['results'] += 1
+        outputs.put(('result', WorkerResult(index, uri, ok, _plain(value))))
+
+    class WorkerSpider(spider_cls):
+        start_urls = _QueueUrls(inputs)
+        if service_factory is not None:
+            ocr_service = service_factory(index)
+
+        async def handle_request(self, request):
+            callback_result, request, response = await super(WorkerSpider, self).handle_request(request)
+            uri = getattr(request, 'uri', None)
+            ok = response is not None and response.ok
+            counts['requests'] += 1
+            counts['ok' if ok else 'failed'] += 1
+            if not hasattr(callback_result, '__aiter__'):
+                # the value of a coroutine callback, the yields of an async generator come one by one below
+                emit(uri, ok, callback_result)
+            return callback_result, request, response
+
+        async def process_item(self, item):
+            emit(None, True, item)
+
+        async def process_callback_result(self, callback_result):
+            emit(None, True, callback_result)
+
+    WorkerSpider.__name__ = spider_cls.__name__
+    if rate_limiter is not None:
+        _set_rate_limiter(WorkerSpider.ocr_service, rate_limiter)
+    start = time.perf_counter()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(WorkerSpider.async_start(loop=loop))
+        loop.run_until_complete(WorkerSpider.ocr_service.aclose())
+    except BaseException as e:
+        outputs.put(('error', (index, repr(e))))
+    finally:
+        stats = dict(counts, worker=index, pid=os.getpid(), seconds=round(time.perf_counter() - start, 4))
+        service = WorkerSpider.ocr_service
+        stats['encode_stats'] = dict(getattr(service, 'encode_stats', {}))
+        metrics = getattr(service, 'metrics', None)
+        if metrics is not None:
+            stats['metrics'] = metrics.snapshot()
+        if getattr(service, 'services', None):
+            stats['pool'] = service.stats
+        outputs.put(('stats', stats))
+        loop.close()
+
+
+class OcrRunner(object):
+    '''
+    Run an OcrSpider in worker processes, so that the image stage of every worker gets its own core.
+    The start urls are sharded by a hash of the url, every worker runs the spider on its own event loop
+    with its own service, and streams the results back to the parent.
+
+        runner = OcrRunner(MySpider, workers=4, rate_limiter=SharedRateLimiter(qps=10))
+        for result in runner.run(iter_file_paths('./images')):
+            print(result.uri, result.value)
+        print(runner.stats)
+
+    spider_cls: an OcrSpider subclass defined at module level, the workers import it
+    workers: number of worker processes
+    service_factory: module level function(worker index) -> service of the worker,
+        None means the ocr_service the spider class creates when its module is imported by the worker
+    rate_limiter: a SharedRateLimiter (or any picklable RateLimiter) set on the service of every worker,
+        so that all the workers share one qps quota and call budget
+    queue_size: max urls waiting for each worker, and max results waiting for the parent
+    start_method: multiprocessing start method, spawn by default: the workers don't inherit the loop
+        and the sessions of the parent
+    '''
+
+    def __init__(self,
+                 spider_cls: Type,
+                 workers: int=None,
+                 service_factory: Callable[[int], Any]=None,
+                 rate_limiter: RateLimiter=None,
+                 queue_size: int=1000,
+                 start_method: str='spawn',
+                 shutdown_timeout: float=30.0):
+        self.spider_cls = spider_cls
+        self.workers = workers or os.cpu_count() or 1
+        self.service_factory = service_factory
+        self.rate_limiter = rate_limiter
+        self.queue_size = queue_size
+        self.context = multiprocessing.get_context(start_method)
+        self.shutdown_timeout = shutdown_timeout
+        self.worker_stats: Dict[int, dict] = {}
+        self.errors: List[tuple] = []
+        self.dispatched = [0] * self.workers
+        self.dropped = 0
+        self.results = 0
+
+    def __repr__(self):
+        return f'OcrRunner<{self.spider_cls.__name__}, workers={self.workers}>'
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'dispatched': list(self.dispatched),
+            'dropped': self.dropped,
+            'results': self.results,
+            'errors': list(self.errors),
+            'per_worker': [self.worker_stats.get(index) for index in range(self.workers)],
+        }
+
+    def _feed(self, urls: Iterable[str], inputs: list, processes: list, stop: threading.Event) -> None:
+        def put(index, url) -> bool:
+            while not stop.is_set():
+                if not processes[index].is_alive():
+                    return False
+                try:
+                    inputs[index].put(url, timeout=0.2)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for url in urls:
+                if stop.is_set():
+                    break
+                index = shard_of(url, self.workers)
+                if put(index, url):
+                    self.dispatched[index] += 1
+                else:
+                    self.dropped += 1
+        except Exception as e:
+            logger.error(f'<Runner start urls: {e!r}>')
+            self.errors.append((None, repr(e)))
+        finally:
+            for index in range(self.workers):
+                put(index, _STOP)
+
+    def run(self, start_urls: Iterable[str]=None) -> Iterator[WorkerResult]:
+        '''
+        Start the workers, dispatch start_urls (the start_urls of the spider by default)
+        and yield the results as they arrive. Closing the iterator early stops the workers
+        '''
+        urls = self.spider_cls.start_urls if start_urls is None else start_urls
+        inputs = [self.context.Queue(self.queue_size) for _ in range(self.workers)]
+        outputs = self.context.Queue(self.queue_size)
+        processes = [
+            self.context.Process(target=_worker_main,
+                                 name=f'ruia_ocr_worker_{index}',
+                                 args=(index, self.spider_cls, self.service_factory, inputs[index], outputs,
+                                       self.rate_limiter),
+                                 daemon=True)
+            for index in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        stop = threading.Event()
+        feeder = threading.Thread(target=self._feed, args=(urls, inputs, processes, stop),
+                                  name='ruia_ocr_runner_feed', daemon=True)
+        feeder.start()
+        finished = set()
+        try:
+            while len(finished) < self.workers:
+                try:
+                    kind, payload = outputs.get(timeout=0.5)
+                except queue.Empty:
+                    for index, process in enumerate(processes):
+                        if index not in finished and not process.is_alive():
+                            # died without its stats, such as killed by the os
+                            finished.add(index)
+                            self.errors.append((index, f'exit code {process.exitcode}'))
+                            logger.error(f'<Runner worker {index} died: exit code {process.exitcode}>')
+                    continue
+                if kind == 'result':
+                    self.results += 1
+                    yield payload
+                elif kind == 'stats':
+                    self.worker_stats[payload['worker']] = payload
+                    finished.add(payload['worker'])
+                    logger.info(f'<Runner worker {payload["worker"]} finished: {payload["requests"]} requests '
+                                f'in {payload["seconds"]}s>')
+                elif kind == 'error':
+                    self.errors.append(payload)
+                    logger.error(f'<Runner worker {payload[0]}: {payload[1]}>')
+        finally:
+            stop.set()
+            feeder.join(timeout=self.shutdown_timeout)
+            deadline = time.monotonic() + self.shutdown_timeout
+            for process in processes:
+                process.join(timeout=max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            for q in inputs + [outputs]:
+                q.close()
+                q.cancel_join_thread()
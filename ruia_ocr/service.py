@@ -1,5 +1,6 @@
 import os
-import base64
+import asyncio
+import concurrent.futures
 import hmac
 import hashlib
 import datetime
@@ -8,36 +9,39 @@ import requests
 import json
 
 from PIL import Image
-from io import BytesIO
+from requests.adapters import HTTPAdapter
+from types import MappingProxyType
 from urllib.parse import urlparse, quote, urlencode
-from typing import Any, List, Tuple, Union
+from typing import Any, AsyncIterator, Iterable, List, Mapping, NamedTuple, Optional, Tuple, Union
 from enum import Enum
 
 from ruia import Request
 from ruia.utils import get_logger
-from ruia_ocr.exceptions import ServicePayloadsError, ImageTypeError
+from ruia_ocr.exceptions import ServicePayloadsError, ImageTypeError, ImageFetchError
 from ruia_ocr.configs import *
+from ruia_ocr.executor import OcrExecutor
+from ruia_ocr.utils import IMAGE_EXTENSIONS
+from ruia_ocr.cache import OcrCache
+from ruia_ocr.ratelimit import RateLimiter
+from ruia_ocr.auth import AccessTokenManager, BceSigner, TokenStore, _access_token_url
+from ruia_ocr.tiling import TilePolicy, Tile, preprocess_tiles, merge_words_results
+from ruia_ocr.batching import BatchPolicy, CompositeBatcher, image_size
+from ruia_ocr.dedupe import DedupeIndex, DedupeKey, image_fingerprint
+from ruia_ocr.metrics import OcrMetrics, NULL_TIMER
+from ruia_ocr.result import OcrResult, loads
+from ruia_ocr.hedging import HedgePolicy, hedged
+from ruia_ocr.prefilter import BlankFilter, blank_stats
+from ruia_ocr.imaging import (Region, RegionStr, ImageSource, ImageBytes, EncoderPolicy, EncodedImage, RawImage,
+                              parse_region, crop_by_region, encode_image, open_image, passthrough_image,
+                              preprocess_image)
+from ruia_ocr.formbody import FormBody, FormPayload
+from ruia_ocr.fetch import ImageFetcher
 
 logger = get_logger('Spider')
 
-_Number = Union[int, float]
+__all__ = ['BaiduOcrService', 'BaseOcrService', 'OcrBatchResult']
 
-Region = Tuple[_Number, _Number, _Number, _Number] # (x1, y1, x2, y2)
-
-RegionStr = str #  x1,y1,x2,y2;...  example 1,1,200,200;1,1,0.9,0.9
-
-try:
-    # Adaptive interface changes. It's recommended to do this
-    from aip.base import AipBase
-
-    _access_token_url = AipBase._AipBase__accessTokenUrl
-except:
-    # Fixed api implementation, not recommended
-    _access_token_url = 'https://aip.baidubce.com/oauth/2.0/token'
-
-
-
-__all__ = ['BaiduOcrService', 'BaseOcrService']
+BatchInput = Union[ImageSource, Tuple[ImageSource, RegionStr]]
 
 
 def getAuthrHeaders(method,
@@ -96,6 +100,23 @@ def getAuthrHeaders(method,
     return headers
 
 
+class OcrBatchResult(NamedTuple):
+    '''
+    One result of aio_request_many
+    index: position of the image in the inputs
+    error: the exception raised by this image, result is None then
+    '''
+    index: int
+    source: ImageSource
+    region: RegionStr
+    result: Any
+    error: Exception = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
 class BaseOcrService(object):
     '''
     You can implement your own ocr-services by only implementing a subclass.
@@ -109,11 +130,64 @@ class BaseOcrService(object):
 
     service_types = None
 
-    def __init__(self):
+    # Formats the ocr api accepts as they are: such a file without region, within the limits of the api and
+    # of the encoder, is sent without decoding and image_convert_ocr is not called. () means always decode.
+    # A subclass overriding image_convert_ocr always decodes, unless it sets PASSTHROUGH_FORMATS itself
+    PASSTHROUGH_FORMATS: Tuple[str, ...] = ()
+
+    # Stream the urlencoded body of the calls chunk by chunk, see ruia_ocr.formbody.
+    # False hands the payload dict to aiohttp/requests, which urlencode it into one more copy of the image
+    STREAM_BODY = True
+
+    # Default config of the pooled sessions used by aio_request and request
+    # LIMIT: max connections of the pool, LIMIT_PER_HOST: 0 means no limit per host
+    # KEEPALIVE_TIMEOUT: seconds an idle connection is kept, TTL_DNS_CACHE: seconds a dns lookup is cached
+    SESSION_CONFIG = {
+        "LIMIT": 100,
+        "LIMIT_PER_HOST": 0,
+        "KEEPALIVE_TIMEOUT": 30,
+        "TTL_DNS_CACHE": 300,
+        "TIMEOUT": 10,
+    }
+
+    def __init__(self, executor: OcrExecutor=None, cache: OcrCache=None, session_config: dict=None,
+                 rate_limiter: RateLimiter=None, encoder: EncoderPolicy=None, tiling: TilePolicy=None,
+                 batching: BatchPolicy=None, dedupe: DedupeIndex=None, metrics: OcrMetrics=None,
+                 hedging: HedgePolicy=None, prefilter: BlankFilter=None, fetcher: ImageFetcher=None):
         self._service_url: str = None
         self._service_type: BaseServiceTypes = None
         self._service_payload = None
         self._ocr_options = {}
+        self._executor = executor
+        self._cache = cache
+        self.session_config = dict(self.SESSION_CONFIG, **(session_config or {}))
+        self._aio_session: aiohttp.ClientSession = None
+        self._session: requests.Session = None
+        # close of the aiohttp session scheduled by close() on its running loop
+        self._closing: concurrent.futures.Future = None
+        self._rate_limiter = rate_limiter
+        self.encoder = encoder
+        self.tiling = tiling
+        self.batching = batching
+        self.dedupe = dedupe
+        self.metrics = metrics
+        self.hedging = hedging
+        self.prefilter = prefilter
+        self.fetcher = fetcher
+        self._batcher: CompositeBatcher = None
+        self.encode_stats = {'images': 0, 'bytes': 0, 'saved_bytes': 0, 'passthrough': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
 
     def __repr__(self):
         return f'{self.name}<{self.service_url}, {self.service_type}>'
@@ -126,6 +200,470 @@ class BaseOcrService(object):
     def ocr_options(self, value):
         self._ocr_options = value
 
+    @property
+    def executor(self) -> OcrExecutor:
+        '''
+        :return: The pool running the image stage off the event loop, None means inline
+        '''
+        return self._executor
+
+    @executor.setter
+    def executor(self, value: OcrExecutor):
+        self._executor = value
+
+    @property
+    def passthrough_formats(self) -> Tuple[str, ...]:
+        '''
+        :return: PASSTHROUGH_FORMATS, () when image_convert_ocr is overridden below the class setting them
+        '''
+        mro = type(self).__mro__
+        convert = next(cls for cls in mro if 'image_convert_ocr' in vars(cls))
+        formats = next(cls for cls in mro if 'PASSTHROUGH_FORMATS' in vars(cls))
+        return self.PASSTHROUGH_FORMATS if issubclass(formats, convert) else ()
+
+    @property
+    def cache(self) -> OcrCache:
+        '''
+        :return: The ocr result cache checked before any network call, None means no cache
+        '''
+        return self._cache
+
+    @cache.setter
+    def cache(self, value: OcrCache):
+        self._cache = value
+
+    @property
+    def aio_session(self) -> aiohttp.ClientSession:
+        '''
+        :return: The keep-alive aiohttp session of aio_request, created lazily in the running loop
+        '''
+        loop = asyncio.get_event_loop()
+        if self._aio_session is None or self._aio_session.closed or self._aio_session._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.session_config['LIMIT'],
+                limit_per_host=self.session_config['LIMIT_PER_HOST'],
+                keepalive_timeout=self.session_config['KEEPALIVE_TIMEOUT'],
+                ttl_dns_cache=self.session_config['TTL_DNS_CACHE'],
+                use_dns_cache=True)
+            self._aio_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.session_config['TIMEOUT']),
+                trace_configs=[self.metrics.trace_config()] if self.metrics is not None else None)
+        return self._aio_session
+
+    @property
+    def session(self) -> requests.Session:
+        '''
+        :return: The keep-alive requests session of request, created lazily
+        '''
+        if self._session is None:
+            adapter = HTTPAdapter(pool_connections=self.session_config['LIMIT'],
+                                  pool_maxsize=self.session_config['LIMIT'])
+            self._session = requests.Session()
+            self._session.mount('https://', adapter)
+            self._session.mount('http://', adapter)
+        return self._session
+
+    async def aclose(self) -> None:
+        '''
+        Close the pooled sessions, and wait for a close of the aiohttp session scheduled by close()
+        '''
+        if self._aio_session is not None:
+            session, self._aio_session = self._aio_session, None
+            await session.close()
+        if self._closing is not None:
+            closing, self._closing = self._closing, None
+            await asyncio.wrap_future(closing)
+        self.close()
+
+    def close(self) -> None:
+        '''
+        Close the pooled sessions. When the loop of the aiohttp session is running, its close is scheduled
+        on that loop: await aclose() instead to wait for it
+        '''
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self._aio_session is not None:
+            session, self._aio_session = self._aio_session, None
+            loop = session._loop
+            if loop.is_closed():
+                return
+            if loop.is_running():
+                # from the thread of the loop or any other one
+                self._closing = asyncio.run_coroutine_threadsafe(session.close(), loop)
+            else:
+                loop.run_until_complete(session.close())
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        '''
+        :return: The limiter shared by every request of this service, None means no limit
+        '''
+        return self._rate_limiter
+
+    @rate_limiter.setter
+    def rate_limiter(self, value: RateLimiter):
+        self._rate_limiter = value
+
+    def _timer(self, stage: str):
+        '''
+        with self._timer('encode'): ..., times the stage in self.metrics when there is one
+        '''
+        return NULL_TIMER if self.metrics is None else self.metrics.timer(stage)
+
+    def _count(self, event: str, value: int=1) -> None:
+        if self.metrics is not None:
+            self.metrics.count(event, value)
+
+    def _observe_size(self, name: str, size: int) -> None:
+        if self.metrics is not None:
+            self.metrics.observe_size(name, size)
+
+    @property
+    def batcher(self) -> CompositeBatcher:
+        '''
+        :return: The composite batcher of the running loop following self.batching, None means no batching
+        '''
+        if self.batching is None:
+            return None
+        loop = asyncio.get_event_loop()
+        if self._batcher is None or self._batcher.loop is not loop or self._batcher.policy is not self.batching:
+            self._batcher = CompositeBatcher(self, self.batching)
+            if self.batching.service_type != self.service_type:
+                logger.info(f'<Batching: the small images are sent to {self.batching.service_type} '
+                            f'instead of {self.service_type}>')
+        return self._batcher
+
+    def is_batched(self, request) -> bool:
+        '''
+        Decide whether the image of the request is packed with others by the composite batcher,
+        only the header of the image is read. The decision is kept in request.batched
+        '''
+        request.batched = False
+        if self.batching is None or request.service_type not in (None, self.service_type):
+            return False
+        if request.uri.startswith('http') or not request.uri.lower().endswith(IMAGE_EXTENSIONS):
+            return False
+        try:
+            request.batched = self.batching.accepts(image_size(request.uri, self._request_region(request)))
+        except OSError:
+            pass
+        return request.batched
+
+    def called_type(self, request) -> BaseServiceTypes:
+        '''
+        :return: The service type the request is sent to, the one of self.batching for a batched request.
+        The cache and dedupe keys of the request use it, see is_batched
+        '''
+        if request.batched:
+            return self.batching.service_type
+        return request.service_type or self.service_type
+
+    def batch_size(self, source: ImageSource, region: RegionStr=None) -> Optional[Tuple[int, int]]:
+        '''
+        :return: the size of the image when the composite batcher packs it, None when it is sent alone
+        '''
+        if self.batching is None or (isinstance(source, str) and source.startswith('http')):
+            return None
+        try:
+            size = image_size(source, region)
+        except OSError:
+            return None
+        return size if self.batching.accepts(size) else None
+
+    @property
+    def credential(self) -> Any:
+        '''
+        :return: The unit the quota of the ocr api is counted by, such as the app id
+        '''
+        return None
+
+    async def acquire_quota(self, service_type: BaseServiceTypes=None) -> None:
+        '''
+        Wait for a token of the rate limiter before sending a request
+        '''
+        if self._rate_limiter is not None:
+            with self._timer('quota_wait'):
+                await self._rate_limiter.acquire(service_type or self.service_type, self.credential)
+
+    def acquire_quota_sync(self, service_type: BaseServiceTypes=None) -> None:
+        if self._rate_limiter is not None:
+            with self._timer('quota_wait'):
+                self._rate_limiter.acquire_sync(service_type or self.service_type, self.credential)
+
+    def is_quota_error(self, json: dict) -> bool:
+        '''
+        Hook function: whether a decoded response of the ocr api reports the qps limit was exceeded
+        '''
+        return False
+
+    def is_exhausted_error(self, json: dict) -> bool:
+        '''
+        Hook function: whether a decoded response of the ocr api reports the daily or total quota is used up
+        '''
+        return False
+
+    def quota_backoff(self, seconds: float=1.0, service_type: BaseServiceTypes=None) -> None:
+        if self._rate_limiter is not None:
+            self._rate_limiter.backoff(service_type or self.service_type, self.credential, seconds)
+
+    def is_token_error(self, json: dict) -> bool:
+        '''
+        Hook function: whether a decoded response of the ocr api reports an invalid or expired access token
+        '''
+        return False
+
+    def checkout(self, request=None, exclude: 'BaseOcrService'=None) -> 'BaseOcrService':
+        '''
+        Hook function: the service sending the next attempt of a request, a pool of services picks a member
+        :param exclude: a service to avoid when there is another one, such as the one of a hedged call
+        '''
+        return self
+
+    def checkin(self, service: 'BaseOcrService', ok: Optional[bool], result: dict=None) -> None:
+        '''
+        Hook function: the outcome of an attempt sent by service, ok is None when no call was made,
+        result is the decoded response when there is one
+        '''
+
+    def invalidate_token(self) -> None:
+        '''
+        Hook function: drop the access token, the next request fetches a new one
+        '''
+
+    def cache_key(self, source: ImageSource, region: RegionStr=None,
+                  service_type: BaseServiceTypes=None) -> str:
+        '''
+        :return: The cache key of an image source with the service type, its payload, the encoder
+        and the cache_params. It hashes the whole image, see cached_body
+        '''
+        service_type = service_type or self.service_type
+        return OcrCache.make_key(source, region, service_type, self.get_payload(service_type), self.encoder,
+                                 self.cache_params(service_type))
+
+    def cache_meta(self, region: RegionStr=None, service_type: BaseServiceTypes=None) -> str:
+        '''
+        :return: Everything but the image in the cache key, see OcrCache.make_meta
+        '''
+        service_type = service_type or self.service_type
+        return OcrCache.make_meta(region, service_type, self.get_payload(service_type), self.encoder,
+                                  self.cache_params(service_type))
+
+    def cache_params(self, service_type: BaseServiceTypes=None) -> dict:
+        '''
+        Hook function: the parameters of the request a result depends on, besides its payload and the encoder
+        '''
+        return {
+            'url': self.get_service_url(service_type),
+            'tiling': vars(self.tiling) if self.tiling is not None else None,
+        }
+
+    async def cached_body(self, source: ImageSource, region: RegionStr=None, service_type: BaseServiceTypes=None,
+                          cache_key: str=None) -> Tuple[Optional[str], Optional[bytes]]:
+        '''
+        :param cache_key: the key of the image when it is already known, the image is not hashed again
+        :return: (cache key, cached body or None), (None, None) when there is no cache.
+        The image is hashed and the cache is read in a thread, off the event loop
+        '''
+        if self._cache is None:
+            return None, None
+        return await asyncio.get_event_loop().run_in_executor(None, self.cached_body_sync, source, region,
+                                                              service_type, cache_key)
+
+    def cached_body_sync(self, source: ImageSource, region: RegionStr=None, service_type: BaseServiceTypes=None,
+                         cache_key: str=None) -> Tuple[Optional[str], Optional[bytes]]:
+        if self._cache is None:
+            return None, None
+        if cache_key is None:
+            cache_key = self.cache_key(source, region, service_type)
+        body = self._cache.get(cache_key)
+        if body is not None:
+            self._count('cache_hits')
+        return cache_key, body
+
+    def is_cacheable(self, json: dict) -> bool:
+        '''
+        Hook function: whether a decoded response of the ocr api can be cached
+        '''
+        return True
+
+    def _loads(self, body: bytes, service_type: BaseServiceTypes=None) -> Tuple[dict, bool]:
+        '''
+        :return: (decoded response, whether it can be cached), a quota or token error is handled
+        '''
+        with self._timer('parse'):
+            result = loads(body)
+        self._observe_size('response', len(body))
+        if self.is_quota_error(result):
+            self._count('quota_errors')
+            self.quota_backoff(service_type=service_type)
+        elif self.is_token_error(result):
+            self._count('token_errors')
+            self.invalidate_token()
+        else:
+            return result, self.is_cacheable(result)
+        return result, False
+
+    def _loads_and_cache(self, cache_key: str, body: bytes, service_type: BaseServiceTypes=None,
+                         dedupe_key: DedupeKey=None) -> dict:
+        result, cacheable = self._loads(body, service_type)
+        if cacheable:
+            self._remember(cache_key, body, dedupe_key)
+        return result
+
+    async def _aio_loads_and_cache(self, cache_key: str, body: bytes, service_type: BaseServiceTypes=None,
+                                   dedupe_key: DedupeKey=None) -> dict:
+        result, cacheable = self._loads(body, service_type)
+        if cacheable:
+            await self.remember(cache_key, body, dedupe_key)
+        return result
+
+    async def remember(self, cache_key: str, body: bytes, dedupe_key: DedupeKey=None) -> None:
+        '''
+        Keep a result in the cache and the dedupe index, their sqlite files are written in a thread,
+        off the event loop
+        '''
+        if dedupe_key is None and (cache_key is None or self._cache.path is None):
+            return self._remember(cache_key, body)
+        await asyncio.get_event_loop().run_in_executor(None, self._remember, cache_key, body, dedupe_key)
+
+    def _remember(self, cache_key: str, body: bytes, dedupe_key: DedupeKey=None) -> None:
+        if cache_key is not None:
+            self._cache.set(cache_key, body)
+        if dedupe_key is not None:
+            self.dedupe.add(dedupe_key, body)
+
+    async def dedupe_key(self, source: ImageSource, region: RegionStr=None,
+                         service_type: BaseServiceTypes=None) -> Optional[DedupeKey]:
+        '''
+        :return: The key of the image in self.dedupe, the hash runs in self.executor, else in a thread.
+        None when there is no dedupe index or the image can't be hashed, such as a remote image the ocr api downloads
+        '''
+        if self.dedupe is None or (isinstance(source, str) and source.startswith('http')):
+            return None
+        try:
+            if self._executor is None:
+                value = await asyncio.get_event_loop().run_in_executor(None, self.dedupe.fingerprint, source, region)
+            else:
+                value = await self._executor.run(image_fingerprint, source, region, self.dedupe.method,
+                                                 self.dedupe.hash_size, self.dedupe.cell, self.dedupe.max_cells)
+        except OSError:
+            return None
+        return self._make_dedupe_key(value, region, service_type)
+
+    def dedupe_key_sync(self, source: ImageSource, region: RegionStr=None,
+                        service_type: BaseServiceTypes=None) -> Optional[DedupeKey]:
+        if self.dedupe is None or (isinstance(source, str) and source.startswith('http')):
+            return None
+        try:
+            value = self.dedupe.fingerprint(source, region)
+        except OSError:
+            return None
+        return self._make_dedupe_key(value, region, service_type)
+
+    def _make_dedupe_key(self, fingerprint: tuple, region: RegionStr=None,
+                         service_type: BaseServiceTypes=None) -> DedupeKey:
+        value, shape, grid = fingerprint
+        return DedupeKey(value, self.cache_meta(region, service_type), shape, grid)
+
+    async def deduped_body(self, dedupe_key: Optional[DedupeKey], cache_key: str=None) -> Optional[bytes]:
+        '''
+        :return: The body of a duplicate of the image already recognized, None when there is none.
+        The index and the cache are read and written off the event loop
+        '''
+        if dedupe_key is None:
+            return None
+        body = await asyncio.get_event_loop().run_in_executor(None, self.dedupe.get, dedupe_key)
+        if body is not None:
+            self._reuse_duplicate(dedupe_key)
+            await self.remember(cache_key, body)
+        return body
+
+    def _dedupe_get(self, dedupe_key: Optional[DedupeKey], cache_key: str=None) -> Optional[bytes]:
+        if dedupe_key is None:
+            return None
+        body = self.dedupe.get(dedupe_key)
+        if body is not None:
+            self._reuse_duplicate(dedupe_key)
+            self._remember(cache_key, body)
+        return body
+
+    def _reuse_duplicate(self, dedupe_key: DedupeKey) -> None:
+        self._count('dedupe_hits')
+        logger.debug(f'<Duplicate {dedupe_key.hash:x}: reuse the result>')
+
+    def is_fetched(self, uri: Any) -> bool:
+        '''
+        :return: whether the uri is a remote image downloaded by self.fetcher
+        '''
+        return self.fetcher is not None and self.fetcher.accepts(uri)
+
+    async def fetch_image(self, url: str, session: aiohttp.ClientSession=None, request=None) -> bytes:
+        '''
+        Download a remote image with self.fetcher through the pooled session, the spider's one for a request
+        :return: the bytes of the image
+        '''
+        try:
+            with self._timer('fetch'):
+                return await self.fetcher.fetch(url, session or self.aio_session)
+        except ImageFetchError as e:
+            logger.error(str(e))
+            if request is not None:
+                request.retry_times = 0
+            raise
+
+    async def request_image(self, request) -> ImageSource:
+        '''
+        :return: The image of the request: its uri, or the bytes downloaded by self.fetcher. The bytes are kept
+        in request.image, the cache, the prefilter, the dedupe index and a retry don't download them again
+        '''
+        if not self.is_fetched(request.uri):
+            return request.uri
+        if getattr(request, 'image', None) is None:
+            request.image = await self.fetch_image(request.uri, request.current_request_session, request)
+        return request.image
+
+    async def is_blank(self, source: ImageSource, region: RegionStr=None) -> bool:
+        '''
+        :return: whether self.prefilter finds the image blank, the check runs in self.executor, else in a thread.
+        False when there is no prefilter or the image can't be read, such as a remote image the ocr api downloads
+        '''
+        if self.prefilter is None or (isinstance(source, str) and source.startswith('http')):
+            return False
+        try:
+            if self._executor is None:
+                stats = await asyncio.get_event_loop().run_in_executor(
+                    None, blank_stats, source, region, self.prefilter.thumbnail, self.prefilter.edge_threshold)
+            else:
+                stats = await self._executor.run(blank_stats, source, region, self.prefilter.thumbnail,
+                                                 self.prefilter.edge_threshold)
+        except OSError:
+            return False
+        return self._blank(stats)
+
+    def is_blank_sync(self, source: ImageSource, region: RegionStr=None) -> bool:
+        if self.prefilter is None or (isinstance(source, str) and source.startswith('http')):
+            return False
+        try:
+            stats = blank_stats(source, region, self.prefilter.thumbnail, self.prefilter.edge_threshold)
+        except OSError:
+            return False
+        return self._blank(stats)
+
+    def _blank(self, stats) -> bool:
+        if not self.prefilter.is_blank(stats):
+            return False
+        self._count('blank_skipped')
+        logger.debug(f'<Blank image {stats}: skip the ocr call>')
+        return True
+
+    def empty_result(self) -> dict:
+        '''
+        Hook function: the result of a blank image skipped by the prefilter
+        '''
+        return {}
+
     def set_payload(self, payloads: Any) -> None:
         '''
         :param payloads: The parameters of the service you requested,is a python dict
@@ -133,7 +671,7 @@ class BaseOcrService(object):
         dft:
             payload = self._service_type.dft_payload.copy()
             payload.update(payloads)
-            self._service_payload = payloads
+            self._service_payload = MappingProxyType(payload)
 
         '''
         return NotImplemented
@@ -166,53 +704,317 @@ class BaseOcrService(object):
         '''
         return self._service_payload
 
-    async def aio_request(self, image_path: str, region: RegionStr=None, *, img: Image.Image=None) -> dict:
+    def get_service_url(self, service_type: BaseServiceTypes=None) -> str:
+        '''
+        :return: The url of service_type, None means the service type of this service
+        '''
+        if service_type is None or service_type == self._service_type:
+            return self.service_url
+        return service_type.url
+
+    def get_payload(self, service_type: BaseServiceTypes=None) -> Mapping:
+        '''
+        :return: The read-only payload template of service_type, None means the service type of this service.
+        Every request builds its own payload from it, see build_payload
+        '''
+        if service_type is None or service_type == self._service_type:
+            return self._service_payload
+        return MappingProxyType(service_type.dft_payload)
+
+    def build_payload(self, service_type: BaseServiceTypes=None, **image_fields) -> dict:
+        '''
+        :param image_fields: the image data of one request, such as image=base64 data or url=remote image
+        :return: A new payload of one request
+        '''
+        payload = {k: v for k, v in (self.get_payload(service_type) or {}).items()
+                   if k not in ('image', 'url')}
+        payload.update(image_fields)
+        return payload
+
+    def form_body(self, service_type: BaseServiceTypes=None, **image_fields) -> Union[FormBody, dict]:
+        '''
+        :return: the body of one call sent by requests, a FormBody producing the urlencoded payload chunk by chunk,
+        the payload dict when STREAM_BODY is off
+        '''
+        payload = self.build_payload(service_type, **image_fields)
+        if self.STREAM_BODY:
+            return FormBody(payload)
+        return {k: b''.join(v.chunks()).decode() if isinstance(v, RawImage) else v for k, v in payload.items()}
+
+    def aio_form_body(self, service_type: BaseServiceTypes=None, **image_fields) -> Union[FormPayload, dict]:
+        '''
+        :return: the body of one call sent by aiohttp, see form_body
+        '''
+        body = self.form_body(service_type, **image_fields)
+        return FormPayload(body) if isinstance(body, FormBody) else body
+
+    async def aio_request(self, image_path: Union[str, ImageBytes], region: RegionStr=None, *,
+                          img: Image.Image=None) -> dict:
+        '''
+        Recognize one image
+        :param image_path: local image path or the bytes of an image file
+        :param img: PIL.Image, instead of image_path
+        '''
         return NotImplemented
         
-    def request(self, image_path: str=None, region: RegionStr=None, *, img: Image.Image=None) -> dict:
+    def request(self, image_path: Union[str, ImageBytes]=None, region: RegionStr=None, *,
+                img: Image.Image=None) -> dict:
         return NotImplemented
 
+    async def aio_request_many(self, inputs: Iterable[BatchInput], concurrency: int=10,
+                               ordered: bool=False) -> AsyncIterator[OcrBatchResult]:
+        '''
+        Bulk ocr outside ruia, yield an OcrBatchResult per input as they complete
+
+        :param inputs: image paths, PIL.Image or (image, region) tuples, consumed lazily
+        :param concurrency: max number of images in flight, so at most this many images are decoded at once
+        :param ordered: yield the results in the order of inputs instead of completion
+        '''
+        if concurrency < 1:
+            raise ValueError('concurrency must be greater than 0')
+        inputs = enumerate(inputs)
+        pending = set()
+        finished = {}
+        next_index = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < concurrency:
+                    try:
+                        index, item = next(inputs)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(asyncio.ensure_future(self._aio_request_one(index, item)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if not ordered:
+                        yield result
+                        continue
+                    finished[result.index] = result
+                    while next_index in finished:
+                        yield finished.pop(next_index)
+                        next_index += 1
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _aio_request_one(self, index: int, item: BatchInput) -> OcrBatchResult:
+        source, region = item if isinstance(item, tuple) else (item, None)
+        try:
+            if isinstance(source, Image.Image):
+                result = await self.aio_request(None, region, img=source)
+            else:
+                result = await self.aio_request(source, region)
+            return OcrBatchResult(index, source, region, result)
+        except Exception as e:
+            logger.error(f'<Ocr image {index}: {e!r}>')
+            return OcrBatchResult(index, source, region, None, e)
+
+    async def _aio_request_batched(self, source: ImageSource, region: RegionStr, size: Tuple[int, int],
+                                   cache_key: str=None, dedupe_key: DedupeKey=None) -> dict:
+        '''
+        Recognize the image through the composite batcher, see batch_size
+        :return: the result of the image
+        '''
+        result = await self.batcher.submit(source, region, size)
+        if self.is_cacheable(result):
+            await self.remember(cache_key, json.dumps(result, ensure_ascii=False).encode(), dedupe_key)
+        return result
+
+    def _request_region(self, request: Request) -> RegionStr:
+        region = getattr(request, 'region', None)
+        return self.ocr_options.get('region', None) if region is None else region
+
     def _process_region(self, image: Image.Image, region: RegionStr) -> List[Region]:
         '''
         region: 1,1,200,200 or 1,1, 0.9, 0.9
         '''
-        boxs = []
-        for v in region.strip(';').split(';'):
-            box = list((map(float, v.split(','))))
-            for index, coord in enumerate(box):
-                if index % 2 == 0:
-                    box[index] = image.width * coord if coord < 1 else coord
-                else:
-                    box[index] = image.height * coord if coord < 1 else coord
-                    
-            box = tuple(map(int, box))
-            boxs.append(box)
-        return boxs
+        return parse_region(image.size, region)
 
     def _get_image_by_region(self, image: Image.Image, region: RegionStr=None) -> Image.Image:
-        if region:
-            # Stitching pictures
-            boxs = self._process_region(image, region)
-            imgs = [image.crop(box) for box in boxs]
-            width, height = list(zip(*[img.size for img in imgs]))
-            max_width = max(width)
-            img_new = Image.new('RGB', (max_width, sum(height)))
-            for index, img in enumerate(imgs):
-                box = (0, sum(height[:index]), img.width,
-                       sum(height[:index + 1]))
-                img_new.paste(img, box)
-            # img_new.show()
-            return img_new
-        else:
-            return image
+        # Stitching pictures
+        return crop_by_region(image, region)
 
-    def get_ocr_image(self, file_path: str, request, region: RegionStr=None) -> Any:
+    def get_ocr_image(self, file_path: ImageSource, request, region: RegionStr=None) -> Any:
         '''
         Converting the local-image to be detected becomes the data that Ocr api eventually sends
         '''
-        _image = Image.open(file_path)
-        _image = self._get_image_by_region(_image, region)
-        return self.image_convert_ocr(_image, request)
+        data = self.passthrough(file_path, region)
+        if data is not None:
+            return data
+        _image = self._open_image(file_path, region)
+        with self._timer('encode'):
+            return self.image_convert_ocr(_image, request)
+
+    def passthrough(self, source: ImageSource, region: RegionStr=None) -> Optional[str]:
+        '''
+        :return: the base64 data of the original file when it can be sent as it is, see passthrough_formats.
+        None when the image has to be decoded and encoded
+        '''
+        try:
+            with self._timer('encode'):
+                encoded = passthrough_image(source, region, self.encoder, self.passthrough_formats)
+        except OSError:
+            # the decoding reports the error
+            return None
+        if encoded is None:
+            return None
+        self._record_encoded(encoded)
+        return encoded.data
+
+    def _open_image(self, file_path: ImageSource, region: RegionStr=None) -> Image.Image:
+        with self._timer('decode'):
+            _image = open_image(file_path, region, self.encoder)
+            _image.load()
+        with self._timer('region'):
+            return self._get_image_by_region(_image, region)
+
+    async def aio_get_ocr_image(self, file_path: ImageSource, request=None, region: RegionStr=None,
+                                check: bool=True) -> Any:
+        '''
+        Same as get_ocr_image, but run in self.executor when there is one.
+        A process pool runs ruia_ocr.imaging.preprocess_image, a thread pool or no pool runs the hooks of the service.
+        '''
+        with self._timer('image'):
+            if self._executor is None:
+                return self._convert_image(file_path, request, region, check)
+            if self._executor.is_process:
+                try:
+                    encoded = await self._executor.run(preprocess_image, file_path, region, check,
+                                                       self.encoder, self.passthrough_formats)
+                except ImageTypeError as e:
+                    logger.error(str(e))
+                    if request is not None:
+                        request.retry_times = 0
+                    raise
+                self._record_encoded(encoded)
+                return encoded.data
+            return await self._executor.run(self._convert_image, file_path, request, region, check)
+
+    async def aio_get_ocr_tiles(self, file_path: ImageSource, request=None, region: RegionStr=None,
+                                check: bool=True) -> List[Tile]:
+        '''
+        The image stage when self.tiling is set: the image is split into tiles once it is over tiling.max_edge,
+        run in self.executor when there is one
+        :return: the encoded tiles, a single Tile without box when the image is not tiled
+        '''
+        try:
+            with self._timer('image'):
+                if self._executor is None:
+                    tiles = preprocess_tiles(file_path, region, check, self.encoder, self.tiling,
+                                             self.passthrough_formats)
+                else:
+                    tiles = await self._executor.run(preprocess_tiles, file_path, region, check,
+                                                     self.encoder, self.tiling, self.passthrough_formats)
+        except ImageTypeError as e:
+            logger.error(str(e))
+            if request is not None:
+                request.retry_times = 0
+            raise
+        for tile in tiles:
+            self._record_encoded(tile.encoded)
+        return tiles
+
+    async def aio_ocr_tiles(self, tiles: List[Tile], service_type: BaseServiceTypes=None,
+                            session: aiohttp.ClientSession=None, reserved: int=0) -> dict:
+        '''
+        Recognize the tiles of one image concurrently and merge their results, see merge_tile_results
+        :param reserved: number of quota tokens the caller already acquired for this image
+        '''
+        semaphore = asyncio.Semaphore(self.tiling.concurrency if self.tiling else 4)
+
+        async def ocr(index: int, tile: Tile) -> dict:
+            async with semaphore:
+                if index >= reserved:
+                    await self.acquire_quota(service_type)
+                return json.loads(await self.aio_post_hedged(tile.encoded.data, service_type, session))
+
+        tasks = [asyncio.ensure_future(ocr(index, tile)) for index, tile in enumerate(tiles)]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        logger.debug(f'<Ocr {len(tiles)} tiles>')
+        return self.merge_tile_results(tiles, results)
+
+    async def aio_post_image(self, data: Union[str, RawImage], service_type: BaseServiceTypes=None,
+                             session: aiohttp.ClientSession=None, field: str='image') -> bytes:
+        '''
+        Post the encoded image to the ocr api, return the raw response body
+        :param field: the payload field of data, such as 'url' for a web image
+        '''
+        raise NotImplementedError
+
+    def is_ok_body(self, body: bytes) -> bool:
+        '''
+        :return: whether a raw response body is a successful result, a hedged call losing to it is cancelled
+        '''
+        try:
+            return self.is_cacheable(loads(body))
+        except ValueError:
+            return False
+
+    async def aio_post_hedged(self, data: Union[str, RawImage], service_type: BaseServiceTypes=None,
+                              session: aiohttp.ClientSession=None, field: str='image') -> bytes:
+        '''
+        aio_post_image, with a duplicate call when self.hedging is set and the first one is slow.
+        The quota of the first call is acquired by the caller, the one of the duplicate here
+        '''
+        if self.hedging is None:
+            return await self.aio_post_image(data, service_type, session, field)
+
+        async def duplicate():
+            await self.acquire_quota(service_type)
+            return await self.aio_post_image(data, service_type, session, field)
+
+        return await hedged(self.hedging, lambda: self.aio_post_image(data, service_type, session, field),
+                            duplicate, self.is_ok_body)
+
+    def merge_tile_results(self, tiles: List[Tile], results: List[dict]) -> dict:
+        '''
+        Hook function: merge the results of the tiles of one image into the result of the whole image
+        '''
+        raise NotImplementedError
+
+    def _convert_image(self, file_path: ImageSource, request=None, region: RegionStr=None,
+                       check: bool=True) -> Any:
+        if check:
+            return self.get_ocr_image(file_path, request, region)
+        data = self.passthrough(file_path, region)
+        if data is not None:
+            return data
+        _image = self._open_image(file_path, region)
+        with self._timer('encode'):
+            return self.encode_ocr_image(_image, check=False)
+
+    def encode_ocr_image(self, image: Image.Image, check: bool=True) -> str:
+        '''
+        Encode the image following self.encoder, return the base64 data
+        '''
+        encoded = encode_image(image, self.encoder, check)
+        self._record_encoded(encoded)
+        return encoded.data
+
+    def _record_encoded(self, encoded: EncodedImage) -> None:
+        self._observe_size('payload', encoded.bytes)
+        if encoded.timings is not None and self.metrics is not None:
+            for stage, seconds in zip(('decode', 'region', 'encode'), encoded.timings):
+                self.metrics.observe(stage, seconds)
+        self.encode_stats['images'] += 1
+        self.encode_stats['bytes'] += encoded.bytes
+        if encoded.passthrough:
+            self.encode_stats['passthrough'] += 1
+            self._count('passthrough')
+        if encoded.saved_bytes is not None:
+            self.encode_stats['saved_bytes'] += encoded.saved_bytes
+            logger.debug(f'<Encode {encoded.format} {encoded.size}: {encoded.bytes} bytes, '
+                         f'saved {encoded.saved_bytes} bytes>')
 
     async def request_process(self, request: Request, spider_ins=None):
         '''
@@ -232,9 +1034,16 @@ class BaseOcrService(object):
         '''
         return json
 
+    def process_result(self, body: bytes) -> OcrResult:
+        '''
+        Hook function: build the OcrResult of await response.json(result=True)
+        '''
+        return OcrResult(body)
+
     def image_convert_ocr(self, image: Image.Image, request) -> Any:
         '''
-        Hook function: Converting the local-image to be detected becomes the data that Ocr api eventually sends
+        Hook function: Converting the local-image to be detected becomes the data that Ocr api eventually sends.
+        Not called for the files sent as they are, see passthrough_formats
         '''
         raise NotImplementedError
 
@@ -256,28 +1065,70 @@ class BaiduOcrService(BaseOcrService):
 
     access_token_url = _access_token_url
 
+    PASSTHROUGH_FORMATS = ('JPEG', 'PNG', 'BMP')
+
+    # 18: Open api qps request limit reached
+    QUOTA_ERROR_CODES = (18, )
+
+    # 17: Open api daily request limit reached, 19: Open api total request limit reached
+    EXHAUSTED_ERROR_CODES = (17, 19)
+
+    # 110: Access token invalid or no longer valid, 111: Access token expired
+    TOKEN_ERROR_CODES = (110, 111)
+
+    CONTENT_TYPE = {'Content-Type': 'application/x-www-form-urlencoded'}
+
     def __init__(self,
                  app_id,
                  api_key,
                  secret_key,
                  service_type: BaiDuServiceTypes=BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE,
-                 sep: BaiDuOcrResult=BaiDuOcrResult.JOIN):
+                 sep: BaiDuOcrResult=BaiDuOcrResult.JOIN,
+                 executor: OcrExecutor=None,
+                 cache: OcrCache=None,
+                 session_config: dict=None,
+                 rate_limiter: RateLimiter=None,
+                 token_store: TokenStore=None,
+                 encoder: EncoderPolicy=None,
+                 tiling: TilePolicy=None,
+                 batching: BatchPolicy=None,
+                 dedupe: DedupeIndex=None,
+                 metrics: OcrMetrics=None,
+                 hedging: HedgePolicy=None,
+                 prefilter: BlankFilter=None,
+                 fetcher: ImageFetcher=None):
         '''
         :param app_id: your app_id, See more at https://ai.baidu.com/docs#/OCR-API/top
         :param api_key: your api_key, See more at https://ai.baidu.com/docs#/OCR-API/top
         :param secret_key: your secret_key, See more at https://ai.baidu.com/docs#/OCR-API/top
         :param service_type: your request service type, There are a total of 41 service types,
         See more at https://ai.baidu.com/docs#/OCR-API/top
+        :param executor: OcrExecutor, run the image decode/crop/encode stage off the event loop
+        :param cache: OcrCache, reuse the results of images already recognized
+        :param session_config: override BaseOcrService.SESSION_CONFIG of the pooled sessions
+        :param rate_limiter: RateLimiter, keep the requests of this app under its qps quota
+        :param token_store: TokenStore, share the access token on disk between worker processes
+        :param encoder: EncoderPolicy, format, downscaling and size budget of the uploaded image, None means PNG
+        :param tiling: TilePolicy, split the images over the size limits into tiles instead of failing,
+        the results of the tiles are merged into one result
+        :param batching: BatchPolicy, pack the small images into one canvas recognized by one call,
+        used by aio_request and OcrSpider
+        :param dedupe: DedupeIndex, reuse the result of a duplicate image already recognized
+        :param metrics: OcrMetrics, latency histograms of every stage of the requests
+        :param hedging: HedgePolicy, send a duplicate of the calls slower than a percentile of the recent ones
+        :param prefilter: BlankFilter, skip the call of the blank images, they get an empty words_result
+        :param fetcher: ImageFetcher, download the https images in memory, the api only fetches http links
         '''
 
-        super().__init__()
+        super().__init__(executor, cache, session_config, rate_limiter, encoder, tiling, batching, dedupe,
+                         metrics, hedging, prefilter, fetcher)
         self.app_id = app_id
         self.api_key = api_key
         self.sep = sep
         self.secret_key = secret_key
         self._service_type = service_type
         self._service_url = None
-        self._service_payload = service_type.dft_payload
+        self._service_payload = MappingProxyType(service_type.dft_payload)
         self._ocr_options = {}
         if service_type.value not in self.service_types:
             raise ServicePayloadsError(
@@ -287,125 +1138,176 @@ class BaiduOcrService(BaseOcrService):
         try:
             # Adaptive interface changes. It's recommended to do this
             from aip import AipOcr
-            _ocr = AipOcr(app_id, api_key, secret_key)
-            _authobj = _ocr._auth()
-            _version = _ocr.getVersion()
-            self._access_token = _ocr._auth().get('access_token')
-            self._params = _ocr._getParams(_authobj)
-            self._params.update(aipSdk='python', aipVersion=_version)
+            _version = AipOcr(app_id, api_key, secret_key).getVersion()
+            self._params = {'aipSdk': 'python', 'aipVersion': _version}
         except:
             # Fixed api implementation, not recommended
-            self._access_token = None
-            self._params = {
-                'access_token': self._access_token,
-                'aipSdk': 'python'
-            }
-        finally:
-            self._access_token_semphone = None
-            headers = getAuthrHeaders('POST',
-                                      self.service_url,
-                                      _apiKey=self.api_key,
-                                      _secretKey=self.secret_key)
-            headers.update(
-                {'Content-Type': 'application/x-www-form-urlencoded'})
-            self._headers = headers
+            self._params = {'aipSdk': 'python'}
+        # The access token is fetched lazily by the first request and shared by the services with the same credentials
+        self._token_manager = AccessTokenManager.shared(api_key,
+                                                        secret_key,
+                                                        token_url=self.access_token_url,
+                                                        store=token_store)
+        # The authorization headers are re-signed before they expire, see headers
+        self._signer = BceSigner(api_key, secret_key)
+
+    @property
+    def headers(self) -> Mapping[str, str]:
+        '''
+        :return: Immutable request headers with a valid bce authorization
+        '''
+        return self.get_headers()
 
-    async def _get_access_token(self):
+    def get_headers(self, service_type: BaiDuServiceTypes=None) -> Mapping[str, str]:
+        return self._signer.sign('POST', self.get_service_url(service_type), headers=self.CONTENT_TYPE)
+
+    @property
+    def access_token(self) -> str:
+        '''
+        :return: The current access token, None if it has not been fetched or has expired
+        '''
+        return self._token_manager.token
+
+    async def _get_access_token(self, session: aiohttp.ClientSession=None):
         '''
         baidu-ocr service need access_token, this method try to get this parameter.
         :return: access_token
         '''
-        if self._access_token is None:
-            response = await Request(url=self.access_token_url,
-                                     params={
-                                         'grant_type': 'client_credentials',
-                                         'client_id': self.api_key,
-                                         'client_secret': self.secret_key
-                                     }).fetch()
-            json = await response.json()
-            self._access_token, self._expires_in = json.get(
-                'access_token'), json.get('expires_in')
-        return self._access_token
+        return await self._token_manager.get_token(session or (lambda: self.aio_session))
+
+    async def _get_params(self, session: aiohttp.ClientSession=None) -> dict:
+        return dict(self._params, access_token=await self._get_access_token(session))
+
+    def _get_params_sync(self) -> dict:
+        return dict(self._params, access_token=self._token_manager.get_token_sync(self.session))
+
+    def is_token_error(self, json: dict) -> bool:
+        return json.get('error_code') in self.TOKEN_ERROR_CODES
+
+    def invalidate_token(self) -> None:
+        self._token_manager.invalidate()
 
     def set_payload(self, payloads: dict) -> None:
         payload = self._service_type.dft_payload.copy()
         payload.update(payloads)
-        self._service_payload = payloads
+        self._service_payload = MappingProxyType(payload)
 
     def image_convert_ocr(self, _image: Image.Image, request) -> Any:
-        _max = max(_image.height, _image.width)
-        _min = min(_image.height, _image.width)
-        if _max > 4096:
-            request.retry_times = 0
-            logger.error(
-                'Baidu-ocr \'s longest edge of the picture can not exceed 4096 px'
-            )
-            raise ImageTypeError
-        if _min < 15:
-            request.retry_times = 0
-            logger.error(
-                'Baidu-ocr \'s shortest edge of the picture cannot be less than 15 px'
-            )
-            raise ImageTypeError
-        image_io = BytesIO()
-        _image.save(image_io, format='PNG')
-        return base64.b64encode(image_io.getvalue()).decode()
+        try:
+            return self.encode_ocr_image(_image)
+        except ImageTypeError as e:
+            if request is not None:
+                request.retry_times = 0
+            logger.error(str(e))
+            raise
 
     async def _localImage_or_webImage_parse(self, request: Request,
-                                            spider_ins=None):
+                                            spider_ins=None) -> dict:
         '''
-        process image-data(loacl-image or web-image) update baidu pay_loads
+        process image-data(loacl-image or web-image) of one request
         :param request: Request
+        :return: the image fields of baidu pay_loads, {'url': web-image} or {'image': base64 data}
         '''
-        _raw_url = request.uri
-        if _raw_url.startswith('https'):
+        # downloaded in memory by the fetcher, then recognized like a local image
+        _raw_url = await self.request_image(request)
+        if isinstance(_raw_url, str) and _raw_url.startswith('https'):
             logger.error('Baidu-ocr does not support remote https image link,'
-                         'check your start_urls')
+                         'check your start_urls or set an ImageFetcher')
             request.retry_times = 0
             raise ImageTypeError
-        elif _raw_url.startswith('http'):
-            # self._service_payload.update(url=_raw_url)
-            self._service_payload.pop('image', None)
-            self._service_payload.update(url=_raw_url)
+        elif isinstance(_raw_url, str) and _raw_url.startswith('http'):
+            return {'url': _raw_url}
         else:
-            if _raw_url[-3:].lower() not in ['jpg', 'png', 'bmp', 'peg']:
+            if isinstance(_raw_url, str) and _raw_url[-3:].lower() not in ['jpg', 'png', 'bmp', 'peg']:
                 logger.error('Baidu does not support this type of picture , '
                              'must be `jpg`, `png`, `bmp` or `jpeg`')
                 request.retry_times = 0
                 request._ok = False
                 raise ImageTypeError
+            elif self.tiling is not None:
+                tiles = await self.aio_get_ocr_tiles(_raw_url, request, region=self._request_region(request))
+                if len(tiles) > 1:
+                    # recognized tile by tile, see OcrRequest._make_request
+                    request.tiles = tiles
+                    return {}
+                return {'image': tiles[0].encoded.data}
             else:
-                image = self.get_ocr_image(
+                image = await self.aio_get_ocr_image(
                     _raw_url,
                     request,
-                    region=self.ocr_options.get('region', None))
-                self._service_payload.pop('url', None)
-                self._service_payload.update(image=image)
+                    region=self._request_region(request))
+                return {'image': image}
 
     async def request_process(self, request: 'OcrRequest', spider_ins=None):
-        # Baidu ocr's request header parameters
-        # headers = getAuthrHeaders('POST', self.service_url, _apiKey=self.api_key,
-        #                           _secretKey=self.secret_key)
-        # headers.update({'Content-Type': 'application/x-www-form-urlencoded'})
-        await self._localImage_or_webImage_parse(request, spider_ins)
-        pay_loads = self._service_payload.copy()
-        request.metadata = {'image': os.path.basename(request.url)}
-        request.uri = request.url
-        request.url = self.service_url
+        # Every request builds its own payload, region and headers, nothing shared is modified,
+        # so that concurrent requests on one service can't send each other's images
+        service_type = getattr(request, 'service_type', None)
+        request.tiles = None
+        if getattr(request, 'batched', False):
+            # recognized by the composite batcher, see OcrRequest._make_request
+            request.metadata = dict(request.metadata or {}, image=os.path.basename(request.uri))
+            request._middle_processed = True
+            return
+        image_fields = await self._localImage_or_webImage_parse(request, spider_ins)
+        request.metadata = dict(request.metadata or {}, image=os.path.basename(request.uri))
+        request.url = self.get_service_url(service_type)
         request.method = 'POST'
-        request.headers = self._headers
-        aiohttp_kwargs = request.aiohttp_kwargs
+        request.headers = self.get_headers(service_type)
+        aiohttp_kwargs = dict(request.aiohttp_kwargs)
         aiohttp_kwargs.pop('params', None)
         aiohttp_kwargs.pop('data', None)
-        aiohttp_kwargs.update(params=self._params)
-        aiohttp_kwargs.update(data=pay_loads)
+        aiohttp_kwargs.update(params=await self._get_params(request.current_request_session))
+        aiohttp_kwargs.update(data=self.aio_form_body(service_type, **image_fields))
         request.aiohttp_kwargs = aiohttp_kwargs
         request._middle_processed = True # 已处理标志位
 
+    def is_cacheable(self, json: dict) -> bool:
+        # errors such as qps limit come back with http status 200
+        return 'error_code' not in json
+
+    @property
+    def credential(self) -> str:
+        return self.app_id
+
+    def is_quota_error(self, json: dict) -> bool:
+        return json.get('error_code') in self.QUOTA_ERROR_CODES
+
+    def is_exhausted_error(self, json: dict) -> bool:
+        return json.get('error_code') in self.EXHAUSTED_ERROR_CODES
+
+    def empty_result(self) -> dict:
+        return {'log_id': 0, 'words_result_num': 0, 'words_result': []}
+
+    def merge_tile_results(self, tiles: List[Tile], results: List[dict]) -> dict:
+        return merge_words_results(tiles, results, self.tiling.dedupe_ratio if self.tiling else 0.5)
+
+    async def aio_post_image(self, data: Union[str, RawImage], service_type: BaiDuServiceTypes=None,
+                             session: aiohttp.ClientSession=None, field: str='image') -> bytes:
+        session = session or self.aio_session
+        params = await self._get_params(session)
+        with self._timer('http'):
+            async with session.post(self.get_service_url(service_type),
+                                    headers=self.get_headers(service_type),
+                                    params=params,
+                                    data=self.aio_form_body(service_type, **{field: data})) as r:
+                return await r.read()
+
+    def post_image(self, data: Union[str, RawImage], service_type: BaiDuServiceTypes=None) -> bytes:
+        params = self._get_params_sync()
+        with self._timer('http'):
+            return self.session.post(url=self.get_service_url(service_type),
+                                     headers=self.get_headers(service_type),
+                                     params=params,
+                                     data=self.form_body(service_type, image=data),
+                                     timeout=self.session_config['TIMEOUT']).content
+
     def process_text(self, text: str):
-        jsons = json.loads(text)
+        jsons = loads(text)
         return self.process_json(jsons)
 
+    def process_result(self, body: bytes) -> OcrResult:
+        return OcrResult(body, self.sep)
+
     def process_json(self, json: dict):
         words_result = json.get('words_result', None)
         res = []
@@ -416,52 +1318,88 @@ class BaiduOcrService(BaseOcrService):
                 return self.sep.join(res)
         return ''
 
-    async def aio_request(self, image_path: str, region: RegionStr=None, *, img: Image.Image=None):
-        if img is None:
+    async def aio_request(self, image_path: Union[str, ImageBytes], region: RegionStr=None, *,
+                          img: Image.Image=None):
+        self._count('requests')
+        if img is None and self.is_fetched(image_path):
+            image_path = await self.fetch_image(image_path)
+        if img is None and isinstance(image_path, str):
             if image_path[-3:].lower() not in ['jpg', 'png', 'bmp', 'peg']:
                 logger.error('Baidu does not support this type of picture , '
                             'must be `jpg`, `png`, `bmp` or `jpeg`')
                 raise ImageTypeError
-            image = Image.open(image_path)
+
+        source = image_path if img is None else img
+        # a batched image is recognized by the service type of the batching, its result is kept under it
+        batch_size = self.batch_size(source, region)
+        service_type = self.batching.service_type if batch_size is not None else None
+        cache_key, body = await self.cached_body(source, region, service_type)
+        if body is not None:
+            return json.loads(body)
+        if await self.is_blank(source, region):
+            return self.empty_result()
+        dedupe_key = await self.dedupe_key(source, region, service_type)
+        body = await self.deduped_body(dedupe_key, cache_key)
+        if body is not None:
+            return json.loads(body)
+
+        if batch_size is not None:
+            return await self._aio_request_batched(source, region, batch_size, cache_key, dedupe_key)
+
+        if self.tiling is not None:
+            tiles = await self.aio_get_ocr_tiles(source, region=region, check=False)
+            if len(tiles) > 1:
+                result = await self.aio_ocr_tiles(tiles)
+                body = json.dumps(result, ensure_ascii=False).encode()
+                return await self._aio_loads_and_cache(cache_key, body, dedupe_key=dedupe_key)
+            b64_data = tiles[0].encoded.data
         else:
-            image = img
-
-        if region:
-            image = self._get_image_by_region(image, region)
-
-        image_io = BytesIO()
-        image.save(image_io, format='PNG')
-        b64_data = base64.b64encode(image_io.getvalue()).decode()
-        payloads = self.service_payload.copy()
-        payloads.update({'image': b64_data})
-
-        async with aiohttp.request('POST',
-                             url=self.service_url,
-                             headers=self._headers,
-                             params=self._params,
-                             data=payloads) as r:
-            return await r.json()
+            b64_data = await self.aio_get_ocr_image(source, region=region, check=False)
+
+        await self.acquire_quota()
+        body = await self.aio_post_hedged(b64_data)
+        return await self._aio_loads_and_cache(cache_key, body, dedupe_key=dedupe_key)
         
-    def request(self, image_path: str=None, region: RegionStr=None, *, img: Image.Image=None):
-        if img is None:
+    def request(self, image_path: Union[str, ImageBytes]=None, region: RegionStr=None, *,
+                img: Image.Image=None):
+        self._count('requests')
+        if img is None and self.is_fetched(image_path):
+            with self._timer('fetch'):
+                image_path = self.fetcher.fetch_sync(image_path, self.session)
+        if img is None and isinstance(image_path, str):
             if image_path[-3:].lower() not in ['jpg', 'png', 'bmp', 'peg']:
                 logger.error('Baidu does not support this type of picture , '
                             'must be `jpg`, `png`, `bmp` or `jpeg`')
                 raise ImageTypeError
-            image = Image.open(image_path)
+
+        source = image_path if img is None else img
+        cache_key, body = self.cached_body_sync(source, region)
+        if body is not None:
+            return json.loads(body)
+        if self.is_blank_sync(source, region):
+            return self.empty_result()
+        dedupe_key = self.dedupe_key_sync(source, region)
+        body = self._dedupe_get(dedupe_key, cache_key)
+        if body is not None:
+            return json.loads(body)
+
+        if self.tiling is not None:
+            tiles = preprocess_tiles(source, region, False, self.encoder, self.tiling, self.passthrough_formats)
+            for tile in tiles:
+                self._record_encoded(tile.encoded)
+            if len(tiles) > 1:
+                results = []
+                for tile in tiles:
+                    self.acquire_quota_sync()
+                    results.append(json.loads(self.post_image(tile.encoded.data)))
+                result = self.merge_tile_results(tiles, results)
+                return self._loads_and_cache(cache_key, json.dumps(result, ensure_ascii=False).encode(),
+                                             dedupe_key=dedupe_key)
+            b64_data = tiles[0].encoded.data
         else:
-            image = img
-
-        if region:
-            image = self._get_image_by_region(image, region)
-        image_io = BytesIO()
-        image.save(image_io, format='PNG')
-        b64_data = base64.b64encode(image_io.getvalue()).decode()
-        payloads = self.service_payload.copy()
-        payloads.update({'image': b64_data})
-        json = requests.post(url=self.service_url,
-                             headers=self._headers,
-                             params=self._params,
-                             data=payloads).json()
-        return json
+            b64_data = self._convert_image(source, region=region, check=False)
+
+        self.acquire_quota_sync()
+        body = self.post_image(b64_data)
+        return self._loads_and_cache(cache_key, body, dedupe_key=dedupe_key)
 
@@ -0,0 +1,370 @@
+# Tiling of the images over the size limits of the ocr api: split -> ocr every tile -> merge.
+# The tiles overlap, the merge translates the lines to the image, drops the repeated ones and joins the cut ones
+from math import ceil
+from PIL import Image
+from typing import List, NamedTuple, Optional, Tuple
+
+from ruia_ocr.imaging import (MAX_EDGE, Region, RegionStr, ImageSource, RegionPlan, EncoderPolicy, EncodedImage,
+                              crop_by_region, encode_image, image_file, preprocess_image)
+
+__all__ = ['TilePolicy', 'Tile', 'plan_tiles', 'preprocess_tiles', 'merge_words_results']
+
+# lists of {'x': int, 'y': int} in the results of the location types
+_POINT_KEYS = ('vertexes_location', 'finegrained_vertexes_location', 'min_finegrained_vertexes_location')
+
+
+class TilePolicy(object):
+    '''
+    When and how an image is split into tiles, each tile is recognized separately and the results are merged.
+
+    Only the edges over max_edge are split, a tile spans the whole image along the other edge.
+    A line is kept from the tile whose core (the tile without the half of each overlap shared with a neighbour)
+    holds it, the pieces of a line crossing a vertical cut are joined again, see merge_words_results.
+
+    max_edge: tile the images whose longest edge, once the region is applied, exceeds max_edge px
+    tile_size: length of a tile along the split edges
+    overlap: px shared by neighbouring tiles, keep it above the height of a text line so every line is whole in a tile
+    concurrency: max number of tiles of one image in flight
+    dedupe_ratio: two pieces of a line in neighbouring tiles are joined when their boxes overlap vertically by more
+        than this share of the lower one
+    '''
+
+    def __init__(self,
+                 tile_size: int=2048,
+                 overlap: int=256,
+                 max_edge: int=MAX_EDGE,
+                 concurrency: int=4,
+                 dedupe_ratio: float=0.5):
+        if not 0 <= overlap < tile_size:
+            raise ValueError('overlap must be in [0, tile_size)')
+        if tile_size > MAX_EDGE:
+            raise ValueError('tile_size can not exceed %s px' % MAX_EDGE)
+        if concurrency < 1:
+            raise ValueError('concurrency must be greater than 0')
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.max_edge = max_edge
+        self.concurrency = concurrency
+        self.dedupe_ratio = dedupe_ratio
+
+    def __repr__(self):
+        return f'TilePolicy<tile_size={self.tile_size}, overlap={self.overlap}, max_edge={self.max_edge}>'
+
+    def needs_tiling(self, size: Tuple[int, int]) -> bool:
+        return max(size) > self.max_edge
+
+
+class Tile(NamedTuple):
+    '''
+    box: the box of the tile on the (region applied) image, None means the whole image was not tiled
+    encoded: the encoded tile, it may be downscaled by the EncoderPolicy
+    '''
+    box: Optional[Region]
+    encoded: EncodedImage
+
+    @property
+    def scale(self) -> Tuple[float, float]:
+        '''
+        :return: factors mapping the coordinates on the encoded tile back to the image
+        '''
+        if self.box is None:
+            return 1.0, 1.0
+        x1, y1, x2, y2 = self.box
+        return (x2 - x1) / float(self.encoded.size[0]), (y2 - y1) / float(self.encoded.size[1])
+
+
+def _spans(length: int, tile: int, overlap: int) -> List[Tuple[int, int]]:
+    if length <= tile:
+        return [(0, length)]
+    count = int(ceil((length - overlap) / float(tile - overlap)))
+    # spread the tiles evenly, so that every overlap is at least overlap px
+    step = (length - tile) / float(count - 1)
+    return [(int(round(i * step)), int(round(i * step)) + tile) for i in range(count)]
+
+
+def plan_tiles(size: Tuple[int, int], policy: TilePolicy) -> List[Region]:
+    '''
+    :return: the boxes of the tiles of an image of size, row by row.
+        An edge within max_edge is not split, every line of a tall image stays whole in a tile
+    '''
+    width, height = size
+    tile = policy.tile_size
+    return [(x1, y1, x2, y2)
+            for y1, y2 in _spans(height, tile if height > policy.max_edge else height, policy.overlap)
+            for x1, x2 in _spans(width, tile if width > policy.max_edge else width, policy.overlap)]
+
+
+def _encode_tiles(image: Image.Image, region: RegionStr, check: bool, policy: EncoderPolicy,
+                  tiling: TilePolicy) -> Optional[List[Tile]]:
+    # the size is known before decoding any pixel
+    size = RegionPlan.compile(region, image.size).size if region else image.size
+    if not tiling.needs_tiling(size):
+        return None
+    image = crop_by_region(image, region)
+    return [Tile(box, encode_image(image.crop(box), policy, check)) for box in plan_tiles(image.size, tiling)]
+
+
+def preprocess_tiles(source: ImageSource, region: RegionStr=None, check: bool=True,
+                     policy: EncoderPolicy=None, tiling: TilePolicy=None,
+                     passthrough: Tuple[str, ...]=()) -> List[Tile]:
+    '''
+    Same as preprocess_image, but split the image into tiles when tiling says so
+    :return: the encoded tiles, a single Tile without box when the image is not tiled
+    '''
+    if tiling is not None:
+        if isinstance(source, Image.Image):
+            tiles = _encode_tiles(source, region, check, policy, tiling)
+        else:
+            with Image.open(image_file(source)) as image:
+                tiles = _encode_tiles(image, region, check, policy, tiling)
+        if tiles is not None:
+            return tiles
+    return [Tile(None, preprocess_image(source, region, check, policy, passthrough))]
+
+
+def _translate(obj: dict, x0: int, y0: int, sx: float, sy: float) -> dict:
+    location = obj.get('location')
+    if isinstance(location, dict):
+        obj['location'] = dict(location,
+                               left=int(round(location.get('left', 0) * sx + x0)),
+                               top=int(round(location.get('top', 0) * sy + y0)),
+                               width=int(round(location.get('width', 0) * sx)),
+                               height=int(round(location.get('height', 0) * sy)))
+    for key in _POINT_KEYS:
+        points = obj.get(key)
+        if isinstance(points, list):
+            obj[key] = [dict(p, x=int(round(p.get('x', 0) * sx + x0)), y=int(round(p.get('y', 0) * sy + y0)))
+                        for p in points]
+    chars = obj.get('chars')
+    if isinstance(chars, list):
+        obj['chars'] = [_translate(dict(c), x0, y0, sx, sy) for c in chars]
+    return obj
+
+
+def _core(spans: List[Tuple[int, int]], span: Tuple[int, int]) -> Tuple[float, float]:
+    # the middle of each overlap splits it between the two tiles
+    index = spans.index(span)
+    low = (spans[index - 1][1] + span[0]) / 2.0 if index else float('-inf')
+    high = (span[1] + spans[index + 1][0]) / 2.0 if index + 1 < len(spans) else float('inf')
+    return low, high
+
+
+def _center(location: dict, axis: str, size: str) -> float:
+    return location[axis] + location[size] / 2.0
+
+
+def _chars(words: dict) -> Optional[List[dict]]:
+    chars = words.get('chars')
+    if isinstance(chars, list) and chars and all(isinstance(c.get('location'), dict) for c in chars):
+        return chars
+    return None
+
+
+def _char_spans(text: str, chars: List[dict]) -> Optional[List[Tuple[int, int]]]:
+    # (start, end) of every char in the text of the line, the spaces of the text have no char
+    spans, position = [], 0
+    for c in chars:
+        char = c.get('char') or ''
+        start = text.find(char, position) if char else -1
+        if start < 0:
+            return None
+        position = start + len(char)
+        spans.append((start, position))
+    return spans
+
+
+def _trim(words: dict, chars: List[dict], low: float, high: float) -> Optional[dict]:
+    '''
+    The part of the line whose chars are centred within [low, high), None if there is none.
+    The text keeps the spaces up to the next char, so the join of two parts keeps the space of the seam
+    '''
+    kept = [i for i, c in enumerate(chars) if low <= _center(c['location'], 'left', 'width') < high]
+    if not kept:
+        return None
+    first, last = kept[0], kept[-1]
+    text = words.get('words') or ''
+    spans = _char_spans(text, chars)
+    if spans is None:
+        text = ''.join(c.get('char') or '' for c in chars[first:last + 1])
+    else:
+        text = text[spans[first][0]:spans[last + 1][0] if last + 1 < len(spans) else len(text)]
+    chars = chars[first:last + 1]
+    location = words['location']
+    trimmed = _with_box(dict(words, words=text), min(c['location']['left'] for c in chars),
+                        max(c['location']['left'] + c['location']['width'] for c in chars),
+                        location['top'], location['top'] + location['height'])
+    trimmed['chars'] = chars
+    return trimmed
+
+
+def _with_box(words: dict, left: int, right: int, top: int, bottom: int) -> dict:
+    words['location'] = dict(words['location'], left=left, top=top, width=right - left, height=bottom - top)
+    vertexes = 'vertexes_location' in words
+    # the points of the original line don't fit the trimmed or joined box
+    for key in _POINT_KEYS:
+        words.pop(key, None)
+    if vertexes:
+        words['vertexes_location'] = [{'x': left, 'y': top}, {'x': right, 'y': top},
+                                      {'x': right, 'y': bottom}, {'x': left, 'y': bottom}]
+    return words
+
+
+def _text_overlap(a: str, b: str) -> int:
+    '''
+    :return: length of the longest end of a starting b, 0 when it is shorter than 2 chars (or than a or b)
+    '''
+    for k in range(min(len(a), len(b)), min(2, len(a), len(b)) - 1, -1):
+        if k and a.endswith(b[:k]):
+            return k
+    return 0
+
+
+def _join(a: dict, b: dict, skip: int=0) -> dict:
+    '''
+    a followed by b without its first skip characters
+    '''
+    la, lb = a['location'], b['location']
+    joined = _with_box(dict(a, words=(a.get('words') or '') + (b.get('words') or '')[skip:]),
+                       min(la['left'], lb['left']), max(la['left'] + la['width'], lb['left'] + lb['width']),
+                       min(la['top'], lb['top']), max(la['top'] + la['height'], lb['top'] + lb['height']))
+    if not skip and isinstance(a.get('chars'), list) and isinstance(b.get('chars'), list):
+        joined['chars'] = a['chars'] + b['chars']
+    else:
+        joined.pop('chars', None)
+    return joined
+
+
+def _vertical_overlap(a: dict, b: dict) -> float:
+    top = max(a['top'], b['top'])
+    bottom = min(a['top'] + a['height'], b['top'] + b['height'])
+    return (bottom - top) / float(min(a['height'], b['height']) or 1)
+
+
+def _merge_by_location(tiles: List[Tile], tiles_lines: List[List[dict]], ratio: float) -> List[dict]:
+    boxes = [tile.box or (0, 0, float('inf'), float('inf')) for tile in tiles]
+    columns = sorted({(box[0], box[2]) for box in boxes})
+    rows = sorted({(box[1], box[3]) for box in boxes})
+    # the lines crossing the core of their tile along x: (column, row, piece, trimmed by its chars)
+    pieces: List[Tuple[int, int, dict, bool]] = []
+    lines: List[dict] = []
+    for box, tile_lines in zip(boxes, tiles_lines):
+        column, row = columns.index((box[0], box[2])), rows.index((box[1], box[3]))
+        x_low, x_high = _core(columns, (box[0], box[2]))
+        y_low, y_high = _core(rows, (box[1], box[3]))
+        for words in tile_lines:
+            location = words['location']
+            # a line in the overlap of two rows of tiles is whole in both, the one holding its centre keeps it
+            if not y_low <= _center(location, 'top', 'height') < y_high:
+                continue
+            left, right = location['left'], location['left'] + location['width']
+            if x_low <= left and right <= x_high:
+                lines.append(words)
+            elif right <= x_low or left >= x_high:
+                # within the core of the neighbour, which has it whole
+                continue
+            elif _chars(words) is not None:
+                trimmed = _trim(words, _chars(words), x_low, x_high)
+                if trimmed is not None:
+                    pieces.append((column, row, trimmed, True))
+            else:
+                pieces.append((column, row, words, False))
+
+    # join the pieces left to right, a piece continues the piece of the previous column it overlaps the most.
+    # Pieces trimmed by their chars are joined as they are, the others only when the end of the left text
+    # is the start of the right one, else both are kept
+    open_pieces: List[Tuple[int, int, dict, bool]] = []
+    for column, row, piece, trimmed in sorted(pieces, key=lambda p: (p[0], p[2]['location']['left'])):
+        best, best_overlap, best_skip = None, 0.0, 0
+        for index, (other_column, other_row, other, other_trimmed) in enumerate(open_pieces):
+            if other_column != column - 1 or other_row != row:
+                continue
+            overlap = _vertical_overlap(piece['location'], other['location'])
+            if overlap <= ratio or overlap <= best_overlap:
+                continue
+            skip = 0
+            if not (trimmed and other_trimmed):
+                skip = _text_overlap(other.get('words') or '', piece.get('words') or '')
+                if not skip:
+                    continue
+            best, best_overlap, best_skip = index, overlap, skip
+        if best is not None:
+            _, _, other, other_trimmed = open_pieces.pop(best)
+            piece, trimmed = _join(other, piece, best_skip), trimmed and other_trimmed
+        open_pieces.append((column, row, piece, trimmed))
+    for _, _, piece, _ in open_pieces:
+        piece['words'] = (piece.get('words') or '').rstrip()
+        lines.append(piece)
+    return _reading_order(lines)
+
+
+def _reading_order(lines: List[dict]) -> List[dict]:
+    # top to bottom, a line whose center is above the bottom of the first line of a row joins the row
+    lines = sorted(lines, key=lambda w: w['location']['top'])
+    rows, row, bottom = [], [], 0
+    for words in lines:
+        location = words['location']
+        if row and location['top'] + location['height'] / 2.0 > bottom:
+            rows.append(row)
+            row = []
+        if not row:
+            bottom = location['top'] + location['height']
+        row.append(words)
+    if row:
+        rows.append(row)
+    return [words for row in rows for words in sorted(row, key=lambda w: w['location']['left'])]
+
+
+def _dedupe_by_text(tiles_lines: List[List[dict]]) -> List[dict]:
+    # without locations, drop the leading lines of a tile repeating the trailing lines of the previous one
+    merged: List[dict] = []
+    previous: List[str] = []
+    for lines in tiles_lines:
+        texts = [words.get('words') for words in lines]
+        skip = 0
+        for k in range(min(len(previous), len(texts)), 0, -1):
+            if previous[-k:] == texts[:k]:
+                skip = k
+                break
+        merged.extend(lines[skip:])
+        previous = texts
+    return merged
+
+
+def merge_words_results(tiles: List[Tile], results: List[dict], dedupe_ratio: float=0.5) -> dict:
+    '''
+    Merge the baidu results of the tiles of one image into the result of the whole image.
+    The locations are translated to the image and the lines repeated by the overlaps are removed, see TilePolicy.
+    A line crossing a vertical cut is seen in part by each tile: with the location of every char
+    (recognize_granularity=small) each part is trimmed to the chars centred in the core of its tile and the parts
+    are joined, else two parts are joined only when the end of the left text is exactly the start of the right
+    one, and both are kept when it is not.
+    Without locations (the basic service types) the lines are only matched by their text, which only removes
+    the lines repeated by a horizontal cut. The first error of a tile is returned as is.
+
+    :param tiles: the tiles returned by preprocess_tiles
+    :param results: the json result of every tile, in the order of tiles
+    '''
+    for result in results:
+        if 'error_code' in result:
+            return result
+    tiles_lines: List[List[dict]] = []
+    for tile, result in zip(tiles, results):
+        words_result = result.get('words_result')
+        if not isinstance(words_result, list):
+            words_result = []
+        if tile.box is not None:
+            x0, y0 = tile.box[:2]
+            sx, sy = tile.scale
+            words_result = [_translate(words, x0, y0, sx, sy) for words in words_result]
+        tiles_lines.append(words_result)
+
+    if all(isinstance(words.get('location'), dict) for lines in tiles_lines for words in lines):
+        lines = _merge_by_location(tiles, tiles_lines, dedupe_ratio)
+    else:
+        lines = _dedupe_by_text(tiles_lines)
+
+    merged = dict(results[0]) if results else {}
+    merged['words_result'] = lines
+    merged['words_result_num'] = len(lines)
+    merged['tiles_num'] = len(tiles)
+    return merged
@@ -1,26 +1,131 @@
 import os
+import queue
+import threading
 
-from typing import Callable, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List
 from ruia.utils import get_logger
 
-__all__ = ['get_file_paths']
+__all__ = ['get_file_paths', 'iter_file_paths', 'IMAGE_EXTENSIONS']
 
 logger = get_logger('Ocr')
 
+# The image types accepted by BaiduOcrService
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+_DONE = object()
+
 
 def get_file_paths(dir, filter_files: Callable[[str], bool] = None, num=None, *, key=None, base_name=False) -> List[str]:
-    res = []
-    for root, dirs, files in os.walk(dir):
-        if filter_files:
-            for file in files:
-                if filter_files(file):
-                    res.append(os.path.abspath(os.path.join(root, file)))
-        else:
-            for file in files:
-                res.append(os.path.abspath(os.path.join(root, file)))
-    return_value = res[:num] if num else res
+    return_value = list(iter_file_paths(dir, filter_files, num, extensions=None))
     if base_name:
         return_value = [os.path.basename(v) for v in return_value]
     if key:
         return_value.sort(key=key)
     return return_value
+
+
+def iter_file_paths(dir, filter_files: Callable[[str], bool] = None, num=None, *,
+                    extensions: Iterable[str] = IMAGE_EXTENSIONS, workers: int = 0,
+                    base_name=False) -> Iterator[str]:
+    '''
+    Yield the absolute paths of the files under dir while walking it, built on os.scandir
+
+    :param filter_files: called with the file name, keep the file if it returns True
+    :param num: stop walking once num files are found
+    :param extensions: keep only these extensions (case insensitive), None means every file.
+        The default matches the image types accepted by BaiduOcrService
+    :param workers: scan subdirectories with this many threads, the order of the paths is not stable then
+    '''
+    suffixes = tuple(e.lower() for e in extensions) if extensions else None
+
+    def accept(name: str) -> bool:
+        if suffixes and not name.lower().endswith(suffixes):
+            return False
+        return filter_files(name) if filter_files else True
+
+    root = os.path.abspath(dir)
+    paths = _iter_parallel(root, accept, workers) if workers > 0 else _iter_serial(root, accept)
+    try:
+        for count, path in enumerate(paths, 1):
+            yield os.path.basename(path) if base_name else path
+            if num and count >= num:
+                break
+    finally:
+        paths.close()
+
+
+def _scan(path: str, accept: Callable[[str], bool]):
+    files, dirs = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    # like os.walk, symlinks to directories are not followed
+                    if not entry.is_symlink():
+                        dirs.append(entry.path)
+                elif accept(entry.name):
+                    files.append(entry.path)
+    except OSError as e:
+        logger.error(f'<Scan {path}: {e}>')
+    return files, dirs
+
+
+def _iter_serial(path: str, accept: Callable[[str], bool]) -> Iterator[str]:
+    # top-down like os.walk: the files of a directory, then each subdirectory
+    files, dirs = _scan(path, accept)
+    yield from files
+    for sub in dirs:
+        yield from _iter_serial(sub, accept)
+
+
+def _iter_parallel(path: str, accept: Callable[[str], bool], workers: int) -> Iterator[str]:
+    results = queue.Queue(maxsize=4096)
+    stop = threading.Event()
+    lock = threading.Lock()
+    pending = [0]
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ruia_ocr_scan')
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def submit(sub):
+        with lock:
+            pending[0] += 1
+        pool.submit(scan, sub)
+
+    def scan(sub):
+        try:
+            if stop.is_set():
+                return
+            files, dirs = _scan(sub, accept)
+            for d in dirs:
+                submit(d)
+            for f in files:
+                put(f)
+        finally:
+            with lock:
+                pending[0] -= 1
+                done = pending[0] == 0
+            if done:
+                put(_DONE)
+
+    try:
+        submit(path)
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        pool.shutdown(wait=False)
@@ -12,6 +12,7 @@ setup(
     packages=find_packages(),
     install_requires=['baidu_aip>=2.2.17', 'ruia>=0.6.2','Pillow'],
     requires=['baidu_aip', 'ruia'],
+    extras_require={'dedupe': ['numpy'], 'fast': ['orjson']},
     classifiers=['Programming Language :: Python :: 3.6',
                  'Programming Language :: Python :: 3.7',
                  'Programming Language :: Python :: 3.8',
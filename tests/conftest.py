@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# the local stand-in of the Baidu ocr api lives with the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from stub_server import BaiduStubServer  # noqa: E402
+
+
+@pytest.fixture
+def stub_server():
+    '''
+    The stand-in server, served from a thread so that the sync and the async clients can use it
+    '''
+    server = BaiduStubServer(seed=0).start_in_thread()
+    yield server
+    server.stop_thread()
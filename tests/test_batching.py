@@ -0,0 +1,105 @@
+import json
+import base64
+import asyncio
+
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageChops
+
+from ruia_ocr.batching import BatchPolicy, CompositeBatcher, CompositePlan, demux_words_results, plan_composite
+from ruia_ocr.service import BaiduOcrService
+
+
+def overlaps(a, b):
+    (ax, ay), (aw, ah), (bx, by), (bw, bh) = a + b
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+
+def test_plan_composite():
+    policy = BatchPolicy(max_images=16, max_item_edge=512, gutter=32)
+    sizes = [(120 + 37 * i % 300, 40 + 53 * i % 200) for i in range(20)]
+    plan = plan_composite(sizes, policy)
+    assert len(plan.offsets) == 16 and plan.sizes == tuple(sizes[:16])
+    boxes = list(zip(plan.offsets, plan.sizes))
+    # the gutters keep the images apart and away from the edges of the canvas
+    assert not any(overlaps((a, (aw + 32, ah + 32)), (b, (bw, bh)))
+                   for i, (a, (aw, ah)) in enumerate(boxes) for b, (bw, bh) in boxes[i + 1:])
+    assert all(x >= 32 and y >= 32 and x + w + 32 <= plan.size[0] and y + h + 32 <= plan.size[1]
+               for (x, y), (w, h) in boxes)
+    assert max(plan.size) <= policy.max_edge
+
+
+def test_plan_composite_stops_at_the_edge_of_the_canvas():
+    policy = BatchPolicy(max_images=16, max_item_edge=512, max_edge=1200, gutter=32)
+    plan = plan_composite([(512, 512)] * 16, policy)
+    assert len(plan.offsets) == 4 and max(plan.size) <= 1200
+
+
+def line(words, left, top, width=60, height=20):
+    return {'words': words, 'location': {'left': left, 'top': top, 'width': width, 'height': height}}
+
+
+def test_demux_words_results():
+    plan = CompositePlan(((32, 32), (200, 32)), ((136, 100), (100, 100)), (332, 164))
+    result = {'log_id': 1, 'words_result': [line('first', 40, 50), line('second', 210, 100),
+                                            line('gutter', 160, 140, 20, 10), {'words': 'no location'}]}
+    first, second = demux_words_results(result, plan)
+    assert [w['words'] for w in first['words_result']] == ['first']
+    assert first['words_result'][0]['location'] == {'left': 8, 'top': 18, 'width': 60, 'height': 20}
+    assert [w['words'] for w in second['words_result']] == ['second']
+    assert (second['log_id'], second['words_result_num'], second['composite_num']) == (1, 1, 2)
+    # the encoder halved the canvas
+    first, _ = demux_words_results({'words_result': [line('first', 20, 25, 30, 10)]}, plan, (166, 82))
+    assert first['words_result'][0]['location'] == {'left': 8, 'top': 18, 'width': 60, 'height': 20}
+
+
+COLORS = [(200, 0, 0), (0, 200, 0), (0, 0, 200), (200, 200, 0), (0, 200, 200)]
+
+
+class ColorOcrService(BaiduOcrService):
+    '''
+    Recognizes the color of every solid image on a canvas as one line covering it
+    '''
+
+    def __init__(self, **kwargs):
+        super().__init__('app_id', 'api_key', 'secret_key', **kwargs)
+        self.calls = 0
+
+    async def acquire_quota(self, *args, **kwargs):
+        pass
+
+    async def aio_post_image(self, data, *args, **kwargs):
+        self.calls += 1
+        canvas = Image.open(BytesIO(base64.b64decode(data))).convert('RGB')
+        words_result = []
+        for color in COLORS:
+            r, g, b = (band.point(lambda v, c=c: 255 if v == c else 0)
+                       for band, c in zip(canvas.split(), color))
+            box = ImageChops.darker(ImageChops.darker(r, g), b).getbbox()
+            if box:
+                words_result.append(line(str(color), box[0], box[1], box[2] - box[0], box[3] - box[1]))
+        return json.dumps({'log_id': self.calls, 'words_result': words_result}).encode()
+
+
+def test_composite_batcher():
+    service = ColorOcrService(batching=BatchPolicy(max_images=5, max_item_edge=128, max_wait=0.01))
+
+    async def run():
+        batcher = CompositeBatcher(service, service.batching)
+        images = [Image.new('RGB', (40 + 10 * i, 30 + 5 * i), color) for i, color in enumerate(COLORS * 2)]
+        return await asyncio.gather(*(batcher.submit(image) for image in images)), batcher.stats
+
+    results, stats = asyncio.run(run())
+    assert service.calls == 2 and stats == {'batches': 2, 'images': 10, 'calls_saved': 8}
+    for i, result in enumerate(results):
+        assert [w['words'] for w in result['words_result']] == [str(COLORS[i % 5])]
+        assert result['words_result'][0]['location'] == {'left': 0, 'top': 0, 'width': 40 + 10 * i,
+                                                         'height': 30 + 5 * i}
+
+
+def test_batch_policy_limits():
+    with pytest.raises(ValueError):
+        BatchPolicy(max_images=0)
+    with pytest.raises(ValueError):
+        BatchPolicy(max_item_edge=4096, gutter=32)
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+from PIL import Image
+
+from ruia_ocr import BaiduOcrService, BaiDuServiceTypes, OcrCache
+from ruia_ocr.imaging import EncoderPolicy
+
+
+def test_make_key(tmp_path):
+    path = tmp_path / 'a.png'
+    Image.new('RGB', (20, 10), 'white').save(path)
+    data = path.read_bytes()
+    key = OcrCache.make_key(str(path))
+    assert OcrCache.make_key(data) == key
+    assert OcrCache.make_key(data, '0,0,10,10') != key
+    assert OcrCache.make_key(data, service_type=BaiDuServiceTypes.BAIDU_GENERA_TYPE) != key
+    assert OcrCache.make_key(data, payload={'language_type': 'ENG'}) != key
+    assert OcrCache.make_key(data, payload={'image': 'ignored', 'url': 'ignored'}) == key
+    assert OcrCache.make_key(data, encoder=EncoderPolicy()) != key
+    assert OcrCache.make_key(data, params={'url': 'https://example.com/ocr'}) != key
+
+
+def test_memory_lru():
+    cache = OcrCache(max_items=2, max_memory_bytes=10)
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    assert cache.get('a') == b'1234'
+    cache.set('c', b'1234')
+    # b is the least recently used
+    assert cache.get('b') is None
+    cache.set('d', b'12345678')
+    assert cache.stats['memory_bytes'] <= 10
+    cache.set('e', b'x' * 11)
+    assert cache.get('e') is None
+
+
+def test_disk_tier(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = OcrCache(path, max_items=1)
+    cache.set('a', b'first')
+    cache.set('b', b'second')
+    assert cache.get('a') == b'first'
+    assert cache.stats['disk_hits'] == 1
+    cache.close()
+    cache = OcrCache(path)
+    assert cache.get('b') == b'second'
+    assert cache.stats['disk_bytes'] == len(b'first') + len(b'second')
+
+
+def test_ttl(tmp_path):
+    cache = OcrCache(str(tmp_path / 'cache.db'), ttl=-1)
+    cache.set('a', b'value')
+    assert cache.get('a') is None
+    assert cache.stats['disk_bytes'] == 0
+
+
+def test_disk_budget(tmp_path):
+    cache = OcrCache(str(tmp_path / 'cache.db'), max_items=1, max_disk_bytes=1000)
+    for index in range(30):
+        cache.set('key%s' % index, b'x' * 100)
+    total = cache._db.execute('SELECT SUM(size) FROM ocr_cache').fetchone()[0]
+    assert cache.stats['disk_bytes'] == total <= 1000
+    assert cache.get('key29') is not None
+    assert cache.get('key0') is None
+    # a replaced entry is counted once
+    cache.set('key29', b'y' * 50)
+    assert cache.stats['disk_bytes'] == total - 50
+
+
+def test_remember_writes_off_the_event_loop(tmp_path):
+    threads = []
+
+    class Cache(OcrCache):
+        def set(self, key, value):
+            threads.append(threading.current_thread())
+            super().set(key, value)
+
+    async def main():
+        service = BaiduOcrService('app_id', 'api_key', 'secret_key', cache=Cache(str(tmp_path / 'cache.db')))
+        await service.remember('key', b'{"words_result": []}')
+        return service.cache.get('key')
+
+    assert asyncio.run(main()) == b'{"words_result": []}'
+    assert threads and threads[0] is not threading.main_thread()
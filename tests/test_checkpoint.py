@@ -0,0 +1,63 @@
+import os
+import threading
+
+from ruia_ocr.checkpoint import ProgressIndex, fingerprint
+
+
+def write(path, data=b'image'):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_resume(tmp_path):
+    done, failed, new = (write(tmp_path / name) for name in ('done.jpg', 'failed.jpg', 'new.jpg'))
+    progress = ProgressIndex(str(tmp_path / 'progress.db'))
+    progress.mark(done)
+    progress.mark(failed, 'status 500')
+    progress.close()
+
+    progress = ProgressIndex(str(tmp_path / 'progress.db'))
+    assert progress.counts() == {'done': 1, 'failed': 1}
+    assert progress.should_skip(done)
+    assert not progress.should_skip(failed)
+    assert not progress.should_skip(new)
+    assert ProgressIndex(str(tmp_path / 'progress.db'), retry_failed=False).should_skip(failed)
+
+
+def test_rescan(tmp_path):
+    touched, changed = write(tmp_path / 'touched.jpg'), write(tmp_path / 'changed.jpg')
+    progress = ProgressIndex(str(tmp_path / 'progress.db'), rescan=True)
+    progress.mark(touched)
+    progress.mark(changed)
+    progress.flush()
+    os.utime(touched, (1, 1))
+    write(tmp_path / 'changed.jpg', b'IMAGE')
+    assert progress.should_skip(touched)
+    assert not progress.should_skip(changed)
+    assert fingerprint(touched).mtime == 1
+
+
+def test_batches(tmp_path):
+    progress = ProgressIndex(str(tmp_path / 'progress.db'), batch_size=3, flush_interval=3600)
+    for i in range(5):
+        progress.mark(f'http://example.com/{i}.jpg', None if i % 2 else 'error')
+    # the first batch is written by the third outcome, the last two wait for the next flush
+    assert progress.stats == {'skipped': 0, 'done': 2, 'failed': 3, 'pending_writes': 2}
+    assert len(progress) == 3
+    progress.flush()
+    assert len(progress) == 5
+
+
+def test_marks_from_threads(tmp_path):
+    progress = ProgressIndex(str(tmp_path / 'progress.db'), batch_size=7, flush_interval=0.001)
+
+    def mark(start):
+        for i in range(start, start + 100):
+            progress.mark(f'http://example.com/{i}.jpg', None if i % 3 else 'error')
+
+    threads = [threading.Thread(target=mark, args=(i * 100, )) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert progress.counts() == {'done': 266, 'failed': 134}
@@ -0,0 +1,166 @@
+import io
+import random
+import asyncio
+import threading
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+pytest.importorskip('numpy')
+
+from ruia_ocr.dedupe import BKTree, DedupeIndex, DedupeKey, hamming
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        pytest.skip('Pillow can not scale its default font')
+
+
+def _save(image: Image.Image, format: str='PNG', **params) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format, **params)
+    return buffer.getvalue()
+
+
+def price(text: str) -> Image.Image:
+    image = Image.new('RGB', (320, 80), 'white')
+    ImageDraw.Draw(image).text((10, 10), text, fill='black', font=_font(48))
+    return image
+
+
+def captcha(text: str, seed: int) -> Image.Image:
+    rnd = random.Random(seed)
+    image = Image.new('RGB', (160, 60), (230, 230, 230))
+    draw = ImageDraw.Draw(image)
+    for index, char in enumerate(text):
+        draw.text((10 + 35 * index, 5 + rnd.randint(0, 10)), char, fill=(40, 40, 120), font=_font(40))
+    for _ in range(6):
+        draw.line([(rnd.randint(0, 160), rnd.randint(0, 60)), (rnd.randint(0, 160), rnd.randint(0, 60))],
+                  fill=(90, 90, 90))
+    return image
+
+
+def page(total: str) -> Image.Image:
+    image = Image.new('RGB', (1240, 1754), 'white')
+    draw = ImageDraw.Draw(image)
+    for line in range(40):
+        draw.text((80, 80 + 40 * line), f'Line {line} of the invoice, total {total}', fill='black', font=_font(24))
+    return image
+
+
+def key(index: DedupeIndex, source, region=None, scope='scope') -> DedupeKey:
+    value, shape, grid = index.fingerprint(source, region)
+    return DedupeKey(value, scope, shape, grid)
+
+
+def is_duplicate(first: bytes, second: bytes, **params) -> bool:
+    index = DedupeIndex(**params)
+    index.add(key(index, first), b'{"words_result": []}')
+    return index.get(key(index, second)) is not None
+
+
+@pytest.mark.parametrize('first, second', [('¥12.99', '¥18.49'), ('¥12.99', '¥12.98')])
+def test_prices_are_not_duplicates(first, second):
+    assert not is_duplicate(_save(price(first)), _save(price(second)))
+
+
+def test_captchas_are_not_duplicates():
+    assert not is_duplicate(_save(captcha('A7K2', 1)), _save(captcha('A7K3', 1)))
+    assert not is_duplicate(_save(captcha('A7K2', 1)), _save(captcha('B8Q2', 2)))
+
+
+def test_invoice_pages_are_not_duplicates():
+    assert not is_duplicate(_save(page('123.45')), _save(page('123.46')))
+
+
+@pytest.mark.parametrize('quality', [95, 75, 50])
+def test_reencoded_jpeg_is_a_duplicate(quality):
+    for image in (price('¥12.99'), captcha('A7K2', 1), page('123.45')):
+        assert is_duplicate(_save(image), _save(image, 'JPEG', quality=quality))
+        assert is_duplicate(_save(image, 'JPEG', quality=90), _save(image, 'JPEG', quality=quality))
+
+
+def test_lossless_copy_is_a_duplicate(tmp_path):
+    path = tmp_path / 'price.bmp'
+    price('¥12.99').save(path)
+    assert is_duplicate(_save(price('¥12.99')), str(path))
+    assert is_duplicate(_save(price('¥12.99')), price('¥12.99'))
+
+
+def test_resized_image_is_not_a_duplicate():
+    image = price('¥12.99')
+    assert not is_duplicate(_save(image), _save(image.resize((160, 40), Image.LANCZOS)))
+
+
+def test_zero_tolerance_needs_the_same_grid():
+    image = price('¥12.99')
+    assert is_duplicate(_save(image), _save(image, 'BMP'), tolerance=0)
+    assert not is_duplicate(_save(image), _save(image, 'JPEG', quality=30), tolerance=0)
+
+
+def test_scope_and_region():
+    image = _save(price('¥12.99'))
+    index = DedupeIndex()
+    index.add(key(index, image, '0,0,160,80'), b'left')
+    assert index.get(key(index, image, '0,0,160,80', scope='other')) is None
+    assert index.get(key(index, image, '160,0,320,80')) is None
+    assert index.get(key(index, _save(price('¥12.99'), 'JPEG'), '0,0,160,80')) == b'left'
+    assert index.stats == {'lookups': 3, 'calls_avoided': 1, 'hit_rate': 1 / 3, 'items': 1}
+
+
+def test_index_persists(tmp_path):
+    path = str(tmp_path / 'dedupe.db')
+    index = DedupeIndex(path)
+    index.add(key(index, _save(price('¥12.99'))), b'price')
+    index.close()
+    index = DedupeIndex(path)
+    assert len(index) == 1
+    assert index.get(key(index, _save(price('¥12.99'), 'JPEG', quality=80))) == b'price'
+    assert index.get(key(index, _save(price('¥18.49')))) is None
+    index.close()
+    # another grid is another index
+    assert len(DedupeIndex(path, cell=4)) == 0
+
+
+def test_bktree_search():
+    tree = BKTree()
+    values = [random.Random(seed).getrandbits(64) for seed in range(200)]
+    for value in values:
+        tree.add(value)
+    tree.add(values[0])
+    assert len(tree) == len(values)
+    query = values[7] ^ 0b1011
+    expected = sorted((hamming(query, value), value) for value in values if hamming(query, value) <= 12)
+    assert tree.search_all(query, 12) == expected
+    assert tree.search(query, 2) is None
+    assert tree.search(query, 3) == (3, values[7])
+
+
+def test_service_reuses_a_duplicate_off_the_event_loop(monkeypatch):
+    from ruia_ocr.cache import OcrCache
+    from ruia_ocr.service import BaiduOcrService
+
+    service = BaiduOcrService('app_id', 'api_key', 'secret_key', cache=OcrCache(), dedupe=DedupeIndex())
+    threads = []
+
+    def recording(method):
+        def wrapper(*args):
+            threads.append(threading.current_thread())
+            return method(*args)
+        return wrapper
+
+    monkeypatch.setattr(service.dedupe, 'fingerprint', recording(service.dedupe.fingerprint))
+    monkeypatch.setattr(service.dedupe, 'get', recording(service.dedupe.get))
+    first, second = _save(price('¥12.99')), _save(price('¥12.99'), 'JPEG', quality=80)
+
+    async def reuse():
+        service.dedupe.add(await service.dedupe_key(first), b'{"words_result": []}')
+        cache_key = service.cache_key(second)
+        return await service.deduped_body(await service.dedupe_key(second), cache_key), cache_key
+
+    body, cache_key = asyncio.run(reuse())
+    assert body == b'{"words_result": []}'
+    assert service.cache.get(cache_key) == body
+    assert len(threads) == 3 and threading.main_thread() not in threads
@@ -0,0 +1,65 @@
+import random
+import base64
+
+from io import BytesIO
+from urllib.parse import quote
+
+import pytest
+from PIL import Image, ImageDraw
+
+from ruia_ocr.exceptions import ImageTypeError
+from ruia_ocr.imaging import MIN_EDGE, EncoderPolicy, encode_base64, encode_image, payload_size
+
+
+def document(size=(800, 600)):
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for line in range(0, size[1] - 40, 40):
+        draw.text((20, 20 + line), 'Invoice No. 12345678, total 1234.56', fill='black')
+    return image
+
+
+def photo(size=(1200, 900), seed=0):
+    rnd = random.Random(seed)
+    return Image.frombytes('RGB', size, bytes(rnd.getrandbits(8) for _ in range(size[0] * size[1] * 3)))
+
+
+def test_payload_size():
+    data = base64.b64encode(bytes(range(256)) * 3)
+    assert payload_size(data) == len(quote(data.decode(), safe=''))
+
+
+def test_no_policy_is_a_plain_png():
+    image = document()
+    encoded = encode_image(image)
+    assert (encoded.format, encoded.size, encoded.data) == ('PNG', image.size, encode_base64(image))
+    assert encoded.bytes == payload_size(encoded.data.encode())
+
+
+def test_auto_keeps_a_small_png_and_sends_a_photo_as_jpeg():
+    assert encode_image(document(), EncoderPolicy()).format == 'PNG'
+    encoded = encode_image(photo(), EncoderPolicy(report_savings=True))
+    assert encoded.format == 'JPEG'
+    assert encoded.saved_bytes > 0
+    assert Image.open(BytesIO(base64.b64decode(encoded.data))).format == 'JPEG'
+
+
+def test_max_edge_and_target_dpi():
+    assert encode_image(document((3000, 1000)), EncoderPolicy(max_edge=1500)).size == (1500, 500)
+    image = document((1200, 900))
+    image.info['dpi'] = (600, 600)
+    assert encode_image(image, EncoderPolicy(target_dpi=300)).size == (600, 450)
+    # never below the shortest edge of the api
+    assert EncoderPolicy(max_edge=100).scale(Image.new('L', (4000, 40))) == MIN_EDGE / 40.0
+
+
+def test_payload_budget():
+    encoded = encode_image(photo(), EncoderPolicy(format='JPEG', max_payload_bytes=200 * 1024))
+    assert encoded.bytes <= 200 * 1024
+    with pytest.raises(ImageTypeError):
+        encode_image(photo((40, 40)), EncoderPolicy(format='PNG', max_payload_bytes=200))
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        EncoderPolicy(format='WEBP')
@@ -0,0 +1,59 @@
+import time
+import asyncio
+import threading
+
+import pytest
+from PIL import Image, ImageDraw
+
+from ruia_ocr.executor import OcrExecutor
+from ruia_ocr.service import BaiduOcrService
+
+
+def image():
+    image = Image.new('RGB', (400, 300), 'white')
+    ImageDraw.Draw(image).text((20, 20), 'Invoice No. 12345678', fill='black')
+    return image
+
+
+def convert(executor):
+    service = BaiduOcrService('app_id', 'api_key', 'secret_key', executor=executor)
+
+    async def run():
+        try:
+            return await service.aio_get_ocr_image(image(), region='0,0,200,100')
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('kind', OcrExecutor.KINDS)
+def test_executor_encodes_like_the_event_loop(kind):
+    assert convert(OcrExecutor(kind, max_workers=2)) == convert(None)
+
+
+def test_max_pending_caps_the_jobs_in_flight():
+    executor = OcrExecutor('thread', max_workers=8, max_pending=3)
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def job():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    async def run():
+        await asyncio.gather(*(executor.run(job) for _ in range(20)))
+
+    asyncio.run(run())
+    executor.shutdown()
+    assert peak[0] == 3
+
+
+def test_unknown_kind():
+    with pytest.raises(ValueError):
+        OcrExecutor('fiber')
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import aiohttp
+import pytest
+import requests
+from PIL import Image
+
+from bench_ocr import StubOcrService
+from ruia_ocr.cache import OcrCache
+from ruia_ocr.configs import BaiDuServiceTypes
+from ruia_ocr.exceptions import ImageFetchError
+from ruia_ocr.fetch import ImageFetcher
+
+
+def png(size=(200, 100)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'white').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+IMAGE = png()
+LARGE = png((2000, 2000)) + bytes(64 * 1024)
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    '''
+    /image.png with an ETag, /nolength.png streamed without a Content-Length, /missing and /busy fail
+    '''
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        if self.path == '/image.png':
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(IMAGE)))
+            self.end_headers()
+            self.wfile.write(IMAGE)
+        elif self.path == '/large.png':
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(LARGE)))
+            self.end_headers()
+            self.wfile.write(LARGE)
+        elif self.path == '/nolength.png':
+            self.send_response(200)
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(LARGE)
+            self.close_connection = True
+        else:
+            self.send_response(404 if self.path == '/missing' else 503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+
+@pytest.fixture
+def image_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHandler)
+    server.paths = []
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(fetcher, *urls):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            results = []
+            for url in urls:
+                try:
+                    results.append(await fetcher.fetch(url, session))
+                except Exception as e:
+                    results.append(e)
+            return results
+    return asyncio.run(run())
+
+
+def test_accepts():
+    fetcher = ImageFetcher()
+    assert fetcher.accepts('HTTPS://example.com/1.jpg') and not fetcher.accepts('http://example.com/1.jpg')
+    assert not fetcher.accepts('images/1.jpg') and not fetcher.accepts(b'https://')
+    assert ImageFetcher(schemes=('http', 'https')).accepts('http://example.com/1.jpg')
+
+
+def test_conditional_download(image_server):
+    fetcher = ImageFetcher(schemes=('http', ), cache=OcrCache())
+    url = image_server.url + '/image.png'
+    assert fetch(fetcher, url, url) == [IMAGE, IMAGE]
+    with requests.Session() as session:
+        assert fetcher.fetch_sync(url, session) == IMAGE
+    assert fetcher.stats == {'downloads': 1, 'not_modified': 2, 'bytes': len(IMAGE), 'too_large': 0, 'errors': 0}
+    # without a cache every download is a whole one
+    assert fetch(ImageFetcher(schemes=('http', )), url) == [IMAGE]
+
+
+def test_size_limit(image_server):
+    fetcher = ImageFetcher(schemes=('http', ), max_bytes=32 * 1024, chunk_size=4096)
+    large, streamed = fetch(fetcher, image_server.url + '/large.png', image_server.url + '/nolength.png')
+    assert isinstance(large, ImageFetchError) and isinstance(streamed, ImageFetchError)
+    with pytest.raises(ImageFetchError):
+        fetcher.fetch_sync(image_server.url + '/nolength.png')
+    assert fetcher.too_large == 3 and fetcher.downloads == 0
+
+
+def test_failures(image_server):
+    fetcher = ImageFetcher(schemes=('http', ))
+    missing, busy = fetch(fetcher, image_server.url + '/missing', image_server.url + '/busy')
+    # a retry can't find a missing image, a busy server may answer it
+    assert isinstance(missing, ImageFetchError)
+    assert isinstance(busy, aiohttp.ClientResponseError) and busy.status == 503
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch_sync(image_server.url + '/busy')
+    assert fetcher.errors == 3
+
+
+def test_service_recognizes_the_downloaded_image(stub_server, image_server):
+    ocr_service = StubOcrService(stub_server, 'app_id', 'api_key', 'secret_key',
+                                 BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE,
+                                 fetcher=ImageFetcher(schemes=('http', )))
+    url = image_server.url + '/image.png'
+    assert ocr_service.request(url)['words_result_num'] == 5
+    ocr_service.close()
+
+    async def run():
+        async with ocr_service:
+            return await ocr_service.aio_request(url)
+
+    assert asyncio.run(run())['words_result_num'] == 5
+    assert image_server.paths == ['/image.png', '/image.png'] and ocr_service.fetcher.downloads == 2
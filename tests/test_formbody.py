@@ -0,0 +1,89 @@
+import base64
+import asyncio
+
+from urllib.parse import urlencode
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from PIL import Image
+
+from bench_ocr import StubOcrService
+from ruia_ocr.configs import BaiDuServiceTypes
+from ruia_ocr.formbody import FORM_CONTENT_TYPE, FormBody, FormPayload
+from ruia_ocr.imaging import RawImage
+
+FIELDS = {'image': base64.b64encode(bytes(range(256)) * 40).decode(), 'language_type': 'CHN_ENG',
+          'probability': True, 'name': '书名 & ISBN=978', 'raw': b'a+b/c d', 'count': 3}
+
+
+def jpeg(tmp_path):
+    path = str(tmp_path / 'photo.jpg')
+    Image.effect_noise((300, 200), 64).convert('RGB').save(path, quality=90)
+    return path
+
+
+def test_same_body_as_urlencode():
+    expected = urlencode(FIELDS).encode()
+    for chunk_size in (7, 100, 64 * 1024):
+        body = FormBody(FIELDS, chunk_size=chunk_size)
+        assert bytes(body) == expected and body.size == len(expected)
+        # a character is at most 3 bytes of utf-8, each escaped into 3 characters
+        assert max(len(chunk) for chunk in body) <= 9 * chunk_size
+    # a retry iterates it again
+    body = FormBody(FIELDS, chunk_size=100)
+    assert b''.join(body) == b''.join(body)
+
+
+def test_raw_image_is_encoded_from_the_file(tmp_path):
+    path = jpeg(tmp_path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    expected = urlencode({'image': base64.b64encode(data).decode(), 'language_type': 'ENG'}).encode()
+    for source in (path, data):
+        body = FormBody({'image': RawImage(source, 'JPEG'), 'language_type': 'ENG'}, chunk_size=1000)
+        assert body.size == len(expected) and bytes(body) == expected
+    raw = RawImage(path, 'JPEG')
+    assert raw.b64_size == len(base64.b64encode(data))
+
+
+def test_form_payload_is_posted_with_its_length(tmp_path):
+    path = jpeg(tmp_path)
+    body = FormBody({'image': RawImage(path, 'JPEG'), 'language_type': 'ENG'}, chunk_size=1000)
+
+    async def echo(request):
+        form = await request.post()
+        return web.json_response({'length': request.content_length, 'type': request.content_type,
+                                  'image': form['image'], 'language_type': form['language_type']})
+
+    async def post():
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post('/', echo)
+        async with TestServer(app) as server, aiohttp.ClientSession() as session:
+            async with session.post(server.make_url('/'), data=FormPayload(body)) as resp:
+                return await resp.json()
+
+    echoed = asyncio.run(post())
+    with open(path, 'rb') as f:
+        image = base64.b64encode(f.read()).decode()
+    assert echoed == {'length': body.size, 'type': FORM_CONTENT_TYPE, 'image': image, 'language_type': 'ENG'}
+
+
+def test_service_streams_the_file(stub_server, tmp_path):
+    path = jpeg(tmp_path)
+    received = []
+    for stream in (True, False):
+        ocr_service = StubOcrService(stub_server, 'app_id', 'api_key', 'secret_key',
+                                     BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE)
+        ocr_service.STREAM_BODY = stream
+        assert ocr_service.request(path)['words_result_num'] == 5
+        ocr_service.close()
+
+        async def run():
+            async with ocr_service:
+                return await ocr_service.aio_request(path)
+
+        assert asyncio.run(run())['words_result_num'] == 5
+        received.append(stub_server.stats['bytes_received'])
+    # the same bodies, streamed or urlencoded from the payload dict
+    assert received[1] == 2 * received[0]
@@ -0,0 +1,115 @@
+import json
+import asyncio
+
+import pytest
+
+from ruia_ocr.hedging import HedgePolicy, hedged
+from ruia_ocr.pool import OcrServicePool
+from ruia_ocr.service import BaiduOcrService
+
+OK = {'log_id': 1, 'words_result_num': 0, 'words_result': []}
+
+
+def test_delay_follows_the_percentile():
+    policy = HedgePolicy(percentile=0.9, min_delay=0.01, max_delay=1.0, min_samples=10)
+    assert policy.delay() == 1.0
+    for ms in range(1, 11):
+        policy.record(ms / 100)
+    assert policy.delay() == 0.1
+    policy.record(5.0)
+    assert policy.delay() == 0.1
+    policy.latencies.extend([0.001] * 100)
+    policy.record(0.001)
+    assert policy.delay() == 0.01
+
+
+def test_budget():
+    policy = HedgePolicy(budget=0.5, burst=1)
+    assert policy.allow() and not policy.allow()
+    policy.start()
+    policy.start()
+    assert policy.allow()
+    assert policy.stats['hedges'] == 2 and policy.stats['denied'] == 1
+    with pytest.raises(ValueError):
+        HedgePolicy(percentile=1)
+
+
+def call(seconds, result, calls=None):
+    async def run():
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            if calls is not None:
+                calls.append('cancelled')
+            raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return run
+
+
+def test_slow_call_gets_a_duplicate():
+    policy = HedgePolicy(max_delay=0.02)
+    calls = []
+    assert asyncio.run(hedged(policy, call(1, 'first', calls), call(0, 'second'))) == 'second'
+    assert calls == ['cancelled']
+    assert (policy.hedges, policy.wins) == (1, 1)
+    # a fast call has no duplicate
+    assert asyncio.run(hedged(policy, call(0, 'first'), call(0, 'second'))) == 'first'
+    assert policy.stats['calls'] == 2 and policy.hedges == 1
+
+
+def test_duplicate_failing_waits_for_the_first_call():
+    policy = HedgePolicy(max_delay=0.01)
+    assert asyncio.run(hedged(policy, call(0.05, 'first'), call(0, ConnectionError()))) == 'first'
+    assert asyncio.run(hedged(policy, call(0.05, {'error_code': 18}), call(0, 'second'),
+                              lambda result: 'error_code' not in result)) == 'second'
+    with pytest.raises(TimeoutError):
+        asyncio.run(hedged(policy, call(0.05, TimeoutError()), call(0, ConnectionError())))
+    assert policy.wins == 1
+
+
+def test_no_budget_no_duplicate():
+    policy = HedgePolicy(max_delay=0.01, burst=0)
+    assert asyncio.run(hedged(policy, call(0.05, 'first'), call(0, 'second'))) == 'first'
+    assert (policy.hedges, policy.denied) == (0, 1)
+
+
+class SlowOcrService(BaiduOcrService):
+    '''
+    The calls take the seconds of delays in turn, the last one is repeated
+    '''
+
+    def __init__(self, app_id, *delays, **kwargs):
+        super().__init__(app_id, 'api_key', 'secret_key', **kwargs)
+        self.delays = list(delays)
+        self.calls = 0
+
+    async def acquire_quota(self, *args, **kwargs):
+        pass
+
+    async def aio_post_image(self, data, *args, **kwargs):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        await asyncio.sleep(delay)
+        return json.dumps(dict(OK, log_id=self.calls)).encode()
+
+    async def aio_request(self, image_path=None, region=None, *, img=None):
+        return json.loads(await self.aio_post_hedged('data'))
+
+
+def test_service_hedges_its_posts():
+    service = SlowOcrService('a', 1, 0, hedging=HedgePolicy(max_delay=0.02))
+    assert asyncio.run(service.aio_request('1.jpg'))['log_id'] == 2
+    assert service.calls == 2 and service.hedging.wins == 1
+
+
+def test_pool_sends_the_duplicate_through_another_member():
+    pool = OcrServicePool([SlowOcrService('a', 1), SlowOcrService('b', 0)], hedging=HedgePolicy(max_delay=0.02))
+    slow, fast = pool.members
+    pool._next = len(pool.members) - 1
+    assert asyncio.run(pool.aio_request('1.jpg')) == OK
+    assert (slow.service.calls, fast.service.calls) == (1, 1)
+    # the cancelled call is neither a success nor a failure
+    assert (slow.inflight, slow.calls, slow.errors) == (0, 0, 0)
+    assert (fast.inflight, fast.calls) == (0, 1)
@@ -0,0 +1,65 @@
+from io import BytesIO
+
+from PIL import Image
+
+from ruia_ocr.imaging import EncoderPolicy, RawImage, image_header, passthrough_image
+from ruia_ocr.service import BaiduOcrService
+
+
+def encode(format, size=(320, 200), mode='RGB', **params):
+    image_io = BytesIO()
+    Image.new(mode, size, 'white').save(image_io, format=format, **params)
+    return image_io.getvalue()
+
+
+def test_image_header():
+    assert image_header(encode('JPEG')) == ('JPEG', (320, 200))
+    assert image_header(encode('JPEG', progressive=True)) == ('JPEG', (320, 200))
+    assert image_header(encode('PNG', (33, 4097))) == ('PNG', (33, 4097))
+    assert image_header(encode('BMP', (21, 17))) == ('BMP', (21, 17))
+    # left to the decoder
+    assert image_header(encode('JPEG', mode='CMYK')) is None
+    assert image_header(encode('GIF')) is None
+    assert image_header(b'\xff\xd8') is None
+
+
+def test_passthrough_image(tmp_path):
+    data = encode('JPEG')
+    path = tmp_path / '1.jpg'
+    path.write_bytes(data)
+    encoded = passthrough_image(str(path))
+    assert encoded.passthrough and encoded.format == 'JPEG' and encoded.size == (320, 200)
+    assert isinstance(encoded.data, RawImage)
+    assert encoded.bytes == encoded.data.payload_size
+    assert passthrough_image(data).size == (320, 200)
+
+
+def test_passthrough_image_declines():
+    data = encode('PNG')
+    assert passthrough_image(data, region='0,0,100,100') is None
+    assert passthrough_image(data, formats=('JPEG', )) is None
+    assert passthrough_image(data, formats=()) is None
+    assert passthrough_image(encode('PNG', (10, 10))) is None
+    assert passthrough_image(encode('PNG', (5000, 100))) is None
+    assert passthrough_image(data, policy=EncoderPolicy(passthrough=False)) is None
+    assert passthrough_image(data, policy=EncoderPolicy(max_payload_bytes=100)) is None
+    assert passthrough_image(data, policy=EncoderPolicy(max_edge=160)) is None
+
+
+class GrayOcrService(BaiduOcrService):
+    def image_convert_ocr(self, image, request):
+        return self.encode_ocr_image(image.convert('L'))
+
+
+class GrayJpegOcrService(GrayOcrService):
+    PASSTHROUGH_FORMATS = ('JPEG', )
+
+
+def test_passthrough_formats():
+    assert BaiduOcrService('app_id', 'api_key', 'secret_key').passthrough_formats == ('JPEG', 'PNG', 'BMP')
+    # the hook of the subclass has to see every image
+    service = GrayOcrService('app_id', 'api_key', 'secret_key')
+    assert service.passthrough_formats == ()
+    assert isinstance(service.get_ocr_image(encode('PNG'), None), str)
+    assert service.encode_stats['passthrough'] == 0
+    assert GrayJpegOcrService('app_id', 'api_key', 'secret_key').passthrough_formats == ('JPEG', )
@@ -0,0 +1,72 @@
+import asyncio
+
+from PIL import Image
+
+from bench_ocr import StubOcrService
+from ruia_ocr.configs import BaiDuServiceTypes
+from ruia_ocr.metrics import Histogram, OcrMetrics
+
+
+def test_histogram_quantiles():
+    histogram = Histogram((1, 2, 4, 8))
+    for value in (0.5, 1.5, 1.5, 3, 3, 3, 3, 6, 6, 20):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 4, 2, 1]
+    assert (histogram.count, histogram.sum, histogram.max) == (10, 47.5, 20)
+    # the median falls in the middle of the third bucket
+    assert histogram.quantile(0.5) == 3.0
+    assert histogram.quantile(0.0) == 0.0
+    # the +Inf bucket is bounded by the largest value seen
+    assert histogram.quantile(1.0) == 20
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = OcrMetrics(enabled=False)
+    with metrics.timer('encode'):
+        pass
+    metrics.observe_size('payload', 1024)
+    metrics.count('requests')
+    assert metrics.snapshot() == {'stages': {}, 'sizes': {}, 'events': {}}
+    assert metrics.prometheus() == '\n'
+
+
+def test_prometheus_exposition():
+    metrics = OcrMetrics(buckets=(0.1, 1.0), size_buckets=(1024,))
+    metrics.observe('http', 0.05)
+    metrics.observe('http', 0.5)
+    metrics.observe('http', 2.0)
+    metrics.observe_size('payload', 2048)
+    metrics.count('retries', 2)
+    lines = metrics.prometheus(prefix='ocr').splitlines()
+    assert '# TYPE ocr_stage_seconds histogram' in lines
+    assert lines[2:7] == ['ocr_stage_seconds_bucket{stage="http",le="0.1"} 1',
+                          'ocr_stage_seconds_bucket{stage="http",le="1"} 2',
+                          'ocr_stage_seconds_bucket{stage="http",le="+Inf"} 3',
+                          'ocr_stage_seconds_sum{stage="http"} 2.55',
+                          'ocr_stage_seconds_count{stage="http"} 3']
+    assert 'ocr_transfer_bytes_bucket{kind="payload",le="+Inf"} 1' in lines
+    assert lines[-1] == 'ocr_events_total{event="retries"} 2'
+    metrics.reset()
+    assert metrics.snapshot() == {'stages': {}, 'sizes': {}, 'events': {}}
+
+
+def test_service_reports_every_stage(stub_server, tmp_path):
+    path = str(tmp_path / '1.jpg')
+    Image.new('RGB', (200, 100), 'white').save(path)
+    metrics = OcrMetrics()
+    ocr_service = StubOcrService(stub_server, 'app_id', 'api_key', 'secret_key',
+                                 BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE, metrics=metrics)
+
+    async def run():
+        async with ocr_service:
+            return await asyncio.gather(*(ocr_service.aio_request(path) for _ in range(3)))
+
+    assert all(result['words_result_num'] == 5 for result in asyncio.run(run()))
+    snapshot = metrics.snapshot()
+    for stage in ('image', 'http', 'parse', 'connect', 'upload', 'server'):
+        assert snapshot['stages'][stage]['count'] >= 1, stage
+    assert snapshot['stages']['http']['count'] == 3
+    assert snapshot['sizes']['payload']['count'] == 3 and snapshot['sizes']['response']['count'] == 3
+    assert snapshot['events']['requests'] == 3
+    assert 'http' in metrics.summary()
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from ruia_ocr.configs import BaiDuServiceTypes
+from ruia_ocr.qrs import OcrSpider
+from ruia_ocr.service import BaiduOcrService
+
+
+def service():
+    return BaiduOcrService('app_id', 'api_key', 'secret_key', BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE)
+
+
+def test_payload_template_is_read_only():
+    ocr_service = service()
+    with pytest.raises(TypeError):
+        ocr_service.service_payload['image'] = 'data'
+    ocr_service.set_payload({'language_type': 'ENG'})
+    assert ocr_service.service_payload['language_type'] == 'ENG'
+    assert ocr_service.service_payload['probability'] == 'true'
+    assert BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE.dft_payload['language_type'] == 'CHN_ENG'
+
+
+def test_every_request_builds_its_own_payload():
+    ocr_service = service()
+    first = ocr_service.build_payload(image='first')
+    second = ocr_service.build_payload(url='http://example.com/second.jpg')
+    assert first['image'] == 'first' and 'url' not in first
+    assert second['url'] == 'http://example.com/second.jpg' and 'image' not in second
+    assert 'image' not in ocr_service.service_payload and 'url' not in ocr_service.service_payload
+    accurate = ocr_service.build_payload(BaiDuServiceTypes.BAIDU_ACCURATEBASIC_TYPE, image='third')
+    assert accurate == dict(BaiDuServiceTypes.BAIDU_ACCURATEBASIC_TYPE.dft_payload, image='third')
+
+
+def test_spider_request_overrides_region_and_service_type():
+    class Spider(OcrSpider):
+        ocr_service = service()
+        ocr_region = '0,0,0.5,0.5'
+        start_urls = ['1.jpg']
+
+    async def requests():
+        spider = Spider()
+        try:
+            return spider.request('1.jpg'), spider.request('2.jpg', region='0,0,100,100',
+                                                           service_type=BaiDuServiceTypes.BAIDU_IDCARD_TYPE)
+        finally:
+            await spider.request_session.close()
+
+    default, card = asyncio.run(requests())
+    assert (default.region, default.service_type) == ('0,0,0.5,0.5', None)
+    assert default.url == Spider.ocr_service.service_url
+    assert (card.region, card.service_type) == ('0,0,100,100', BaiDuServiceTypes.BAIDU_IDCARD_TYPE)
+    assert card.url == BaiDuServiceTypes.BAIDU_IDCARD_TYPE.url
+    assert Spider.ocr_service.ocr_options == {}
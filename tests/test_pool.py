@@ -0,0 +1,113 @@
+import time
+import asyncio
+
+from collections import Counter
+
+import pytest
+
+from ruia_ocr.pool import OcrServicePool, PoolMember
+from ruia_ocr.service import BaiduOcrService
+
+OK = {'log_id': 1, 'words_result_num': 0, 'words_result': []}
+QPS = {'error_code': 18, 'error_msg': 'Open api qps request limit reached'}
+DAILY = {'error_code': 17, 'error_msg': 'Open api daily request limit reached'}
+
+
+class ScriptedOcrService(BaiduOcrService):
+    '''
+    Answers the results of its script in turn, an exception in the script is raised, the last one is repeated
+    '''
+
+    def __init__(self, app_id, *script):
+        super().__init__(app_id, 'api_key', 'secret_key')
+        self.script = list(script) or [OK]
+        self.calls = 0
+
+    def _answer(self):
+        result = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def aio_request(self, image_path=None, region=None, *, img=None):
+        await asyncio.sleep(0)
+        return self._answer()
+
+    def request(self, image_path=None, region=None, *, img=None):
+        return self._answer()
+
+
+def test_least_inflight_per_weight():
+    pool = OcrServicePool([ScriptedOcrService('a'), (ScriptedOcrService('b'), 2)])
+    services = [pool.checkout() for _ in range(6)]
+    assert Counter(service.credential for service in services) == {'a': 2, 'b': 4}
+    for service in services:
+        pool.checkin(service, True, OK)
+    assert [member.inflight for member in pool.members] == [0, 0]
+    assert [member.calls for member in pool.members] == [2, 4]
+
+
+def test_failing_member_is_ejected_and_its_time_out_doubles():
+    pool = OcrServicePool([ScriptedOcrService('a'), ScriptedOcrService('b')], max_errors=3,
+                          eject_seconds=10, max_eject_seconds=15)
+    bad = pool.members[0]
+    for strike, seconds in enumerate((10, 15)):
+        for _ in range(3):
+            pool.checkin(bad.service, False)
+        assert bad.ejections == strike + 1 and bad.strikes == strike + 1
+        assert seconds - 1 < bad.ejected_until - time.monotonic() <= seconds
+        assert {pool.checkout().credential for _ in range(4)} == {'b'}
+        bad.ejected_until = 0
+    assert bad.stats['healthy'] and bad.stats['errors'] == 6
+    # a success in between starts the doubling over
+    pool.checkin(bad.service, True, OK)
+    assert bad.strikes == 0
+
+
+def test_quota_errors_throttle_and_exhaustion_ejects():
+    pool = OcrServicePool([ScriptedOcrService('a'), ScriptedOcrService('b')], throttle=60)
+    first, second = pool.members
+    pool.checkin(first.service, True, QPS)
+    # not a failure, only avoided while another member can take the call
+    assert first.quota_errors == 1 and first.errors == 0 and first.stats['healthy']
+    assert {pool.checkout().credential for _ in range(4)} == {'b'}
+    pool.checkin(second.service, True, DAILY)
+    assert second.ejections == 1 and not second.stats['healthy']
+    assert {pool.checkout().credential for _ in range(4)} == {'a'}
+
+
+def test_every_member_ejected_uses_the_first_coming_back():
+    pool = OcrServicePool([ScriptedOcrService('a'), ScriptedOcrService('b')])
+    pool.members[0].ejected_until = 2e9
+    pool.members[1].ejected_until = 1e9
+    assert pool.checkout().credential == 'b'
+
+
+def test_member_limit():
+    pool = OcrServicePool([PoolMember(ScriptedOcrService('a'), limit=2), ScriptedOcrService('b')])
+    assert [pool.request('1.jpg') for _ in range(2)] == [OK, OK]
+    assert [member.calls for member in pool.members] == [1, 1]
+    pool.members[0].calls = 2
+    assert pool.members[0].exhausted
+    assert {pool.checkout().credential for _ in range(4)} == {'b'}
+
+
+def test_aio_request_checks_the_outcome_in():
+    pool = OcrServicePool([ScriptedOcrService('a', ConnectionError('reset'), OK)], max_errors=2)
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await pool.aio_request('1.jpg')
+        return await pool.aio_request('1.jpg')
+
+    assert asyncio.run(run()) == OK
+    member, = pool.members
+    assert (member.inflight, member.calls, member.errors, member.ejections) == (0, 2, 1, 0)
+
+
+def test_pool_needs_a_member():
+    with pytest.raises(ValueError):
+        OcrServicePool([])
+    with pytest.raises(ValueError):
+        PoolMember(ScriptedOcrService('a'), weight=0)
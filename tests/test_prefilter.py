@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from ruia_ocr import prefilter, service as service_module
+from ruia_ocr.prefilter import BlankFilter, blank_stats
+from ruia_ocr.service import BaiduOcrService
+
+
+def page(text=True, size=(600, 400)):
+    image = Image.new('RGB', size, 'white')
+    if text:
+        ImageDraw.Draw(image).text((40, 40), 'Invoice No. 12345678', fill='black')
+    image_io = BytesIO()
+    image.save(image_io, format='PNG')
+    return image_io.getvalue()
+
+
+def test_blank_filter():
+    blank_filter = BlankFilter()
+    assert blank_filter.check(page(text=False))
+    assert not blank_filter.check(page())
+    assert blank_filter.check(Image.new('RGBA', (300, 300), (0, 0, 0, 0)))
+    assert blank_filter.stats == {'checked': 3, 'skipped': 2, 'skip_rate': 2 / 3}
+
+
+def test_blank_stats_without_numpy(monkeypatch):
+    image = Image.linear_gradient('L').resize((300, 200))
+    ImageDraw.Draw(image).text((20, 20), 'total 1234.56', fill=255)
+    with_numpy = blank_stats(image)
+    monkeypatch.setattr(prefilter, 'np', None)
+    without_numpy = blank_stats(image)
+    assert all(abs(a - b) < 1e-9 for a, b in zip(with_numpy, without_numpy))
+
+
+def test_is_blank_runs_off_the_event_loop(monkeypatch):
+    threads = []
+
+    def recording_blank_stats(*args):
+        threads.append(threading.current_thread())
+        return blank_stats(*args)
+
+    monkeypatch.setattr(service_module, 'blank_stats', recording_blank_stats)
+    service = BaiduOcrService('app_id', 'api_key', 'secret_key', prefilter=BlankFilter())
+    assert service.executor is None
+
+    async def check():
+        return await service.is_blank(page(text=False)), await service.is_blank(page())
+
+    assert asyncio.run(check()) == (True, False)
+    assert threads and threading.main_thread() not in threads
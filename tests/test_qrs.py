@@ -0,0 +1,86 @@
+import asyncio
+
+from PIL import Image
+
+from ruia_ocr import BaiduOcrService, OcrCache, OcrSpider
+from ruia_ocr.qrs import StartQueue
+
+
+def cached_service(paths):
+    '''
+    A service answering every image from its cache, no call is made
+    '''
+    service = BaiduOcrService('app_id', 'api_key', 'secret_key', cache=OcrCache())
+    for path in paths:
+        service.cache.set(service.cache_key(path), b'{"words_result_num": 1, "words_result": [{"words": "%s"}]}'
+                          % path.encode())
+    return service
+
+
+def make_images(directory, number):
+    paths = []
+    for index in range(number):
+        path = str(directory / ('%s.png' % index))
+        Image.new('RGB', (20, 20), 'white').save(path)
+        paths.append(path)
+    return paths
+
+
+def test_start_queue():
+    async def main():
+        queue = StartQueue(2)
+        await queue.put(1)
+        await queue.put(2)
+        waiting = asyncio.ensure_future(queue.put(3))
+        await asyncio.sleep(0.01)
+        assert not waiting.done() and queue.qsize() == 2
+        # the callbacks are never refused
+        queue.put_nowait(4)
+        assert queue.qsize() == 3
+        assert await queue.get() == 1
+        assert await queue.get() == 2
+        await asyncio.sleep(0.01)
+        assert waiting.done()
+        assert [queue.get_nowait() for _ in range(queue.qsize())] == [4, 3]
+
+    asyncio.run(main())
+
+
+def test_spider_feeds_a_bounded_queue(tmp_path):
+    paths = make_images(tmp_path, 30)
+    seen, sizes = [], []
+
+    class Spider(OcrSpider):
+        ocr_service = cached_service(paths)
+        start_urls = paths
+        start_queue_size = 4
+        concurrency = 2
+
+        async def parse(self, response):
+            sizes.append(self.request_queue.qsize())
+            seen.append(response.uri)
+
+    asyncio.run(Spider.async_start())
+    assert sorted(seen) == sorted(paths)
+    assert max(sizes) <= 4
+
+
+def test_spider_uses_process_start_urls(tmp_path):
+    paths = make_images(tmp_path, 6)
+    seen = []
+
+    class Spider(OcrSpider):
+        ocr_service = cached_service(paths)
+        start_urls = paths
+
+        async def process_start_urls(self):
+            async for request in super(Spider, self).process_start_urls():
+                if not request.uri.endswith('3.png'):
+                    request.metadata['tag'] = 'custom'
+                    yield request
+
+        async def parse(self, response):
+            seen.append((response.uri, response.metadata.get('tag')))
+
+    asyncio.run(Spider.async_start())
+    assert sorted(seen) == sorted((path, 'custom') for path in paths if not path.endswith('3.png'))
@@ -0,0 +1,48 @@
+import time
+import asyncio
+
+import pytest
+
+from ruia_ocr.ratelimit import TokenBucket, RateLimiter
+
+
+def test_burst_then_qps():
+    bucket = TokenBucket(qps=10, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # the reservations queue up, each 1 / qps after the previous one
+    delays = [bucket.reserve() for _ in range(3)]
+    assert delays == pytest.approx([0.1, 0.2, 0.3], abs=0.01)
+    assert bucket.acquired == 6
+
+
+def test_acquire_spaces_the_calls():
+    bucket = TokenBucket(qps=50, burst=1)
+
+    async def run():
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) == pytest.approx(0.1, abs=0.04)
+
+
+def test_backoff_pauses_the_bucket():
+    bucket = TokenBucket(qps=10, burst=5)
+    bucket.backoff(0.5)
+    assert bucket.reserve() == pytest.approx(0.6, abs=0.01)
+
+
+def test_rate_limiter_buckets():
+    limiter = RateLimiter(qps=2, limits={'accurate': (10, 20), 'free': None})
+    assert limiter.bucket('general') is limiter.bucket('general')
+    assert limiter.bucket('general') is not limiter.bucket('general', 'other app')
+    assert (limiter.bucket('accurate').qps, limiter.bucket('accurate').burst) == (10, 20)
+    assert limiter.bucket('free') is None
+    assert RateLimiter().bucket('general') is None
+    limiter.acquire_sync('general')
+    assert limiter.stats['general:None'] == {'acquired': 1, 'waited': 0.0}
+
+
+def test_qps_must_be_positive():
+    with pytest.raises(ValueError):
+        TokenBucket(qps=0)
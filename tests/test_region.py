@@ -0,0 +1,49 @@
+from PIL import Image, ImageDraw
+
+from ruia_ocr.imaging import SOURCE_SIZE, EncoderPolicy, RegionPlan, crop_by_region, open_image, parse_region
+
+
+def quadrants(size=(2000, 1600)):
+    # a color per quadrant, a crop shows where it was taken from
+    image = Image.new('RGB', size, 'red')
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    draw.rectangle((width // 2, 0, width, height // 2), fill='green')
+    draw.rectangle((0, height // 2, width // 2, height), fill='blue')
+    draw.rectangle((width // 2, height // 2, width, height), fill='white')
+    return image
+
+
+def jpeg(path, image, dpi=None):
+    image.save(str(path), format='JPEG', quality=95, **({'dpi': dpi} if dpi else {}))
+    return str(path)
+
+
+def test_parse_region():
+    assert parse_region((2000, 1600), '0,0,0.5,0.5;1000,800,2000,1600') == [(0, 0, 1000, 800),
+                                                                             (1000, 800, 2000, 1600)]
+
+
+def test_plan_stitches_the_boxes_by_row():
+    plan = RegionPlan.compile('0,0,0.5,0.5;1000,800,1800,1000', (2000, 1600))
+    assert RegionPlan.compile('0,0,0.5,0.5;1000,800,1800,1000', (2000, 1600)) is plan
+    assert plan.offsets == (0, 800) and plan.size == (1000, 1000)
+    stitched = plan.apply(quadrants())
+    assert stitched.size == (1000, 1000)
+    assert stitched.getpixel((500, 400)) == (255, 0, 0)
+    assert stitched.getpixel((400, 900)) == (255, 255, 255)
+    # the canvas right of the narrower box stays black
+    assert stitched.getpixel((900, 900)) == (0, 0, 0)
+
+
+def test_draft_decoded_jpeg(tmp_path):
+    data = jpeg(tmp_path / 'quadrants.jpg', quadrants(), dpi=(600, 600))
+    image = open_image(data, '1000,800,2000,1600', EncoderPolicy(max_edge=250))
+    # the decoder reduced the image by 2, the region is still relative to the original
+    assert image.size == (1000, 800) and image.info[SOURCE_SIZE] == (2000, 1600)
+    assert image.info['dpi'] == (300, 300)
+    cropped = crop_by_region(image, '1000,800,2000,1600')
+    assert cropped.size == (500, 400)
+    assert all(abs(a - b) < 8 for a, b in zip(cropped.getpixel((250, 200)), (255, 255, 255)))
+    # no reduction without a policy downscaling by 2 or more
+    assert open_image(data, None, EncoderPolicy(max_edge=1500)).size == (2000, 1600)
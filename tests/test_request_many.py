@@ -0,0 +1,73 @@
+import random
+import asyncio
+
+import pytest
+
+from ruia_ocr.service import BaiduOcrService
+
+
+class FakeOcrService(BaiduOcrService):
+    '''
+    aio_request answers after a random delay, an image named bad fails
+    '''
+
+    def __init__(self):
+        super().__init__('app_id', 'api_key', 'secret_key')
+        self.running = 0
+        self.peak = 0
+        self.random = random.Random(0)
+
+    async def aio_request(self, image_path, region=None, *, img=None):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(self.random.random() / 100)
+            if image_path == 'bad':
+                raise ValueError(image_path)
+            return {'words_result': [{'words': image_path}], 'region': region}
+        finally:
+            self.running -= 1
+
+
+def collect(service, inputs, **params):
+    async def run():
+        return [result async for result in service.aio_request_many(inputs, **params)]
+    return asyncio.run(run())
+
+
+def test_concurrency_and_errors():
+    service = FakeOcrService()
+    paths = [f'{i}.jpg' for i in range(30)] + ['bad']
+    results = collect(service, paths, concurrency=4)
+    assert service.peak == 4
+    assert sorted(result.index for result in results) == list(range(31))
+    failed = [result for result in results if not result.ok]
+    assert len(failed) == 1 and failed[0].source == 'bad' and isinstance(failed[0].error, ValueError)
+
+
+def test_ordered():
+    results = collect(FakeOcrService(), ((f'{i}.jpg', '0,0,10,10') for i in range(20)), concurrency=5,
+                      ordered=True)
+    assert [result.index for result in results] == list(range(20))
+    assert all(result.result['region'] == '0,0,10,10' for result in results)
+
+
+def test_inputs_are_consumed_lazily():
+    consumed = []
+
+    def paths():
+        for i in range(100):
+            consumed.append(i)
+            yield f'{i}.jpg'
+
+    async def first():
+        async for result in FakeOcrService().aio_request_many(paths(), concurrency=3):
+            return result
+
+    asyncio.run(first())
+    assert len(consumed) == 3
+
+
+def test_concurrency_must_be_positive():
+    with pytest.raises(ValueError):
+        collect(FakeOcrService(), ['1.jpg'], concurrency=0)
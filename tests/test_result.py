@@ -0,0 +1,91 @@
+import json
+import asyncio
+
+from PIL import Image
+
+from bench_ocr import StubOcrService
+from ruia_ocr import result as result_module
+from ruia_ocr.configs import BaiDuServiceTypes
+from ruia_ocr.items import OcrField, OcrItem
+from ruia_ocr.qrs import OcrSpider
+from ruia_ocr.result import OcrLine, OcrResult
+
+BODY = json.dumps({
+    'log_id': 7,
+    'words_result_num': 3,
+    'words_result': [
+        {'words': '书名: 三体', 'location': {'left': 10, 'top': 20, 'width': 100, 'height': 18},
+         'probability': {'average': 0.98, 'min': 0.9, 'variance': 0.001}},
+        {'words': 'ISBN 978-7-5366-9293-0', 'location': {'left': 10, 'top': 50, 'width': 200, 'height': 18}},
+        {'words': '定价 23.00 元'},
+    ],
+}, ensure_ascii=False).encode()
+
+
+def test_result_is_decoded_on_first_access(monkeypatch):
+    calls = []
+    monkeypatch.setattr(result_module, 'loads', lambda body: calls.append(body) or json.loads(body))
+    result = OcrResult(BODY, sep='\n')
+    assert calls == []
+    assert len(result) == 3 and result.log_id == 7 and result.error_code is None
+    assert result.boxes == [(10, 20, 100, 18), (10, 50, 200, 18), None]
+    assert result.probabilities == [0.98, None, None]
+    assert result.text == '书名: 三体\nISBN 978-7-5366-9293-0\n定价 23.00 元'
+    assert result[0] == OcrLine('书名: 三体', (10, 20, 100, 18), 0.98)
+    assert len(calls) == 1
+
+
+def test_error_result():
+    result = OcrResult({'error_code': 17, 'error_msg': 'Open api daily request limit reached'})
+    assert (result.error_code, result.error_msg, result.lines, result.text) == \
+        (17, 'Open api daily request limit reached', [], '')
+    assert repr(result) == 'OcrResult<error_code=17>'
+
+
+class BookItem(OcrItem):
+    title = OcrField(r'书名[:：]\s*(\S+)')
+    isbn = OcrField(r'ISBN\s*([\d-]+)')
+    numbers = OcrField(r'(\d+)', many=True)
+    first_number = OcrField(r'(\d+)')
+    price = OcrField(r'定价\s*([\d.]+)')
+
+    async def clean_price(self, value):
+        return float(value)
+
+
+def test_item_matches_each_pattern_once():
+    text = OcrResult(BODY, sep='\n').text
+    values = BookItem.extract_fields(text)
+    assert values['title'] == '三体' and values['isbn'] == '978-7-5366-9293-0'
+    assert values['numbers'] == ['978', '7', '5366', '9293', '0', '23', '00']
+    assert values['first_number'] == '978'
+
+
+def test_get_item_from_a_result_and_from_text():
+    async def items():
+        result = OcrResult(BODY, sep='\n')
+        return await BookItem.get_item(result=result), await BookItem.get_item(html=result.text)
+
+    from_result, from_text = asyncio.run(items())
+    assert from_result.results == from_text.results
+    assert from_result.title == '三体' and from_result.price == 23.0
+
+
+def test_spider_response_result(stub_server, tmp_path):
+    path = str(tmp_path / '1.jpg')
+    Image.new('RGB', (200, 100), 'white').save(path)
+    results = []
+
+    class Spider(OcrSpider):
+        start_urls = [path]
+        ocr_service = StubOcrService(stub_server, 'app_id', 'api_key', 'secret_key',
+                                     BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE)
+        request_config = {'RETRIES': 0, 'DELAY': 0, 'TIMEOUT': 10}
+
+        async def parse(self, response):
+            results.append((await response.json(result=True), await response.json()))
+
+    asyncio.run(Spider.async_start())
+    (result, text), = results
+    assert isinstance(result, OcrResult) and len(result) == 5
+    assert result.text == text and all(box is not None for box in result.boxes)
@@ -0,0 +1,79 @@
+import types
+import functools
+import multiprocessing
+
+import pytest
+from PIL import Image
+
+from bench_ocr import StubOcrService
+from ruia_ocr.configs import BaiDuServiceTypes
+from ruia_ocr.exceptions import QuotaExhaustedError
+from ruia_ocr.qrs import OcrSpider
+from ruia_ocr.ratelimit import SharedRateLimiter, SharedTokenBucket
+from ruia_ocr.runner import OcrRunner, shard_of
+
+
+class LinesSpider(OcrSpider):
+    '''
+    Module level, the workers import it
+    '''
+    request_config = {'RETRIES': 0, 'DELAY': 0, 'TIMEOUT': 10}
+
+    async def parse(self, response):
+        return (await response.json(result=True)).words
+
+
+def stub_service(base_url, index):
+    server = types.SimpleNamespace(base_url=base_url, token_url=base_url + '/oauth/2.0/token')
+    return StubOcrService(server, 'app_id', 'api_key', 'secret_key', BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE)
+
+
+def drain(bucket, acquired):
+    try:
+        while True:
+            bucket.reserve()
+            acquired.value += 1
+    except QuotaExhaustedError:
+        pass
+
+
+def test_shard_of():
+    uris = [f'images/{i}.jpg' for i in range(1000)]
+    shards = [shard_of(uri, 4) for uri in uris]
+    assert set(shards) == {0, 1, 2, 3} and min(shards.count(i) for i in range(4)) > 200
+    assert shards == [shard_of(uri, 4) for uri in uris]
+
+
+def test_shared_budget_across_processes():
+    context = multiprocessing.get_context('spawn')
+    bucket = SharedTokenBucket(qps=1e9, burst=1000, budget=500, context=context)
+    counters = [context.RawValue('i', 0) for _ in range(3)]
+    processes = [context.Process(target=drain, args=(bucket, counter)) for counter in counters]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert sum(counter.value for counter in counters) == 500 and bucket.acquired == 500
+    with pytest.raises(QuotaExhaustedError):
+        bucket.reserve()
+
+
+def test_runner(stub_server, tmp_path):
+    paths = []
+    for i in range(8):
+        path = str(tmp_path / f'{i}.jpg')
+        Image.new('RGB', (200, 100), 'white').save(path)
+        paths.append(path)
+    runner = OcrRunner(LinesSpider, workers=2, service_factory=functools.partial(stub_service, stub_server.base_url),
+                       rate_limiter=SharedRateLimiter(qps=1000, budget=6))
+    results = list(runner.run(paths))
+    assert sorted(result.uri for result in results) == sorted(paths)
+    for result in results:
+        assert result.worker == shard_of(result.uri, 2)
+    ok = [result for result in results if result.ok]
+    # beyond the shared budget the requests fail without a call
+    assert len(ok) == 6 and stub_server.stats['ocr_calls'] == 6
+    assert all(len(result.value) == 5 for result in ok)
+    stats = runner.stats
+    assert sum(stats['dispatched']) == 8 and stats['dropped'] == 0 and stats['errors'] == []
+    assert sum(worker['requests'] for worker in stats['per_worker']) == 8
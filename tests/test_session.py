@@ -0,0 +1,56 @@
+import asyncio
+
+from ruia_ocr.service import BaiduOcrService
+
+
+def service(**session_config):
+    return BaiduOcrService('app_id', 'api_key', 'secret_key', session_config=session_config or None)
+
+
+def test_aio_session_is_reused_within_a_loop():
+    ocr_service = service(LIMIT=7)
+
+    async def sessions():
+        first = ocr_service.aio_session
+        assert ocr_service.aio_session is first
+        assert first.connector.limit == 7
+        await ocr_service.aclose()
+        assert first.closed
+        return first
+
+    asyncio.run(sessions())
+
+
+def test_aclose_closes_the_session_of_the_running_loop():
+    ocr_service = service()
+
+    async def run():
+        async with ocr_service:
+            session = ocr_service.aio_session
+        return session
+
+    assert asyncio.run(run()).closed
+
+
+def test_close_from_the_running_loop():
+    ocr_service = service()
+
+    async def run():
+        session = ocr_service.aio_session
+        ocr_service.close()
+        # scheduled on the loop, aclose waits for it
+        await ocr_service.aclose()
+        return session
+
+    assert asyncio.run(run()).closed
+
+
+def test_requests_session():
+    ocr_service = service(LIMIT=3)
+    session = ocr_service.session
+    assert ocr_service.session is session
+    adapter = session.get_adapter('https://aip.baidubce.com')
+    assert adapter._pool_connections == 3 and adapter._pool_maxsize == 3
+    with ocr_service:
+        pass
+    assert ocr_service._session is None
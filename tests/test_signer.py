@@ -0,0 +1,54 @@
+import datetime
+
+import pytest
+
+from ruia_ocr import service as service_module
+from ruia_ocr.auth import BceSigner
+from ruia_ocr.service import getAuthrHeaders
+
+NOW = datetime.datetime(2026, 10, 18, 8, 30, 15)
+URL = 'https://aip.baidubce.com/rest/2.0/ocr/v1/general_basic'
+
+
+class FrozenDatetime(datetime.datetime):
+    @classmethod
+    def utcnow(cls):
+        return NOW
+
+
+@pytest.fixture
+def frozen(monkeypatch):
+    monkeypatch.setattr(service_module.datetime, 'datetime', FrozenDatetime)
+    return NOW.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+@pytest.mark.parametrize('url, params', [(URL, None),
+                                         (URL + '?aipSdk=python', None),
+                                         (URL, {'access_token': 'token', 'aipSdk': 'python'})])
+def test_same_headers_as_getAuthrHeaders(frozen, url, params):
+    expected = getAuthrHeaders('POST', url, dict(params or {}), _apiKey='api_key', _secretKey='secret_key')
+    signed = BceSigner('api_key', 'secret_key').sign('POST', url, params, now=frozen)
+    assert dict(signed) == expected
+
+
+def test_signature_is_reused_until_refresh_before(frozen):
+    signer = BceSigner('api_key', 'secret_key', expire=1800, refresh_before=300)
+    first = signer.sign('POST', URL, now=frozen)
+    assert signer.sign('POST', URL, now=frozen + 1499) is first
+    assert signer.signatures == 1
+    second = signer.sign('POST', URL, now=frozen + 1500)
+    assert second['x-bce-date'] != first['x-bce-date'] and signer.signatures == 2
+
+
+def test_extra_headers_are_not_signed(frozen):
+    signer = BceSigner('api_key', 'secret_key')
+    signed = signer.sign('POST', URL, headers={'Content-Type': 'application/x-www-form-urlencoded'}, now=frozen)
+    assert signed['Content-Type'] == 'application/x-www-form-urlencoded'
+    assert signed['authorization'] == signer.sign('POST', URL, now=frozen)['authorization']
+    with pytest.raises(TypeError):
+        signed['Host'] = 'example.com'
+
+
+def test_refresh_before_must_be_less_than_expire():
+    with pytest.raises(ValueError):
+        BceSigner('api_key', 'secret_key', expire=300, refresh_before=300)
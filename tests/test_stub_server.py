@@ -0,0 +1,85 @@
+import random
+import asyncio
+
+import pytest
+from PIL import Image
+
+from bench_ocr import StubOcrService, compare
+from stub_server import BaiduStubServer, parse_latency
+from ruia_ocr.configs import BaiDuServiceTypes
+from ruia_ocr.qrs import OcrSpider
+
+
+def service(server):
+    return StubOcrService(server, 'app_id', 'api_key', 'secret_key', BaiDuServiceTypes.BAIDU_GENERALBASIC_TYPE)
+
+
+def image(tmp_path, name='1.jpg'):
+    path = tmp_path / name
+    Image.new('RGB', (200, 100), 'white').save(str(path))
+    return str(path)
+
+
+def test_parse_latency():
+    rng = random.Random(0)
+    assert parse_latency('const:0.5')(rng) == 0.5
+    assert 0.1 <= parse_latency('uniform:0.1,0.2')(rng) <= 0.2
+    assert parse_latency('normal:0,0')(rng) == 0.0
+    with pytest.raises(ValueError):
+        parse_latency('pareto:1')
+
+
+def test_request_and_aio_request(stub_server, tmp_path):
+    ocr_service = service(stub_server)
+    path = image(tmp_path)
+    result = ocr_service.request(path)
+    assert result['words_result_num'] == 5
+    ocr_service.close()
+
+    async def run():
+        async with service(stub_server) as aio_service:
+            return await asyncio.gather(*(aio_service.aio_request(path) for _ in range(4)))
+
+    assert all(result['words_result_num'] == 5 for result in asyncio.run(run()))
+    assert stub_server.stats['ocr_calls'] == 5
+
+
+def test_spider(stub_server, tmp_path):
+    parsed = []
+
+    class Spider(OcrSpider):
+        start_urls = [image(tmp_path, f'{i}.jpg') for i in range(6)]
+        ocr_service = service(stub_server)
+        request_config = {'RETRIES': 0, 'DELAY': 0, 'TIMEOUT': 10}
+
+        async def parse(self, response):
+            parsed.append((await response.json()).count('ruia_ocr stub line'))
+
+    asyncio.run(Spider.async_start())
+    assert parsed == [5] * 6
+
+
+def test_qps_limit_and_failures(tmp_path):
+    server = BaiduStubServer(qps=2, failure_rate=0.5, seed=1).start_in_thread()
+    try:
+        ocr_service = service(server)
+        path = image(tmp_path)
+        results = []
+        for _ in range(10):
+            try:
+                results.append(ocr_service.request(path))
+            except Exception as e:
+                results.append(e)
+        ocr_service.close()
+    finally:
+        server.stop_thread()
+    assert server.stats['ocr_calls'] == 10 and server.stats['qps_errors'] >= 8
+    assert sum(isinstance(result, dict) and result.get('error_code') == 18 for result in results) \
+        == server.stats['qps_errors']
+
+
+def test_compare():
+    baseline = {'results': {'spider': {'images_per_second': 100.0}, 'auth': {'signer': {'calls_per_second': 10.0}}}}
+    results = {'spider': {'images_per_second': 80.0}, 'auth': {'signer': {'calls_per_second': 9.5}}}
+    assert compare(results, baseline, 0.1) == {'spider.images_per_second': {'baseline': 100.0, 'current': 80.0,
+                                                                             'change': -0.2}}
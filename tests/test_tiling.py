@@ -0,0 +1,102 @@
+from ruia_ocr.imaging import EncodedImage
+from ruia_ocr.tiling import TilePolicy, Tile, plan_tiles, merge_words_results
+
+# two tiles of a 3000x400 image sharing 400px, the cut between their cores is at x=1500
+BOXES = [(0, 0, 1700, 400), (1300, 0, 3000, 400)]
+TILES = [Tile(box, EncodedImage('', 'JPEG', (box[2] - box[0], box[3] - box[1]), 0)) for box in BOXES]
+
+
+def layout(text, left, widths, top=100, height=40):
+    # the chars of a line on the image, a space only moves the next char
+    chars, x = [], left
+    for char, width in zip(text, widths):
+        if char != ' ':
+            chars.append({'char': char, 'location': {'left': x, 'top': top, 'width': width, 'height': height}})
+        x += width
+    return chars
+
+
+def seen_by(box, text, chars, with_chars=True):
+    # what the api returns for the tile: the chars whole in the tile, in the coordinates of the tile
+    x0, x1 = box[0], box[2]
+    seen = [c for c in chars if x0 <= c['location']['left'] and c['location']['left'] + c['location']['width'] <= x1]
+    if not seen:
+        return []
+    words = ''.join(c['char'] for c in seen) if ' ' not in text else _with_spaces(text, chars, seen)
+    left = seen[0]['location']['left']
+    right = seen[-1]['location']['left'] + seen[-1]['location']['width']
+    line = {'words': words, 'location': {'left': left - x0, 'top': 100, 'width': right - left, 'height': 40}}
+    if with_chars:
+        line['chars'] = [dict(c, location=dict(c['location'], left=c['location']['left'] - x0)) for c in seen]
+    return [line]
+
+
+def _with_spaces(text, chars, seen):
+    first, last = chars.index(seen[0]), chars.index(seen[-1])
+    words = text.split(' ')
+    # the text between the first and the last char seen, the words of text are runs of chars
+    out, index = [], 0
+    for word in words:
+        part = ''.join(char for i, char in enumerate(word, index) if first <= i <= last)
+        index += len(word)
+        if part:
+            out.append(part)
+    return ' '.join(out)
+
+
+def merge(text, widths, left=1000, with_chars=True):
+    chars = layout(text, left, widths)
+    results = [{'words_result': seen_by(box, text, chars, with_chars), 'log_id': 1} for box in BOXES]
+    return merge_words_results(TILES, results)['words_result']
+
+
+def test_plan_tiles_splits_the_long_edge_only():
+    policy = TilePolicy(tile_size=2048, overlap=256, max_edge=4096)
+    boxes = plan_tiles((6000, 1000), policy)
+    assert [box[1::2] for box in boxes] == [(0, 1000)] * len(boxes)
+    assert boxes[0][0] == 0 and boxes[-1][2] == 6000
+    assert all(a[2] - b[0] >= 256 for a, b in zip(boxes, boxes[1:]))
+
+
+def test_chars_join_a_cut_line():
+    text = '发票号码12345678'
+    lines = merge(text, [60, 60, 60, 60] + [25] * 8)
+    assert [line['words'] for line in lines] == [text]
+    assert lines[0]['location']['left'] == 1000
+    assert [c['char'] for c in lines[0]['chars']] == list(text)
+
+
+def test_chars_keep_the_spaces_of_a_cut_line():
+    text = 'Total amount due 1234.56 USD'
+    lines = merge(text, [40, 30, 20, 30, 20] * 5 + [30, 30, 30])
+    assert [line['words'] for line in lines] == [text]
+
+
+def test_text_overlap_joins_a_cut_line():
+    text = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    lines = merge(text, [40] * 26, with_chars=False)
+    assert [line['words'] for line in lines] == [text]
+    assert lines[0]['location']['left'] == 1000
+    assert lines[0]['location']['width'] == 26 * 40
+
+
+def test_text_mismatch_keeps_both_pieces():
+    chars = layout('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 1000, [40] * 26)
+    left, right = [seen_by(box, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', chars, False) for box in BOXES]
+    # the tiles read the chars of the overlap differently
+    right[0]['words'] = right[0]['words'].replace('Q', '0').replace('R', '8')
+    lines = merge_words_results(TILES, [{'words_result': left}, {'words_result': right}])['words_result']
+    assert [line['words'] for line in lines] == [left[0]['words'], right[0]['words']]
+
+
+def test_lines_of_the_overlap_are_kept_once():
+    # a short line within the overlap, both tiles see it whole
+    lines = merge('1234', [25] * 4, left=1550, with_chars=False)
+    assert [(line['words'], line['location']['left']) for line in lines] == [('1234', 1550)]
+    lines = merge('1234', [25] * 4, left=1450)
+    assert [(line['words'], line['location']['left']) for line in lines] == [('1234', 1450)]
+
+
+def test_an_error_of_a_tile_is_returned():
+    error = {'error_code': 17, 'error_msg': 'Open api daily request limit reached'}
+    assert merge_words_results(TILES, [{'words_result': []}, error]) == error
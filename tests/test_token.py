@@ -0,0 +1,101 @@
+import time
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from ruia_ocr.auth import AccessTokenManager, TokenStore
+from ruia_ocr.exceptions import AccessTokenError
+
+
+class TokenServer(object):
+    '''
+    Token endpoint answering tokens 1, 2, ... valid for expires_in seconds after a short delay
+    '''
+
+    def __init__(self, expires_in=2592000, error=False):
+        self.expires_in = expires_in
+        self.error = error
+        self.calls = 0
+        self.server = TestServer(self.app())
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/oauth/2.0/token', self.token)
+        return app
+
+    async def token(self, request):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.error:
+            return web.json_response({'error': 'invalid_client', 'error_description': 'unknown client id'})
+        return web.json_response({'access_token': str(self.calls), 'expires_in': self.expires_in})
+
+    @property
+    def url(self):
+        return str(self.server.make_url('/oauth/2.0/token'))
+
+    async def __aenter__(self):
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.server.close()
+
+
+def test_single_flight():
+    async def run():
+        async with TokenServer() as server:
+            manager = AccessTokenManager('api_key', 'secret_key', server.url)
+            tokens = await asyncio.gather(*(manager.get_token() for _ in range(20)))
+            assert await manager.get_token() == '1'
+            return tokens, server.calls
+
+    tokens, calls = asyncio.run(run())
+    assert set(tokens) == {'1'} and calls == 1
+
+
+def test_refresh_in_the_background():
+    async def run():
+        async with TokenServer(expires_in=3600) as server:
+            manager = AccessTokenManager('api_key', 'secret_key', server.url, refresh_before=3600)
+            assert await manager.get_token() == '1'
+            # past half of the lifetime: the current token is handed out while the next one is fetched
+            manager._refresh_at = time.time() - 1
+            assert await manager.get_token() == '1'
+            await manager._future
+            assert await manager.get_token() == '2'
+            manager.invalidate()
+            assert await manager.get_token() == '3'
+
+    asyncio.run(run())
+
+
+def test_error():
+    async def run():
+        async with TokenServer(error=True) as server:
+            await AccessTokenManager('api_key', 'secret_key', server.url).get_token()
+
+    with pytest.raises(AccessTokenError, match='unknown client id'):
+        asyncio.run(run())
+
+
+def test_store(tmp_path):
+    store = TokenStore(str(tmp_path / 'tokens.json'))
+
+    async def run():
+        async with TokenServer() as server:
+            await AccessTokenManager('api_key', 'secret_key', server.url, store=store).get_token()
+            # another process starts with the stored token
+            manager = AccessTokenManager('api_key', 'secret_key', server.url, store=store)
+            return manager.token, await manager.get_token(), server.calls
+
+    assert asyncio.run(run()) == ('1', '1', 1)
+    assert AccessTokenManager('api_key', 'other secret', store=store).token is None
+    assert oct((tmp_path / 'tokens.json').stat().st_mode & 0o777) == '0o600'
+
+
+def test_shared():
+    assert AccessTokenManager.shared('a', 'b') is AccessTokenManager.shared('a', 'b')
+    assert AccessTokenManager.shared('a', 'b') is not AccessTokenManager.shared('a', 'c')
@@ -0,0 +1,42 @@
+import os
+
+from ruia_ocr.utils import get_file_paths, iter_file_paths
+
+
+def make_tree(root):
+    names = []
+    for directory in ('', 'a', 'a/b', 'c'):
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+        for name in ('1.jpg', '2.PNG', '3.txt', '4.jpeg', '5.bmp'):
+            path = os.path.join(root, directory, name)
+            open(path, 'wb').close()
+            names.append(os.path.abspath(path))
+    return names
+
+
+def test_iter_file_paths_filters_images(tmp_path):
+    names = make_tree(str(tmp_path))
+    paths = list(iter_file_paths(str(tmp_path)))
+    assert sorted(paths) == sorted(name for name in names if not name.endswith('.txt'))
+    assert all(os.path.isabs(path) for path in paths)
+
+
+def test_iter_file_paths_stops_at_num(tmp_path):
+    make_tree(str(tmp_path))
+    paths = iter_file_paths(str(tmp_path), num=3)
+    assert len(list(paths)) == 3
+    assert len(list(iter_file_paths(str(tmp_path), lambda name: name.startswith('1'), num=100))) == 4
+
+
+def test_iter_file_paths_parallel(tmp_path):
+    names = make_tree(str(tmp_path))
+    expected = sorted(name for name in names if not name.endswith('.txt'))
+    assert sorted(iter_file_paths(str(tmp_path), workers=3)) == expected
+    assert len(list(iter_file_paths(str(tmp_path), num=5, workers=3))) == 5
+
+
+def test_get_file_paths_keeps_every_file(tmp_path):
+    names = make_tree(str(tmp_path))
+    assert sorted(get_file_paths(str(tmp_path))) == sorted(names)
+    base_names = get_file_paths(str(tmp_path), num=2, base_name=True)
+    assert len(base_names) == 2 and set(base_names) <= {'1.jpg', '2.PNG', '3.txt', '4.jpeg', '5.bmp'}